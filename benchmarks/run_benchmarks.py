@@ -0,0 +1,178 @@
+#    Copyright (C) 2021 David J. Wooten
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmarks for the model kernels and the demo refresh path
+
+Times the Demo model methods (_MuSyC_E, _bliss, _loewe, _loewe_log and
+_hill_inv), figure construction (get_plot, get_fig_widget) and a headless
+refresh of each Demo subclass, on square dose grids and in the parameter
+regimes set by the reset_to_* buttons, with the compute backend chosen by
+--backend. Results are written as JSON, so runs from two commits can
+be compared with --compare.
+
+    python benchmarks/run_benchmarks.py -o before.json
+    python benchmarks/run_benchmarks.py -o after.json --compare before.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import synergy_demo_backend as backend
+import synergy_numba
+
+# Doses per axis, including dose 0
+GRID_SIZES = (31, 100, 316, 1000)
+QUICK_GRID_SIZES = (31, 100)
+REGIMES = ("default", "bliss", "loewe", "musyc")
+DEMOS = ("MuSyC_Demo", "MuSyC_Bliss_Demo", "MuSyC_Loewe_Demo", "All_Demo")
+
+def timeit(f, repeat, min_time=0.2):
+    """
+    Calls f repeat times, or more until min_time seconds have passed (at most
+    100 calls), and returns the times of each call in seconds
+    """
+    times = []
+    start = time.perf_counter()
+    while len(times) < repeat or (time.perf_counter() - start < min_time and len(times) < 100):
+        t = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - t)
+    return times
+
+def summarize(name, times, **labels):
+    times = np.array(times)
+    return dict(name=name, labels=labels, n=len(times), min=times.min(), median=np.median(times),
+        mean=times.mean(), max=times.max())
+
+def regime_demo(regime, demo="All_Demo", **kwargs):
+    """
+    Demo with its sliders in the given reset_to_* regime
+    """
+    demo = getattr(backend, demo)(cache=False, **kwargs)
+    getattr(demo, "reset_to_%s"%regime)(0)
+    return demo
+
+def bench_kernels(sizes, repeat, compute_backend="numpy"):
+    results = []
+    for regime in REGIMES:
+        demo = regime_demo(regime, backend=compute_backend)
+        E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21 = demo.get_parameters()
+        for size in sizes:
+            grid = backend.DoseGrid.log_spaced(size-1)
+            d1, d2 = grid.d1, grid.d2
+            labels = dict(regime=regime, grid="%dx%d"%grid.shape)
+            E = demo._MuSyC_E(d1, d2, E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21)
+            results.append(summarize("_MuSyC_E", timeit(lambda: demo._MuSyC_E(d1, d2, E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21), repeat), **labels))
+            results.append(summarize("_bliss", timeit(lambda: demo._bliss(d1, d2, E, E0, E1, E2, h1, h2, C1, C2), repeat), **labels))
+            with np.errstate(divide="ignore", invalid="ignore"):
+                results.append(summarize("_loewe", timeit(lambda: demo._loewe(d1, d2, E, E0, E1, E2, h1, h2, C1, C2), repeat), **labels))
+                results.append(summarize("_loewe_log", timeit(lambda: demo._loewe_log(d1, d2, E, E0, E1, E2, h1, h2, C1, C2), repeat), **labels))
+                results.append(summarize("_hill_inv", timeit(lambda: demo._hill_inv(E, E0, E1, h1, C1), repeat), **labels))
+    return results
+
+def bench_figures(sizes, repeat, compute_backend="numpy"):
+    results = []
+    demo = regime_demo("default", backend=compute_backend)
+    for size in sizes:
+        grid = backend.DoseGrid.log_spaced(size-1)
+        E = demo.current_surfaces(grid)["E"]
+        labels = dict(grid="%dx%d"%grid.shape)
+        results.append(summarize("get_plot", timeit(lambda: demo.get_plot(grid, E), repeat), **labels))
+        results.append(summarize("get_fig_widget", timeit(lambda: demo.get_fig_widget(grid, E, "Dose Response"), repeat), **labels))
+    return results
+
+def bench_refresh(sizes, repeat, compute_backend="numpy"):
+    """
+    Headless refresh cycles (compute and push to the figures), alternating
+    between two slider values so every refresh changes the surfaces
+    """
+    results = []
+    for name in DEMOS:
+        for size in sizes:
+            for regime in REGIMES:
+                demo = regime_demo(regime, name, n_doses=size-1, backend=compute_backend)
+                slider = demo.gamma12_slider
+                values = [slider.value, slider.value + slider.step]
+                def refresh():
+                    demo.paused = True
+                    slider.value = values[1] if slider.value == values[0] else values[0]
+                    demo.paused = False
+                    demo.refresh(0)
+                results.append(summarize("refresh", timeit(refresh, repeat), demo=name, regime=regime, grid="%dx%d"%demo.grid.shape))
+    return results
+
+def environment():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    numba = synergy_numba.numba.__version__ if synergy_numba.available else None
+    return dict(commit=commit, python=platform.python_version(), numpy=np.__version__, numba=numba,
+        platform=platform.platform(), processor=platform.processor(), time=time.strftime("%Y-%m-%dT%H:%M:%S"))
+
+def compare(results, baseline):
+    """
+    Prints the ratio of each median time to the median for the same benchmark
+    in baseline (> 1 is slower)
+    """
+    key = lambda r: (r["name"], tuple(sorted(r["labels"].items())))
+    old = dict((key(r), r["median"]) for r in baseline["results"])
+    for r in results["results"]:
+        if key(r) not in old: continue
+        labels = " ".join("%s=%s"%kv for kv in sorted(r["labels"].items()))
+        print("%-16s %-48s %10.3g s  %6.2fx"%(r["name"], labels, r["median"], r["median"]/old[key(r)]))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("-o", "--output", help="JSON file to write (default: stdout)")
+    parser.add_argument("--quick", action="store_true", help="only the smaller grids, for a fast check")
+    parser.add_argument("--sizes", type=int, nargs="+", help="doses per axis, including 0 (default: %s)"%(GRID_SIZES,))
+    parser.add_argument("--repeat", type=int, default=5, help="minimum timed calls per benchmark")
+    parser.add_argument("--only", nargs="+", choices=("kernels", "figures", "refresh"), default=("kernels", "figures", "refresh"))
+    parser.add_argument("--backend", choices=synergy_numba.BACKENDS, default="numpy", help="compute backend of the demos")
+    parser.add_argument("--compare", help="JSON file from an earlier run to compare against")
+    args = parser.parse_args(argv)
+
+    sizes = args.sizes or (QUICK_GRID_SIZES if args.quick else GRID_SIZES)
+    benchmarks = dict(kernels=bench_kernels, figures=bench_figures, refresh=bench_refresh)
+    results = []
+    for name in args.only:
+        results.extend(benchmarks[name](sizes, args.repeat, args.backend))
+    compute_backend = synergy_numba.get_backend(args.backend).__name__
+    results = dict(environment=environment(), backend=compute_backend, sizes=list(sizes), repeat=args.repeat, results=results)
+
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=1)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+#    Copyright (C) 2021 David J. Wooten
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Surface computation shared by many demo sessions
+
+When many users run the demo on one machine, each kernel would compute (and
+cache) the same surfaces. A ComputeService computes them in one process pool
+instead, keeps one cache for every session, and computes a surface that
+several sessions ask for at the same time only once. Start it with
+
+    python compute_service.py --port 50000 --processes 4
+
+and create demos with compute_service="localhost:50000". Sessions talk to the
+service over a multiprocessing manager socket, authenticated with authkey.
+The key is taken from the MUSYC_COMPUTE_SERVICE_KEY environment variable if
+that is set. Otherwise the service makes a random one and writes it to a file
+only its user can read (by default ~/.musyc_compute_service_key), which
+connect reads from; sessions of other users must be given the key.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.managers import BaseManager
+import os
+import secrets
+import signal
+import sys
+import threading
+
+import numpy as np
+
+from surface_cache import SurfaceCache
+import synergy_models as models
+
+DEFAULT_ADDRESS = ("localhost", 50000)
+DEFAULT_AUTHKEY_FILE = os.path.join(os.path.expanduser("~"), ".musyc_compute_service_key")
+# Environment variable holding the authkey, for keys shared between users
+AUTHKEY_ENV = "MUSYC_COMPUTE_SERVICE_KEY"
+
+def _compute(d1, d2, parameters, surface_names, dtype, backend):
+    from synergy_demo_backend import compute_surfaces
+    if backend == "numpy":
+        backend = models
+    else:
+        import synergy_numba
+        backend = synergy_numba.get_backend(backend)
+    return compute_surfaces(d1, d2, parameters, surface_names, dtype=dtype, backend=backend)
+
+class ComputeService:
+    """
+    Computes demo surfaces in a process pool, with a cache shared by every
+    caller and one computation per distinct request in flight
+
+    surfaces() may be called from many threads (the manager server runs each
+    connection in its own thread). Callers asking for surfaces that are
+    already being computed wait for that computation rather than starting
+    another.
+    """
+    def __init__(self, processes=None, cache=None, backend="numpy"):
+        self.cache = SurfaceCache(max_bytes=2**29) if cache is None else cache
+        self.backend = backend
+        self.requests = 0
+        self.computed = 0
+        self.deduplicated = 0
+        self._pool = ProcessPoolExecutor(processes)
+        self._in_flight = dict()
+        self._lock = threading.Lock()
+
+    def surfaces(self, d1, d2, parameters, surface_names, dtype="<f8"):
+        """
+        Dict of the named surfaces (see synergy_demo_backend.compute_surfaces)
+        at the doses d1 and d2, computed in dtype (a numpy dtype string)
+        """
+        d1 = np.asarray(d1, dtype=float)
+        d2 = np.asarray(d2, dtype=float)
+        key = self.cache.key(parameters, fingerprint=(self.cache.grid_fingerprint(d1, d2), dtype), names=surface_names)
+        with self._lock:
+            self.requests += 1
+            surfaces = self.cache.get(key)
+            if surfaces is not None:
+                return surfaces
+            future = self._in_flight.get(key)
+            started = future is None
+            if started:
+                self.computed += 1
+                future = self._pool.submit(_compute, d1, d2, tuple(parameters), tuple(surface_names), dtype, self.backend)
+                self._in_flight[key] = future
+            else:
+                self.deduplicated += 1
+        if started:
+            # Outside the lock, as the callback runs here if it is already done
+            future.add_done_callback(lambda f: self._finish(key, f))
+        return future.result()
+
+    def _finish(self, key, future):
+        with self._lock:
+            if future.exception() is None:
+                self.cache.put(key, future.result())
+            del self._in_flight[key]
+
+    def stats(self):
+        with self._lock:
+            return dict(requests=self.requests, computed=self.computed, deduplicated=self.deduplicated,
+                in_flight=len(self._in_flight), cache=self.cache.stats())
+
+    def shutdown(self):
+        self._pool.shutdown()
+
+class _ServerManager(BaseManager):
+    pass
+
+class _ClientManager(BaseManager):
+    pass
+
+_ClientManager.register("service")
+
+def _address(address):
+    if isinstance(address, str):
+        host, port = address.rsplit(":", 1)
+        return host, int(port)
+    return tuple(address)
+
+def write_authkey(path=DEFAULT_AUTHKEY_FILE):
+    """
+    Writes a new random authkey to path, readable only by its owner, and
+    returns it
+
+    The key is written to a new file beside path, which is then renamed to
+    path, so an existing file or symlink at path is replaced rather than
+    written through.
+    """
+    authkey = secrets.token_hex(32).encode()
+    temp = "%s.%s"%(path, secrets.token_hex(8))
+    fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, 0o600)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(authkey)
+        os.replace(temp, path)
+    except BaseException:
+        os.unlink(temp)
+        raise
+    return authkey
+
+def read_authkey(path=DEFAULT_AUTHKEY_FILE):
+    if not os.path.exists(path):
+        raise ValueError("No authkey file at %s: start the service, or pass its authkey"%path)
+    with open(path, "rb") as f:
+        return f.read().strip()
+
+def _environment_authkey():
+    authkey = os.environ.get(AUTHKEY_ENV)
+    return None if not authkey else authkey.encode()
+
+def serve(address=DEFAULT_ADDRESS, authkey=None, processes=None, cache_bytes=2**29, backend="numpy", authkey_file=DEFAULT_AUTHKEY_FILE):
+    """
+    Runs a ComputeService at address ("host:port" or (host, port)) until
+    interrupted. Without an authkey, the one in the MUSYC_COMPUTE_SERVICE_KEY
+    environment variable is used, or else a random one is written to
+    authkey_file (see write_authkey).
+    """
+    if authkey is None:
+        authkey = _environment_authkey()
+    if authkey is None:
+        authkey = write_authkey(authkey_file)
+    service = ComputeService(processes, cache=SurfaceCache(max_bytes=cache_bytes), backend=backend)
+    _ServerManager.register("service", callable=lambda: service)
+    server = _ServerManager(address=_address(address), authkey=authkey).get_server()
+    # The pool's workers inherit the listening socket, so they must be shut
+    # down on SIGTERM as well or the port stays in use
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    finally:
+        service.shutdown()
+
+def connect(address=DEFAULT_ADDRESS, authkey=None, authkey_file=DEFAULT_AUTHKEY_FILE):
+    """
+    Proxy to the ComputeService at address, with its surfaces() and stats().
+    Without an authkey, the one in the MUSYC_COMPUTE_SERVICE_KEY environment
+    variable is used, or else the one the service wrote to authkey_file.
+    """
+    if authkey is None:
+        authkey = _environment_authkey()
+    if authkey is None:
+        authkey = read_authkey(authkey_file)
+    manager = _ClientManager(address=_address(address), authkey=authkey)
+    manager.connect()
+    return manager.service()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--host", default=DEFAULT_ADDRESS[0])
+    parser.add_argument("--port", type=int, default=DEFAULT_ADDRESS[1])
+    parser.add_argument("--authkey-file", default=DEFAULT_AUTHKEY_FILE,
+        help="file a random authkey is written to, unless %s is set"%AUTHKEY_ENV)
+    parser.add_argument("--processes", type=int, help="worker processes (default: one per CPU)")
+    parser.add_argument("--cache-mb", type=int, default=512, help="size of the shared surface cache")
+    parser.add_argument("--backend", choices=("auto", "numpy", "numba"), default="numpy")
+    args = parser.parse_args(argv)
+    serve((args.host, args.port), processes=args.processes,
+        cache_bytes=args.cache_mb*2**20, backend=args.backend, authkey_file=args.authkey_file)
+
+if __name__ == "__main__":
+    main()
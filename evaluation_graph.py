@@ -0,0 +1,100 @@
+#    Copyright (C) 2021 David J. Wooten
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Incremental evaluation of functions of named parameters and of each other
+
+Moving one slider changes only a few of the MuSyC parameters, and most of the
+work behind the surfaces depends on only some of them (e.g. the state
+occupancies do not depend on E0..E3). An EvaluationGraph keeps the last value
+of each node and recomputes only the nodes whose parameters, or upstream
+nodes, have changed since.
+"""
+
+from collections import Counter, OrderedDict
+from contextlib import nullcontext
+import threading
+
+class EvaluationGraph:
+    """
+    Nodes are functions whose arguments are parameters or other nodes, by name
+
+    Nodes must be added after the nodes they depend on. Any input that is not
+    a node is a parameter, looked up in the dict given to evaluate. evaluations
+    counts how many times each node has been computed.
+    """
+    def __init__(self):
+        self._nodes = OrderedDict()
+        self._values = dict()
+        self._inputs_seen = dict()
+        self._versions = dict()
+        self.evaluations = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, name, function, inputs):
+        if name in self._nodes:
+            raise ValueError("Node %r already exists"%name)
+        self._nodes[name] = (function, tuple(inputs))
+        return self
+
+    def _needed(self, names):
+        needed = set()
+        stack = list(names)
+        while stack:
+            name = stack.pop()
+            if name in needed: continue
+            if name not in self._nodes:
+                raise KeyError("Unknown node %r"%name)
+            needed.add(name)
+            stack.extend(i for i in self._nodes[name][1] if i in self._nodes)
+        return needed
+
+    def evaluate(self, parameters, names=None, stage=None):
+        """
+        Dict of the values of the named nodes (by default, all of them) for the
+        dict of parameters, recomputing only the stale nodes they depend on
+
+        stage, if given, is called with the name of each node that is
+        recomputed and returns a context manager around it.
+        """
+        if names is None:
+            names = list(self._nodes)
+        if stage is None:
+            stage = lambda name: nullcontext()
+        with self._lock:
+            needed = self._needed(names)
+            for name, (function, inputs) in self._nodes.items():
+                if name not in needed: continue
+                # Nodes are compared by version and parameters by value
+                seen = tuple(("node", self._versions[i]) if i in self._nodes else parameters[i] for i in inputs)
+                if self._inputs_seen.get(name) == seen: continue
+                with stage(name):
+                    self._values[name] = function(*[self._values[i] if i in self._nodes else parameters[i] for i in inputs])
+                self._inputs_seen[name] = seen
+                self._versions[name] = self._versions.get(name, 0) + 1
+                self.evaluations[name] += 1
+            return OrderedDict((name, self._values[name]) for name in names)
+
+    def clear(self):
+        """
+        Drops every cached value, so the next evaluate recomputes everything
+        """
+        with self._lock:
+            self._values.clear()
+            self._inputs_seen.clear()
+            self._versions.clear()
+
+    def __contains__(self, name):
+        return name in self._nodes
@@ -0,0 +1,141 @@
+#    Copyright (C) 2021 David J. Wooten
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Per-stage timings of demo refreshes
+
+A Demo created with profile=True times each stage of every refresh (looking
+up or computing the surfaces, the MuSyC, Bliss and Loewe surfaces, and
+sending them to the figures) and keeps the last few hundred refreshes, so
+the slow stage of a live session can be found without attaching a profiler.
+"""
+
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+class RefreshProfiler:
+    """
+    Rolling record of how long each stage of a refresh took
+
+    Each refresh is a dict of stage name to seconds, plus "total", the time
+    from begin() to finish(). The last window refreshes are kept. With
+    trace_allocations, tracemalloc also records the peak bytes allocated in
+    each stage (as "<stage> bytes"), at some cost in speed. Callbacks added
+    with add_callback are called with each finished refresh.
+
+    A refresh is begun and its surfaces computed on the scheduler's worker
+    thread, then sent and finished on the event loop, so the refresh being
+    recorded is only read and replaced under a lock.
+    """
+    def __init__(self, window=200, trace_allocations=False):
+        self.window = window
+        self.trace_allocations = trace_allocations
+        self.refreshes = deque(maxlen=window)
+        self.callbacks = []
+        self._current = None
+        self._start = None
+        self._lock = threading.Lock()
+
+    def begin(self):
+        """
+        Starts recording a refresh, dropping any that was not finished
+        """
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        with self._lock:
+            self._current = OrderedDict()
+            self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        with self._lock:
+            record = self._current
+        if record is None:
+            yield
+            return
+        if self.trace_allocations:
+            start_bytes = tracemalloc.get_traced_memory()[0]
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - t
+            if self.trace_allocations:
+                current, peak = tracemalloc.get_traced_memory()
+            with self._lock:
+                record[name] = record.get(name, 0.) + elapsed
+                if self.trace_allocations:
+                    record[name + " bytes"] = max(peak, current) - start_bytes
+
+    def finish(self):
+        """
+        Ends the current refresh and hands it to the callbacks
+        """
+        with self._lock:
+            record = self._current
+            if record is None: return
+            record["total"] = time.perf_counter() - self._start
+            self._current = None
+            self.refreshes.append(record)
+        for callback in self.callbacks:
+            callback(record)
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def percentiles(self, q=(50, 90, 99)):
+        """
+        Dict of stage name to the q-th percentiles of its times (in seconds)
+        over the refreshes that include that stage
+        """
+        stages = OrderedDict()
+        for record in self.refreshes:
+            for name, value in record.items():
+                stages.setdefault(name, []).append(value)
+        return OrderedDict((name, np.percentile(values, q)) for name, values in stages.items())
+
+    def summary(self, q=(50, 90, 99)):
+        """
+        Text table of the percentiles of each stage in milliseconds
+        """
+        lines = ["%-18s" % "stage" + "".join("%10s" % ("p%g" % p) for p in q)]
+        for name, values in self.percentiles(q).items():
+            if name.endswith(" bytes"):
+                lines.append("%-18s" % name + "".join("%10s" % ("%.3gM" % (v/2**20)) for v in values))
+            else:
+                lines.append("%-18s" % name + "".join("%10.2f" % (1000*v) for v in values))
+        lines.append("%d refreshes" % len(self.refreshes))
+        return "\n".join(lines)
+
+    def widget(self, q=(50, 90, 99)):
+        """
+        An ipywidgets HTML widget showing summary(q), updated after every refresh
+        """
+        from ipywidgets import widgets
+        html = widgets.HTML(value="<pre>%s</pre>" % self.summary(q))
+        def update(record):
+            html.value = "<pre>%s</pre>" % self.summary(q)
+        self.add_callback(update)
+        return html
+
+    def clear(self):
+        self.refreshes.clear()
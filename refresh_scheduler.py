@@ -0,0 +1,120 @@
+#    Copyright (C) 2021 David J. Wooten
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Coalescing scheduler for slider-driven refreshes
+
+Dragging a continuous slider fires a refresh for every intermediate value. The
+scheduler keeps only the newest requested state, computes it on a worker
+thread, and pushes the result back on the event loop only if no newer state
+was requested in the meantime.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+def _running_loop():
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+class RefreshScheduler:
+    """
+    Runs compute(state) off the event loop and push(result) on it
+
+    States submitted while a computation is running replace each other, so at
+    most one state waits at a time. If submit is called outside of a running
+    event loop (e.g. from a script), the state is computed and pushed
+    immediately, and errors in either are raised from submit.
+
+    On the event loop there is no caller to raise to, so an error in compute
+    or push is passed to on_error(error, state) instead, or by default to the
+    loop's exception handler, and kept in self.error. The scheduler then goes
+    on with the newest pending state.
+    """
+    def __init__(self, compute, push, delay=0., on_error=None):
+        self.compute = compute
+        self.push = push
+        self.delay = delay
+        self.on_error = on_error
+        self.submitted = 0
+        self.computed = 0
+        self.pushed = 0
+        self.failed = 0
+        self.error = None
+        self._pending = None
+        self._generation = 0
+        self._running = False
+        self._scheduled = False
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def submit(self, state):
+        self.submitted += 1
+        self._generation += 1
+        self._pending = state
+        loop = _running_loop()
+        if loop is None:
+            self._pending = None
+            self.computed += 1
+            self.pushed += 1
+            self.push(self.compute(state))
+            return
+        if not (self._running or self._scheduled):
+            self._scheduled = True
+            loop.call_later(self.delay, self._start, loop)
+
+    def _start(self, loop):
+        self._scheduled = False
+        if self._running or self._pending is None: return
+        state, generation = self._pending, self._generation
+        self._pending = None
+        self._running = True
+        future = loop.run_in_executor(self._executor, self.compute, state)
+        future.add_done_callback(lambda f: self._finish(f, state, generation, loop))
+
+    def _finish(self, future, state, generation, loop):
+        self._running = False
+        self.computed += 1
+        stale = generation != self._generation
+        try:
+            result = future.result()
+            if not stale:
+                self.pushed += 1
+                self.push(result)
+        except Exception as error:
+            self._report(error, state, loop)
+        if stale and self._pending is not None:
+            # The result is stale, so drop it and start on the newest state
+            self._start(loop)
+
+    def _report(self, error, state, loop):
+        self.failed += 1
+        self.error = error
+        if self.on_error is not None:
+            self.on_error(error, state)
+        else:
+            loop.call_exception_handler(dict(message="RefreshScheduler failed to refresh %r"%(state,), exception=error))
+
+    @property
+    def generation(self):
+        """
+        Number of states submitted so far, to tell whether one is still newest
+        """
+        return self._generation
+
+    @property
+    def idle(self):
+        return not (self._running or self._scheduled or self._pending is not None)
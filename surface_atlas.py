@@ -0,0 +1,169 @@
+#    Copyright (C) 2021 David J. Wooten
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Precomputed surfaces over a grid of slider values, stored on disk
+
+An atlas is a directory holding
+    surfaces.npy - array of shape (n_states, n_surfaces, n_doses)
+    grid.npz     - the dose arrays d1 and d2 the surfaces were computed on
+    index.json   - the slider values along each axis, surface names, E0 and
+                   the dtype of the surfaces
+States are the Cartesian product of the axes, in C order. surfaces.npy is
+opened memory-mapped, so lookups are views into the file. index.json is
+written last, so a directory without one is not a finished atlas.
+"""
+
+import itertools
+import json
+import os
+import shutil
+
+import numpy as np
+
+import synergy_models as models
+
+# Slider values of the default demos, used for sliders that are not atlas axes
+DEFAULT_SLIDER_VALUES = dict(E1=0.4, E2=0.5, h1=np.log10(2), h2=np.log10(0.5), C1=0., C2=0.,
+    alpha12=0., alpha21=0., gamma12=0., gamma21=0., beta=0.)
+
+def build_atlas(path, d1, d2, axes, E0=1, fixed=None, surface_names=("E", "bliss", "loewe"), dtype=np.float64, max_memory=2**27):
+    """
+    Evaluates the surfaces at every combination of slider values in axes
+
+    axes maps slider names to the values to include, or to True for all values
+    the slider can take. Sliders not in axes are held at fixed[name], or else at
+    DEFAULT_SLIDER_VALUES[name]. The atlas is built in a temporary directory
+    beside path and moved to path once it is complete, replacing any atlas
+    already there. The finished atlas is returned.
+    """
+    d1 = np.asarray(d1, dtype=float).flatten()
+    d2 = np.asarray(d2, dtype=float).flatten()
+    fixed = dict(DEFAULT_SLIDER_VALUES, **(fixed or dict()))
+    atlas_axes = []
+    for name in models.SLIDER_RANGES:
+        values = axes.get(name, [fixed[name]])
+        if values is True:
+            values = models.slider_lattice(name)
+        atlas_axes.append((name, [float(v) for v in np.atleast_1d(values)]))
+
+    path = os.path.normpath(path)
+    building = "%s.building.%d" % (path, os.getpid())
+    shutil.rmtree(building, ignore_errors=True)
+    os.mkdir(building)
+    try:
+        _write_atlas(building, d1, d2, atlas_axes, E0, surface_names, dtype, max_memory)
+        if os.path.exists(path):
+            # os.replace cannot overwrite a non-empty directory
+            old = "%s.old.%d" % (path, os.getpid())
+            os.replace(path, old)
+            os.replace(building, path)
+            shutil.rmtree(old)
+        else:
+            os.replace(building, path)
+    except BaseException:
+        shutil.rmtree(building, ignore_errors=True)
+        raise
+    return SurfaceAtlas(path)
+
+def _write_atlas(path, d1, d2, atlas_axes, E0, surface_names, dtype, max_memory):
+    """
+    Writes the atlas files of build_atlas into the existing directory path
+    """
+    np.savez(os.path.join(path, "grid.npz"), d1=d1, d2=d2)
+    shape = tuple(len(values) for name, values in atlas_axes)
+    n_states = int(np.prod(shape))
+    surfaces = np.lib.format.open_memmap(os.path.join(path, "surfaces.npy"), mode="w+",
+        dtype=dtype, shape=(n_states, len(surface_names), len(d1)))
+
+    chunk = max(1, int(max_memory // (24*8*len(d1))))
+    states = itertools.product(*[values for name, values in atlas_axes])
+    for start in range(0, n_states, chunk):
+        values = np.array(list(itertools.islice(states, chunk)))
+        sliders = dict((name, values[:,i]) for i, (name, _) in enumerate(atlas_axes))
+        E0_, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21 = models.parameters_from_sliders(E0, **sliders)
+        E = models.MuSyC_E_batch(d1, d2, E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21, max_memory=max_memory)
+        block = dict()
+        if "bliss" in surface_names:
+            block["bliss"] = models.bliss_batch(d1, d2, E, E0, E1, E2, h1, h2, C1, C2, max_memory=max_memory)
+        if "loewe" in surface_names:
+            block["loewe"] = models.loewe_batch(d1, d2, E, E0, E1, E2, h1, h2, C1, C2, max_memory=max_memory)
+        E[np.isnan(E)] = 0
+        block["E"] = E
+        for k, name in enumerate(surface_names):
+            surfaces[start:start+len(values), k] = block[name]
+    surfaces.flush()
+    del surfaces
+    with open(os.path.join(path, "index.json"), "w") as f:
+        json.dump(dict(axes=atlas_axes, surface_names=list(surface_names), E0=E0, dtype=np.dtype(dtype).name), f)
+
+class SurfaceAtlas:
+    """
+    Read-only view of an atlas written by build_atlas
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "index.json")) as f:
+            index = json.load(f)
+        self.axes = [(name, np.array(values)) for name, values in index["axes"]]
+        self.surface_names = tuple(index["surface_names"])
+        self.E0 = index["E0"]
+        self.dtype = np.dtype(index["dtype"])
+        grid = np.load(os.path.join(path, "grid.npz"))
+        self.d1 = grid["d1"]
+        self.d2 = grid["d2"]
+        self.surfaces = np.load(os.path.join(path, "surfaces.npy"), mmap_mode="r")
+        self.shape = tuple(len(values) for name, values in self.axes)
+        self.hits = 0
+        self.misses = 0
+
+    def matches_grid(self, d1, d2, dtype=None):
+        """
+        Whether the atlas was computed on the doses d1, d2 (and in dtype, if
+        given)
+        """
+        d1 = np.asarray(d1).flatten()
+        d2 = np.asarray(d2).flatten()
+        if dtype is not None and np.dtype(dtype) != self.dtype:
+            return False
+        return d1.shape == self.d1.shape and np.allclose(d1, self.d1) and np.allclose(d2, self.d2)
+
+    def state_index(self, slider_values):
+        """
+        Position of slider_values (a dict by slider name) in the atlas, or None
+        """
+        index = []
+        for name, values in self.axes:
+            i = np.flatnonzero(np.abs(values - slider_values[name]) < 1e-6)
+            if len(i) == 0: return None
+            index.append(i[0])
+        return int(np.ravel_multi_index(index, self.shape))
+
+    def lookup(self, slider_values, names=None):
+        """
+        Dict of surfaces (views into the atlas file) at slider_values, or None
+        if that state, or one of the named surfaces, is not in the atlas
+        """
+        if names is None:
+            names = self.surface_names
+        state = self.state_index(slider_values)
+        if state is None or any(name not in self.surface_names for name in names):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return dict((name, self.surfaces[state, self.surface_names.index(name)]) for name in names)
+
+    def __len__(self):
+        return self.surfaces.shape[0]
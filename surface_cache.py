@@ -0,0 +1,109 @@
+#    Copyright (C) 2021 David J. Wooten
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Bounded LRU cache for computed synergy surfaces
+
+The demo sliders move in fixed steps, so users revisit the same parameter sets
+over and over. Surfaces are cached under the parameter tuple (rounded to strip
+floating point noise from 10**slider), a fingerprint of the dose grid and the
+names of the surfaces.
+"""
+
+from collections import OrderedDict
+import hashlib
+import threading
+
+import numpy as np
+
+class SurfaceCache:
+    """
+    LRU cache of dicts of surfaces, holding at most max_bytes of arrays
+
+    Cached arrays are made read-only, since the same arrays are handed to every
+    caller that hits the entry.
+    """
+    def __init__(self, max_bytes=2**27, significant_digits=12):
+        self.max_bytes = max_bytes
+        self.significant_digits = significant_digits
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def grid_fingerprint(d1, d2):
+        h = hashlib.blake2b(digest_size=16)
+        for d in (d1, d2):
+            d = np.ascontiguousarray(d, dtype=float)
+            h.update(str(d.shape).encode())
+            h.update(d.tobytes())
+        return h.hexdigest()
+
+    def key(self, parameters, d1=None, d2=None, names=(), fingerprint=None):
+        """
+        Cache key for surfaces on the dose grid (d1, d2), which can be given by
+        its grid_fingerprint instead
+        """
+        if fingerprint is None:
+            fingerprint = self.grid_fingerprint(d1, d2)
+        fmt = "%%.%dg"%self.significant_digits
+        parameters = tuple(float(fmt%p) for p in parameters)
+        return parameters, fingerprint, tuple(names)
+
+    def get(self, key):
+        with self._lock:
+            surfaces = self._entries.get(key)
+            if surfaces is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return surfaces
+
+    def put(self, key, surfaces):
+        nbytes = sum(np.asarray(s).nbytes for s in surfaces.values())
+        if nbytes > self.max_bytes: return
+        for s in surfaces.values():
+            if isinstance(s, np.ndarray): s.setflags(write=False)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= sum(np.asarray(s).nbytes for s in old.values())
+            self._entries[key] = surfaces
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= sum(np.asarray(s).nbytes for s in evicted.values())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, entries=len(self._entries), nbytes=self.nbytes, max_bytes=self.max_bytes)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+# Shared by every Demo in the kernel unless they are given their own cache
+shared_cache = SurfaceCache()
@@ -14,160 +14,313 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from abc import ABC, abstractmethod
+from contextlib import ExitStack, nullcontext
+import json
+import os
 
-from ipywidgets import widgets
-import plotly.graph_objects as go
 import numpy as np
 
+import synergy_models as models
+from synergy_models import MuSyC_E_batch, bliss_batch, loewe_batch
+from surface_cache import SurfaceCache, shared_cache
+from surface_atlas import SurfaceAtlas, build_atlas
+from refresh_scheduler import RefreshScheduler, _running_loop
+from refresh_profiler import RefreshProfiler
+from evaluation_graph import EvaluationGraph
+from synergy_landscape import landscape, SUMMARIES, SIGNED_SUMMARIES
+from synergy_isoboles import isoboles, effect_levels, contour_figure
+
+def _log_doses(d):
+    """
+    log10 of doses for plotting, with dose 0 drawn a decade below the lowest dose
+    """
+    d = np.array(d, dtype=float)
+    d[d==0] = np.min(d[d>0])/10
+    return np.log10(d)
+
+# Settings shared by every surface trace and figure, whether a live widget or
+# a static export (see synergy_render)
+SURFACE_STYLE = dict(
+    opacity=0.8,
+    contours_z=dict(
+        show=True,
+        usecolormap=True,
+        highlightcolor="limegreen",
+        project_z=False
+    ),
+    reversescale=False,
+    colorbar=dict(
+        lenmode='fraction',
+        len=0.65,
+        thickness=15
+        ),
+    connectgaps=False
+    )
+
+FIGURE_STYLE = dict(
+    autosize=False,
+    scene_camera_eye=dict(
+        x=1.02,
+        y=2.15,
+        z=1.48
+    ),
+    hovermode=False,
+    margin=dict(
+        l=10,
+        r=10,
+        b=10,
+        t=30
+    ),
+    scene=dict(
+        xaxis_title="Drug 1",
+        yaxis_title="Drug 2",
+        aspectmode="cube"
+    ),
+    font=dict(
+        size=10
+    )
+    )
+
+# Title, axis and color settings of the figure for each surface
+SURFACE_PANELS = dict(
+    E=dict(title="Dose Response", z_title="E (MuSyC)"),
+    bliss=dict(title="Bliss Excess", zlim=(-0.5,0.5), clim=(-0.5,0.5), center_on_zero=True, cmap="PRGn", z_title="Bliss Excess"),
+    loewe=dict(title="Loewe Synergy", zlim=(-3,3), clim=(-3,3), center_on_zero=True, cmap="PRGn", z_title="-log(loewe)"),
+    )
+
+def surface_trace(grid, E, cmap='viridis', clim=None, center_on_zero=False, styled=True):
+    """
+    Properties of the surface trace of E (in the layout of the DoseGrid grid)
+    over log doses. Without styled, SURFACE_STYLE is left out.
+    """
+    if clim is None:
+        if center_on_zero:
+            cmin, cmax = -0.4,0.4
+        else:
+            cmin, cmax = 0,1
+    else:
+        cmin, cmax = clim
+
+    trace = dict(
+        x=grid.log_d1,
+        y=grid.log_d2,
+        z=np.asarray(E, dtype=np.float32).reshape(grid.shape),
+        cmin=cmin,
+        cmax=cmax,
+        colorscale=cmap,
+        )
+    if styled:
+        trace.update(SURFACE_STYLE)
+    return trace
+
+def figure_layout(grid, title, zlim=(0,1.1), width=800, height=600, center_on_zero=False, z_title=None, styled=True):
+    """
+    Layout of the figure of a surface on the DoseGrid grid. Without styled,
+    FIGURE_STYLE is left out.
+    """
+    if z_title is None:
+        if center_on_zero:
+            z_title = ""
+        else:
+            z_title="E"
+    layout = dict(
+        title=title,
+        width=width,
+        height=height,
+        scene=dict(
+            zaxis_title=z_title,
+            zaxis=dict(range=zlim),
+            xaxis=dict(range=(float(grid.log_d1.min()), float(grid.log_d1.max()))),
+            yaxis=dict(range=(float(grid.log_d2.min()), float(grid.log_d2.max()))),
+        ),
+    )
+    if styled:
+        layout.update((k, v) for k, v in FIGURE_STYLE.items() if k != "scene")
+        layout["scene"].update(FIGURE_STYLE["scene"])
+    return layout
+
+def surface_graph(d1, d2, surface_names=("E", "bliss", "loewe"), dtype=np.float64, backend=models):
+    """
+    EvaluationGraph of the surfaces at the doses d1 and d2, for compute_surfaces
+
+    The single drug Hill curves depend only on (h, C) of their drug, and the
+    terms of MuSyC_E that hold its exp and log work (see
+    synergy_models.MuSyC_terms) only on the h, C, alpha and gamma parameters.
+    E mixes the terms with E0..E3, so moving the E1, E2 or beta sliders only
+    recomputes E and the synergy surfaces. Backends without MuSyC_terms (the
+    numba loops) compute E in one node.
+    """
+    dtype = np.dtype(dtype)
+    d1 = np.asarray(d1, dtype=dtype)
+    d2 = np.asarray(d2, dtype=dtype)
+    single = (d1 == 0) | (d2 == 0)
+    # Parameters are passed on as Python floats, which unlike numpy scalars
+    # never upcast float32 arrays
+    graph = EvaluationGraph()
+    if hasattr(backend, "MuSyC_terms"):
+        graph.add("terms", lambda *p: backend.MuSyC_terms(d1, d2, *[float(x) for x in p], dtype=dtype),
+            ("h1", "h2", "C1", "C2", "alpha12", "alpha21", "gamma12", "gamma21"))
+        graph.add("E", lambda terms, *p: backend.MuSyC_E_from_terms(terms, *[float(x) for x in p]),
+            ("terms", "E0", "E1", "E2", "E3"))
+    else:
+        graph.add("E", lambda *p: backend.MuSyC_E(d1, d2, *[float(x) for x in p], dtype=dtype), models.PARAMETER_NAMES)
+    if "bliss" in surface_names:
+        graph.add("hill1", lambda h, C: models.hill_fraction(d1, float(h), float(C)), ("h1", "C1"))
+        graph.add("hill2", lambda h, C: models.hill_fraction(d2, float(h), float(C)), ("h2", "C2"))
+        graph.add("bliss", lambda f1, f2, E, *p: models.bliss_from_fractions(f1, f2, E, *[float(x) for x in p], single),
+            ("hill1", "hill2", "E", "E0", "E1", "E2"))
+    if "loewe" in surface_names:
+        graph.add("loewe", lambda E, *p: backend.loewe_log(d1, d2, E, *[float(x) for x in p])[0],
+            ("E", "E0", "E1", "E2", "h1", "h2", "C1", "C2"))
+    return graph
+
+def compute_surfaces(d1, d2, parameters, surface_names=("E", "bliss", "loewe"), dtype=np.float64, backend=models, stage=None, graph=None):
+    """
+    The named surfaces for the 12 MuSyC parameters, as drawn by the demos: E
+    (with undefined values drawn as 0), the Bliss excess and -log(Loewe)
+
+    backend is a module from synergy_numba.get_backend. stage, if given, is
+    called with the name of each node of surface_graph as it is computed and
+    returns a context manager around it (see RefreshProfiler.stage). With a
+    graph from surface_graph (made for the same doses, dtype and backend),
+    only the parts of the surfaces that depend on parameters changed since its
+    last call are recomputed. Without one, a new graph is evaluated, so the
+    surfaces are the same either way.
+    """
+    if graph is None:
+        graph = surface_graph(d1, d2, surface_names, dtype=dtype, backend=backend)
+    names = ["E"] + [name for name in surface_names if name != "E"]
+    surfaces = dict(graph.evaluate(dict(zip(models.PARAMETER_NAMES, parameters)), names, stage))
+    surfaces["E"] = np.where(np.isnan(surfaces["E"]), 0, surfaces["E"])
+    return surfaces
+
+# Version of the dicts written by Demo.get_state
+STATE_VERSION = 1
+
+def _plain(value):
+    """
+    value with numpy scalars (e.g. slider values) made Python numbers, for json
+    """
+    if isinstance(value, dict):
+        return dict((k, _plain(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def load_state(path):
+    """
+    State saved by Demo.save_state, for Demo.restore or Demo.set_state
+    """
+    if os.path.splitext(path)[1].lower() == ".json":
+        with open(path) as f:
+            return json.load(f)
+    with np.load(path) as saved:
+        state = json.loads(str(saved["state"]))
+        surfaces = dict((key[len("surface_"):], saved[key]) for key in saved.files if key.startswith("surface_"))
+    if surfaces:
+        state["surfaces"] = surfaces
+    return state
+
+class DoseGrid:
+    """
+    A rectangular grid of doses, with what the demo needs to plot and cache
+    surfaces on it computed once
+
+    d1 and d2 are read-only arrays of shape (n_d2, n_d1), sorted by d2 and then
+    d1. order sorts the flattened doses the grid was made from into that
+    layout, zero1 and zero2 mark the single-drug edges, log_d1 and log_d2 are
+    the float32 axis values plotted for d1 and d2, and fingerprint identifies
+    the grid in a SurfaceCache.
+    """
+    def __init__(self, d1, d2):
+        d1 = np.asarray(d1, dtype=float).flatten()
+        d2 = np.asarray(d2, dtype=float).flatten()
+        self.order = np.lexsort((d1, d2))
+        self.shape = (len(np.unique(d2)), len(np.unique(d1)))
+        self.d1 = d1[self.order].reshape(self.shape)
+        self.d2 = d2[self.order].reshape(self.shape)
+        self.zero1 = (self.d1 == 0)
+        self.zero2 = (self.d2 == 0)
+        self.log_d1 = _log_doses(self.d1).astype(np.float32)
+        self.log_d2 = _log_doses(self.d2).astype(np.float32)
+        for a in (self.order, self.d1, self.d2, self.zero1, self.zero2, self.log_d1, self.log_d2):
+            a.setflags(write=False)
+        self.fingerprint = SurfaceCache.grid_fingerprint(self.d1, self.d2)
+
+    @classmethod
+    def log_spaced(cls, n_doses, refine_factor=1):
+        """
+        0 plus n_doses log-spaced doses from 1e-3 to 1e3 on each axis. With
+        refine_factor k, k-1 doses are inserted between each pair of those, so
+        the grid contains the one with refine_factor=1.
+        """
+        d = np.hstack([[0], np.logspace(-3, 3, (n_doses-1)*refine_factor+1)])
+        d1, d2 = np.meshgrid(d, d)
+        return cls(d1, d2)
+
+    def arrange(self, values):
+        """
+        Reorders values given at the doses the grid was made from into its layout
+        """
+        return np.reshape(values, -1)[self.order].reshape(self.shape)
+
+# Keyword options of every Demo and their defaults, beyond the starting
+# parameters, continuous and figsize. See Demo.__init__ for what each does.
+DEMO_OPTIONS = dict(cache=True, atlas=None, refresh_delay=0., n_doses=30, refine_factor=None, refine_delay=0.3,
+    profile=False, dtype=np.float64, backend="numpy", compute_service=None, incremental=True, lazy=False)
+
 class Demo(ABC):
 
+    # Surfaces computed on each refresh, see current_surfaces
+    surface_names = ("E", "bliss", "loewe")
+
     def _get_beta(self, E0, E1, E2, E3):
-        minE = min(E1, E2)
-        return (minE-E3)/(E0-minE)
+        return models.get_beta(E0, E1, E2, E3)
 
     def _get_E3(self, E0, E1, E2, beta):
-        minE = min(E1, E2)
-        return minE - beta*(E0-minE)
+        return models.get_E3(E0, E1, E2, beta)
 
 
     def _hill_inv(self, E, E0, Emax, h, C):
-        E_ratio = (E-E0)/(Emax-E)
-        d = np.float_power(E_ratio, 1./h)*C
-        d[E_ratio<0] = np.nan
-        return d
+        return models.hill_inv(E, E0, Emax, h, C)
 
     def _hill_E(self, d, E0, Emax, h, C):
-        dh = np.power(d,h)
-        return E0 + (Emax-E0)*dh/(np.power(C,h)+dh)
-
-    def _MuSyC_E(self, d1, d2, E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21):
-        d1h1 = np.power(d1,h1)
-        d2h2 = np.power(d2,h2)
-        C1h1 = np.power(C1,h1)
-        C2h2 = np.power(C2,h2)
-        r1 = 100/C1h1
-        r2 = 100/C2h2
-        U=(r1*r2*np.power((r1*C1h1),gamma21)*C1h1*C2h2+r1*r2*np.power((r2*C2h2),gamma12)*C1h1*C2h2+np.power(r1,(gamma21+1))*np.power(alpha21*d1, gamma21*h1)*np.power((r2*C2h2),gamma12)*C1h1+np.power(r2,(gamma12+1))*np.power(alpha12*d2, gamma12*h2)*np.power((r1*C1h1),gamma21)*C2h2)/(d1h1*r1*r2*np.power((r1*C1h1),gamma21)*C2h2+d1h1*r1*r2*np.power((r2*C2h2),gamma12)*C2h2+d1h1*r1*np.power(r2,(gamma12+1))*np.power(alpha12*d2, gamma12*h2)*C2h2+d1h1*r1*np.power(r2,gamma12)*np.power(alpha12*d2, gamma12*h2)*np.power((r1*C1h1),gamma21)+d1h1*np.power(r1,(gamma21+1))*np.power(r2,gamma12)*np.power(alpha21*d1, gamma21*h1)*np.power(alpha12*d2, gamma12*h2)+d1h1*np.power(r1,(gamma21+1))*np.power(alpha21*d1, gamma21*h1)*np.power((r2*C2h2),gamma12)+d2h2*r1*r2*np.power((r1*C1h1),gamma21)*C1h1+d2h2*r1*r2*np.power((r2*C2h2),gamma12)*C1h1+d2h2*np.power(r1,(gamma21+1))*r2*np.power(alpha21*d1, gamma21*h1)*C1h1+d2h2*np.power(r1,gamma21)*r2*np.power(alpha21*d1, gamma21*h1)*np.power((r2*C2h2),gamma12)+d2h2*np.power(r1,gamma21)*np.power(r2,(gamma12+1))*np.power(alpha21*d1, gamma21*h1)*np.power(alpha12*d2, gamma12*h2)+d2h2*np.power(r2,(gamma12+1))*np.power(alpha12*d2, gamma12*h2)*np.power((r1*C1h1),gamma21)+r1*r2*np.power((r1*C1h1),gamma21)*C1h1*C2h2+r1*r2*np.power((r2*C2h2),gamma12)*C1h1*C2h2+np.power(r1,(gamma21+1))*np.power(alpha21*d1, gamma21*h1)*np.power((r2*C2h2),gamma12)*C1h1+np.power(r2,(gamma12+1))*np.power(alpha12*d2, gamma12*h2)*np.power((r1*C1h1),gamma21)*C2h2)
-        A1=(d1h1*r1*r2*np.power((r1*C1h1),gamma21)*C2h2+d1h1*r1*r2*np.power((r2*C2h2),gamma12)*C2h2+d1h1*np.power(r1,(gamma21+1))*np.power(alpha21*d1, gamma21*h1)*np.power((r2*C2h2),gamma12)+d2h2*np.power(r1,gamma21)*r2*np.power(alpha21*d1, gamma21*h1)*np.power((r2*C2h2),gamma12))/(d1h1*r1*r2*np.power((r1*C1h1),gamma21)*C2h2+d1h1*r1*r2*np.power((r2*C2h2),gamma12)*C2h2+d1h1*r1*np.power(r2,(gamma12+1))*np.power(alpha12*d2, gamma12*h2)*C2h2+d1h1*r1*np.power(r2,gamma12)*np.power(alpha12*d2, gamma12*h2)*np.power((r1*C1h1),gamma21)+d1h1*np.power(r1,(gamma21+1))*np.power(r2,gamma12)*np.power(alpha21*d1, gamma21*h1)*np.power(alpha12*d2, gamma12*h2)+d1h1*np.power(r1,(gamma21+1))*np.power(alpha21*d1, gamma21*h1)*np.power((r2*C2h2),gamma12)+d2h2*r1*r2*np.power((r1*C1h1),gamma21)*C1h1+d2h2*r1*r2*np.power((r2*C2h2),gamma12)*C1h1+d2h2*np.power(r1,(gamma21+1))*r2*np.power(alpha21*d1, gamma21*h1)*C1h1+d2h2*np.power(r1,gamma21)*r2*np.power(alpha21*d1, gamma21*h1)*np.power((r2*C2h2),gamma12)+d2h2*np.power(r1,gamma21)*np.power(r2,(gamma12+1))*np.power(alpha21*d1, gamma21*h1)*np.power(alpha12*d2, gamma12*h2)+d2h2*np.power(r2,(gamma12+1))*np.power(alpha12*d2, gamma12*h2)*np.power((r1*C1h1),gamma21)+r1*r2*np.power((r1*C1h1),gamma21)*C1h1*C2h2+r1*r2*np.power((r2*C2h2),gamma12)*C1h1*C2h2+np.power(r1,(gamma21+1))*np.power(alpha21*d1, gamma21*h1)*np.power((r2*C2h2),gamma12)*C1h1+np.power(r2,(gamma12+1))*np.power(alpha12*d2, gamma12*h2)*np.power((r1*C1h1),gamma21)*C2h2)
-        A2=(d1h1*r1*np.power(r2,gamma12)*np.power(alpha12*d2, gamma12*h2)*np.power((r1*C1h1),gamma21)+d2h2*r1*r2*np.power((r1*C1h1),gamma21)*C1h1+d2h2*r1*r2*np.power((r2*C2h2),gamma12)*C1h1+d2h2*np.power(r2,(gamma12+1))*np.power(alpha12*d2, gamma12*h2)*np.power((r1*C1h1),gamma21))/(d1h1*r1*r2*np.power((r1*C1h1),gamma21)*C2h2+d1h1*r1*r2*np.power((r2*C2h2),gamma12)*C2h2+d1h1*r1*np.power(r2,(gamma12+1))*np.power(alpha12*d2, gamma12*h2)*C2h2+d1h1*r1*np.power(r2,gamma12)*np.power(alpha12*d2, gamma12*h2)*np.power((r1*C1h1),gamma21)+d1h1*np.power(r1,(gamma21+1))*np.power(r2,gamma12)*np.power(alpha21*d1, gamma21*h1)*np.power(alpha12*d2, gamma12*h2)+d1h1*np.power(r1,(gamma21+1))*np.power(alpha21*d1, gamma21*h1)*np.power((r2*C2h2),gamma12)+d2h2*r1*r2*np.power((r1*C1h1),gamma21)*C1h1+d2h2*r1*r2*np.power((r2*C2h2),gamma12)*C1h1+d2h2*np.power(r1,(gamma21+1))*r2*np.power(alpha21*d1, gamma21*h1)*C1h1+d2h2*np.power(r1,gamma21)*r2*np.power(alpha21*d1, gamma21*h1)*np.power((r2*C2h2),gamma12)+d2h2*np.power(r1,gamma21)*np.power(r2,(gamma12+1))*np.power(alpha21*d1, gamma21*h1)*np.power(alpha12*d2, gamma12*h2)+d2h2*np.power(r2,(gamma12+1))*np.power(alpha12*d2, gamma12*h2)*np.power((r1*C1h1),gamma21)+r1*r2*np.power((r1*C1h1),gamma21)*C1h1*C2h2+r1*r2*np.power((r2*C2h2),gamma12)*C1h1*C2h2+np.power(r1,(gamma21+1))*np.power(alpha21*d1, gamma21*h1)*np.power((r2*C2h2),gamma12)*C1h1+np.power(r2,(gamma12+1))*np.power(alpha12*d2, gamma12*h2)*np.power((r1*C1h1),gamma21)*C2h2)
-        return U*E0 + A1*E1 + A2*E2 + (1-(U+A1+A2))*E3
+        return models.hill_E(d, E0, Emax, h, C)
+
+    def _MuSyC_E(self, d1, d2, E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21, out=None, dtype=None):
+        return self.backend.MuSyC_E(d1, d2, E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21, out=out, dtype=dtype)
 
     def _bliss(self, d1, d2, E, E0, E1, E2, h1, h2, C1, C2):
-        E1_alone = self._hill_E(d1, E0, E1, h1, C1)
-        E2_alone = self._hill_E(d2, E0, E2, h2, C2)
-        synergy = E1_alone*E2_alone - E
-        synergy[(d1==0) | (d2==0)] = 0
-        return synergy
+        return self.backend.bliss(d1, d2, E, E0, E1, E2, h1, h2, C1, C2)
 
     def _loewe(self, d1, d2, E, E0, E1, E2, h1, h2, C1, C2):
-        with np.errstate(divide='ignore', invalid='ignore'):
-            d1_alone = self._hill_inv(E, E0, E1, h1, C1)
-            d2_alone = self._hill_inv(E, E0, E2, h2, C2)
-            synergy = d1/d1_alone + d2/d2_alone
-        synergy[(d1==0) | (d2==0)] = 1
-        return synergy
-
-    def get_plot(self, d1, d2, E, cmap='viridis', clim=None, center_on_zero=False):
-
-        sorted_indices = np.lexsort((d1,d2))
-        d1 = d1[sorted_indices]
-        d2 = d2[sorted_indices]
-        E = E[sorted_indices]
-
-        n_d1 = len(np.unique(d1))
-        n_d2 = len(np.unique(d2))
-        d1 = d1.reshape(n_d2,n_d1)
-        d2 = d2.reshape(n_d2,n_d1)
-        E = E.reshape(n_d2,n_d1)
-
-        if clim is None:
-            if center_on_zero:
-                cmin, cmax = -0.4,0.4
-            else:
-                cmin, cmax = 0,1
-        else:
-            cmin, cmax = clim
-
-        data_to_plot = go.Surface(
-            x=d1,
-            y=d2,
-            z=E,
-            cmin=cmin,
-            cmax=cmax,
-            opacity=0.8,
-            contours_z=dict(
-                show=True,
-                usecolormap=True,
-                highlightcolor="limegreen",
-                project_z=False
-            ),
-            colorscale=cmap,
-            reversescale=False,
-            colorbar=dict(
-                lenmode='fraction',
-                len=0.65,
-                thickness=15
-                ),
-            connectgaps=False
-            )
-
-
-        return data_to_plot
-
-    def get_fig_widget(self, d1, d2, E, title, zlim=(0,1.1), clim=None, cmap="viridis", width=800, height=600, center_on_zero=False, z_title=None):
-        d1[d1==0] = min(d1[d1>0])/10
-        d2[d2==0] = min(d2[d2>0])/10
-        d1 = np.log10(d1)
-        d2 = np.log10(d2)
-
-        data = [self.get_plot(d1, d2, E, cmap=cmap, center_on_zero=center_on_zero, clim=clim),]
-
-        if z_title is None:
-            if center_on_zero:
-                z_title = ""
-            else:
-                z_title="E"
-        g = go.FigureWidget(data=data)
+        return self.backend.loewe(d1, d2, E, E0, E1, E2, h1, h2, C1, C2)
 
-        g.update_layout(
-            title=title,
-            autosize=False,
-            scene_camera_eye=dict(
-                x=1.02, 
-                y=2.15,
-                z=1.48
-            ),
-            width = width,
-            height = height,
-            hovermode = False,
-            margin=dict(
-                l=10, 
-                r=10, 
-                b=10, 
-                t=30
-            ), 
-            scene=dict(
-                xaxis_title="Drug 1", 
-                yaxis_title="Drug 2", 
-                zaxis_title=z_title, 
-                aspectmode="cube"
-            ),
-            font=dict(
-                size=10
-            )
-        )
-            
-        g.update_layout(scene =
-            dict(
-                    zaxis = dict(range=zlim),
-                    xaxis = dict(range=(min(d1),max(d1))),
-                    yaxis = dict(range=(min(d2),max(d2))),
-                )
-        )
+    def _loewe_log(self, d1, d2, E, E0, E1, E2, h1, h2, C1, C2):
+        return self.backend.loewe_log(d1, d2, E, E0, E1, E2, h1, h2, C1, C2)
+
+    def get_plot(self, grid, E, cmap='viridis', clim=None, center_on_zero=False):
+        """
+        Surface trace of E (in the layout of the DoseGrid grid) over log doses
+        """
+        import plotly.graph_objects as go
+        return go.Surface(**surface_trace(grid, E, cmap=cmap, clim=clim, center_on_zero=center_on_zero))
 
+    def get_fig_widget(self, grid, E, title, zlim=(0,1.1), clim=None, cmap="viridis", width=800, height=600, center_on_zero=False, z_title=None):
+        import plotly.graph_objects as go
+
+        data = [self.get_plot(grid, E, cmap=cmap, center_on_zero=center_on_zero, clim=clim),]
+        g = go.FigureWidget(data=data)
+        g.update_layout(figure_layout(grid, title, zlim=zlim, width=width, height=height, center_on_zero=center_on_zero, z_title=z_title))
         return g
 
-    def __init__(self, E0=1, E1=0.4, E2=0.5, E3=0.4, h1=2, h2=0.5, C1=1, C2=1, continuous=False, figsize=400):
+    def __init__(self, E0=1, E1=0.4, E2=0.5, E3=0.4, h1=2, h2=0.5, C1=1, C2=1, continuous=False, figsize=400, **options):
+        unknown = sorted(set(options) - set(DEMO_OPTIONS))
+        if unknown:
+            raise TypeError("Unknown demo options: %s"%", ".join(unknown))
+        options = dict(DEMO_OPTIONS, **options)
 
         self._E0 = E0
         self._E1 = E1
@@ -180,22 +333,99 @@ class Demo(ABC):
 
         self._beta = self._get_beta(E0, E1, E2, E3)
 
-        d1 = np.logspace(-3,3,30)
-        d2 = np.logspace(-3,3,30)
-        d1 = np.hstack([[0],d1])
-        d2 = np.hstack([[0],d2])
-        d1,d2 = np.meshgrid(d1, d2)
-        d1 = d1.flatten()
-        d2 = d2.flatten()
-        self.d1 = d1
-        self.d2 = d2
-
+        # Sliders are dragged on the coarse grid. With a refine_factor, the
+        # surfaces are recomputed on a grid refine_factor times denser once
+        # the sliders have been still for refine_delay seconds.
+        self.n_doses = n_doses = options["n_doses"]
+        self.refine_factor = refine_factor = options["refine_factor"]
+        self.refine_delay = options["refine_delay"]
+        self._grids = dict(coarse=DoseGrid.log_spaced(n_doses))
+        if refine_factor:
+            fine = self._grids["fine"] = DoseGrid.log_spaced(n_doses, refine_factor)
+            # Where the coarse grid's doses sit in the fine grid
+            self._refine_shared = np.ix_(*[np.r_[0, 1 + refine_factor*np.arange(n-1)] for n in self._grids["coarse"].shape])
+            self._refine_new = np.ones(fine.shape, dtype=bool)
+            self._refine_new[self._refine_shared] = False
+        self._displayed_grid = "coarse"
+
+        self.grid = self._grids["coarse"]
+        self.d1 = self.grid.d1.flatten()
+        self.d2 = self.grid.d2.flatten()
 
         self.paused = False
         self.continuous = continuous
 
         self.figsize = figsize
 
+        # True shares surface_cache.shared_cache with every other Demo
+        cache = options["cache"]
+        if cache is True:
+            cache = shared_cache
+        elif cache is False:
+            cache = None
+        self.cache = cache
+
+        # Precomputed surfaces (a SurfaceAtlas, or the path of one) to serve
+        # slider states from before computing them
+        atlas = options["atlas"]
+        if isinstance(atlas, str):
+            atlas = SurfaceAtlas(atlas)
+        if atlas is not None and not (atlas.matches_grid(self.d1, self.d2, options["dtype"]) and atlas.E0 == E0):
+            raise ValueError("The atlas was built for a different dose grid, dtype or E0")
+        self.atlas = atlas
+
+        # Per-stage timings of each refresh (a RefreshProfiler, or True for one
+        # with the default settings), see profile_widget
+        profile = options["profile"]
+        if profile is True:
+            profile = RefreshProfiler()
+        elif profile is False:
+            profile = None
+        self.profiler = profile
+
+        # Precision the surfaces are computed in. They are always sent to the
+        # figures as float32. Loewe is ill-conditioned where E approaches E1
+        # or E2, so float32 can visibly change the Loewe panel there; see
+        # precision_error.
+        self.dtype = np.dtype(options["dtype"])
+
+        # Module computing the surfaces: synergy_models, synergy_numba, or the
+        # name of one to pass to synergy_numba.get_backend. numba is only
+        # imported when it may be used, as importing it takes a while.
+        backend = options["backend"]
+        if backend == "numpy":
+            backend = models
+        elif isinstance(backend, str):
+            import synergy_numba
+            backend = synergy_numba.get_backend(backend)
+        self.backend = backend
+
+        # Shared service (a compute_service.ComputeService, a proxy to one, or
+        # the "host:port" of one) that computes the surfaces in place of this
+        # kernel. The cache and atlas are still checked first.
+        compute_service = options["compute_service"]
+        if isinstance(compute_service, (str, tuple)):
+            import compute_service as service
+            compute_service = service.connect(compute_service)
+        self.compute_service = compute_service
+
+        # Per dose grid EvaluationGraphs (see surface_graph), so that a slider
+        # change only recomputes the parts of the surfaces that depend on it
+        self.incremental = options["incremental"]
+        self._surface_graphs = dict()
+
+        # Slider events are coalesced, and computed off the event loop when
+        # running in a kernel
+        self.refresh_delay = options["refresh_delay"]
+        self.scheduler = RefreshScheduler(self._refresh_state, self._push_refresh, delay=self.refresh_delay)
+
+        # What the sliders and figures start from: the slider values, the
+        # surfaces already computed for them (if any) and the camera, which
+        # restore and set_state replace before the widgets are built
+        self._slider_values = self._default_slider_values()
+        self._startup = None
+        self._camera = None
+
         self.E1_slider = None
         self.E2_slider = None
         self.h1_slider = None
@@ -212,104 +442,66 @@ class Demo(ABC):
         self.fig = None
         self.figs = []
         self.fig_widget_rows = []
+
+        # Last surface sent to each figure, so unchanged surfaces are not resent
+        self._sent = dict()
+        self.surfaces_sent = 0
+        self.surfaces_skipped = 0
         
         self.widgets = None
 
+        # A lazy demo builds its widgets when first shown (see run)
+        if not options["lazy"]:
+            self._build()
+
+    def _build(self):
+        """
+        Creates the sliders, figures and widget, unless they already exist
+        """
+        if self.widgets is not None: return
         self._setup_sliders()
         self._setup_figs()
+        # The figures were created showing these surfaces
+        for i, fig in enumerate(self.figs):
+            self._sent[i] = np.asarray(fig.data[0].z, dtype=np.float32)
+        if self._camera:
+            for fig in self.figs:
+                fig.layout.scene.camera = self._camera
         self._setup_widget()
 
-    def _setup_sliders(self):
+        if self.refine_factor:
+            self._schedule_refine()
 
-        continuous = self.continuous
-        self.C1_slider = widgets.FloatSlider(
-            value=np.log10(self._C1),
-            min=-2.0,
-            max=2.0,
-            step=0.2,
-            description='log(C1):',
-            continuous_update=continuous)
-
-        self.C2_slider = widgets.FloatSlider(
-            value=np.log10(self._C2),
-            min=-2.0,
-            max=2.0,
-            step=0.2,
-            description='log(C2):',
-            continuous_update=continuous)
-
-        self.h1_slider = widgets.FloatSlider(
-            value=np.log10(self._h1),
-            min=-1.0,
-            max=1.0,
-            step=0.2,
-            description='log(h1):',
-            continuous_update=continuous)
-
-        self.h2_slider = widgets.FloatSlider(
-            value=np.log10(self._h2),
-            min=-1.0,
-            max=1.0,
-            step=0.2,
-            description='log(h2):',
-            continuous_update=continuous)
-
-        self.E1_slider = widgets.FloatSlider(
-            value=self._E1,
-            min=0,
-            max=1,
-            step=0.05,
-            description='E1:',
-            continuous_update=continuous)
-
-        self.E2_slider = widgets.FloatSlider(
-            value=self._E2,
-            min=0,
-            max=1,
-            step=0.05,
-            description='E2:',
-            continuous_update=continuous)
-
-
-        self.alpha12_slider = widgets.FloatSlider(
-            value=0,
-            min=-3.0,
-            max=3.0,
-            step=0.2,
-            description='log(alp12):',
-            continuous_update=continuous)
-
-        self.alpha21_slider = widgets.FloatSlider(
-            value=0,
-            min=-3.0,
-            max=3.0,
-            step=0.2,
-            description='log(alp21):',
-            continuous_update=continuous)
-
-        self.gamma12_slider = widgets.FloatSlider(
-            value=0,
-            min=-1.4,
-            max=1.6,
-            step=0.2,
-            description='log(gam12):',
-            continuous_update=continuous)
-
-        self.gamma21_slider = widgets.FloatSlider(
-            value=0,
-            min=-1.4,
-            max=1.6,
-            step=0.2,
-            description='log(gam21):',
-            continuous_update=continuous)
-
-        self.beta_slider = widgets.FloatSlider(
-            value=self._beta,
-            min=-1,
-            max=1,
-            step=0.05,
-            description='beta:',
-            continuous_update=continuous)
+    def _default_slider_values(self):
+        return dict(E1=self._E1, E2=self._E2, h1=np.log10(self._h1), h2=np.log10(self._h2), C1=np.log10(self._C1),
+            C2=np.log10(self._C2), alpha12=0, alpha21=0, gamma12=0, gamma21=0, beta=self._beta)
+
+    def _setup_sliders(self):
+        from ipywidgets import widgets
+
+        def slider(name, value, description):
+            low, high, step = models.SLIDER_RANGES[name]
+            return widgets.FloatSlider(
+                value=value,
+                min=low,
+                max=high,
+                step=step,
+                description=description,
+                continuous_update=self.continuous)
+
+        values = self._slider_values
+        self.C1_slider = slider("C1", values["C1"], 'log(C1):')
+        self.C2_slider = slider("C2", values["C2"], 'log(C2):')
+        self.h1_slider = slider("h1", values["h1"], 'log(h1):')
+        self.h2_slider = slider("h2", values["h2"], 'log(h2):')
+        self.E1_slider = slider("E1", values["E1"], 'E1:')
+        self.E2_slider = slider("E2", values["E2"], 'E2:')
+
+        self.alpha12_slider = slider("alpha12", values["alpha12"], 'log(alp12):')
+        self.alpha21_slider = slider("alpha21", values["alpha21"], 'log(alp21):')
+        self.gamma12_slider = slider("gamma12", values["gamma12"], 'log(gam12):')
+        self.gamma21_slider = slider("gamma21", values["gamma21"], 'log(gam21):')
+        self.beta_slider = slider("beta", values["beta"], 'beta:')
 
         sliders = [self.h1_slider, self.h2_slider,
             self.E1_slider, self.E2_slider, self.C1_slider, self.C2_slider,
@@ -325,6 +517,7 @@ class Demo(ABC):
         
 
     def _setup_widget(self):
+        from ipywidgets import widgets
 
         for fig in self.figs:
             fig.layout.scene.on_change(self.cam_change, 'camera')
@@ -379,54 +572,281 @@ class Demo(ABC):
         widget_list = self.fig_widget_rows + widget_list
         self.widgets = widgets.VBox(widget_list)
 
-    def get_parameters(self):
-        alpha12 = np.power(10., self.alpha12_slider.value)
-        alpha21 = np.power(10., self.alpha21_slider.value)
-        gamma12 = np.power(10., self.gamma12_slider.value)
-        gamma21 = np.power(10., self.gamma21_slider.value)
-        if alpha12==np.power(10., -3): alpha12=0
-        if alpha21==np.power(10., -3): alpha21=0
-        beta = self.beta_slider.value
-
-        E1 = self.E1_slider.value
-        E2 = self.E2_slider.value
-        E0 = self._E0
-        C1 = np.power(10., self.C1_slider.value)
-        C2 = np.power(10., self.C2_slider.value)
-        h1 = np.power(10., self.h1_slider.value)
-        h2 = np.power(10., self.h2_slider.value)
-        
-        
-        E3 = self._get_E3(E0, E1, E2, beta)
+    def get_slider_values(self):
+        """
+        Current slider values by name (see synergy_models.SLIDER_RANGES)
+        """
+        if self.beta_slider is None:
+            return dict(self._slider_values)
+        return dict((name, getattr(self, name+"_slider").value) for name in models.SLIDER_RANGES)
 
-        return E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21
+    def get_parameters(self):
+        return models.parameters_from_sliders(self._E0, **self.get_slider_values())
 
     def refresh(self, change):
         """
         Handler for changes in slider values
-        Regenerates MuSyC model data, and plots it
+        Regenerates MuSyC model data, and plots it (see RefreshScheduler)
         """
 
         if self.paused: return
-        
-        E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21 = self.get_parameters()
 
-        d1 = np.power(10.,self.fig.data[0].x)
-        d2 = np.power(10.,self.fig.data[0].y)
-        
+        self.scheduler.submit(("coarse", self.get_slider_values()))
 
-        d1[d1==np.min(d1)] = 0
-        d2[d2==np.min(d2)] = 0
-            
-        self._update_figs(d1, d2, E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21)
+    def _stage(self, name):
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.stage(name)
+
+    def profile_widget(self):
+        """
+        Widget showing rolling percentiles of the time spent in each stage of a
+        refresh. Requires profile=True.
+        """
+        if self.profiler is None:
+            raise ValueError("Create the demo with profile=True to profile refreshes")
+        return self.profiler.widget()
+
+    def _refresh_state(self, state):
+        grid, slider_values = state
+        if self.profiler is not None:
+            self.profiler.begin()
+        if grid == "fine":
+            parameters = models.parameters_from_sliders(self._E0, **slider_values)
+            compute = lambda: self._refine_surfaces(slider_values, parameters)
+            return grid, self._cached_surfaces(self._grids[grid], parameters, compute)
+        return grid, self.current_surfaces(self._grids[grid], slider_values)
+
+    def _push_refresh(self, result):
+        grid, surfaces = result
+        # The figures send their changes when their batch_update exits
+        batch = ExitStack()
+        for fig in self.figs:
+            batch.enter_context(fig.batch_update())
+        with self._stage("update_figs"):
+            if grid != self._displayed_grid:
+                for fig in self.figs:
+                    fig.data[0].x = self._grids[grid].log_d1
+                    fig.data[0].y = self._grids[grid].log_d2
+                self._displayed_grid = grid
+            self._update_figs(surfaces)
+        with self._stage("send"):
+            batch.close()
+        if self.profiler is not None:
+            self.profiler.finish()
+        if grid == "coarse" and self.refine_factor:
+            self._schedule_refine()
+
+    def _schedule_refine(self):
+        loop = _running_loop()
+        if loop is None:
+            self._refine(self.scheduler.generation)
+        else:
+            loop.call_later(self.refine_delay, self._refine, self.scheduler.generation)
+
+    def _refine(self, generation):
+        # Only refine if the sliders have not moved since the coarse refresh
+        if generation == self.scheduler.generation and self.scheduler.idle and not self.paused:
+            self.scheduler.submit(("fine", self.get_slider_values()))
+
+    def _refine_surfaces(self, slider_values, parameters):
+        """
+        Surfaces on the fine grid, reusing the coarse grid's surfaces at the
+        doses the two grids share
+        """
+        coarse = self.current_surfaces(self._grids["coarse"], slider_values)
+        fine = self._grids["fine"]
+        shared, new = self._refine_shared, self._refine_new
+        computed = self._compute_surfaces(fine.d1[new], fine.d2[new], *parameters, graph=("refine", fine.fingerprint))
+
+        surfaces = dict()
+        for name, surface in coarse.items():
+            surfaces[name] = np.empty(fine.shape, dtype=self.dtype)
+            surfaces[name][shared] = surface
+            surfaces[name][new] = computed[name]
+        return surfaces
+
+    def current_surfaces(self, grid=None, slider_values=None):
+        """
+        Surfaces on the DoseGrid grid (by default, self.grid) for the given (by
+        default, current) slider values, read from the atlas when it has them
+        and computed (or taken from the cache) otherwise
+        """
+        if grid is None:
+            grid = self.grid
+        if slider_values is None:
+            slider_values = self.get_slider_values()
+        if self.atlas is not None and grid is self._grids["coarse"]:
+            with self._stage("atlas"):
+                surfaces = self.atlas.lookup(slider_values, self.surface_names)
+            if surfaces is not None:
+                return dict((name, surface.reshape(grid.shape)) for name, surface in surfaces.items())
+        parameters = models.parameters_from_sliders(self._E0, **slider_values)
+        return self._cached_surfaces(grid, parameters, lambda: self._compute_surfaces(grid.d1, grid.d2, *parameters, graph=grid.fingerprint))
+
+    def _cached_surfaces(self, grid, parameters, compute):
+        if self.cache is None:
+            return compute()
+
+        key = self.cache.key(parameters, fingerprint=(grid.fingerprint, self.dtype.str), names=self.surface_names)
+        with self._stage("cache"):
+            surfaces = self.cache.get(key)
+        if surfaces is None:
+            surfaces = compute()
+            self.cache.put(key, surfaces)
+        return surfaces
+
+    def _compute_surfaces(self, d1, d2, E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21, graph=None):
+        """
+        graph names the doses d1 and d2 (e.g. a grid's fingerprint) so that
+        they get their own EvaluationGraph when incremental is set
+        """
+        parameters = (E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21)
+        if self.compute_service is not None:
+            with self._stage("service"):
+                return self.compute_service.surfaces(d1, d2, parameters, self.surface_names, self.dtype.str)
+        if graph is not None and self.incremental:
+            if graph not in self._surface_graphs:
+                self._surface_graphs[graph] = surface_graph(d1, d2, self.surface_names, dtype=self.dtype, backend=self.backend)
+            graph = self._surface_graphs[graph]
+        else:
+            graph = None
+        return compute_surfaces(d1, d2, parameters, self.surface_names, dtype=self.dtype, backend=self.backend, stage=self._stage, graph=graph)
+
+    def precision_error(self, slider_values=None):
+        """
+        Error of each displayed surface computed in float32 rather than float64
+        (see synergy_models.precision_error), for the given (by default,
+        current) slider values on the displayed dose grid
+        """
+        if slider_values is None:
+            slider_values = self.get_slider_values()
+        grid = self._grids[self._displayed_grid]
+        errors = models.precision_error(grid.d1, grid.d2, *models.parameters_from_sliders(self._E0, **slider_values))
+        return dict((name, errors[name]) for name in self.surface_names)
 
     @abstractmethod
-    def _update_figs(self, d1, d2, E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21):
+    def _update_figs(self, surfaces):
         pass
 
+    def _set_surface(self, i, z):
+        """
+        Sends z to self.figs[i] as float32, unless that figure already shows it
+        """
+        z = np.asarray(z, dtype=np.float32)
+        last = self._sent.get(i)
+        if last is not None and last.shape == z.shape and np.array_equal(last, z, equal_nan=True):
+            self.surfaces_skipped += 1
+            return
+        self.figs[i].data[0].z = z
+        self._sent[i] = z
+        self.surfaces_sent += 1
+
     def run(self):
+        self._build()
         return self.widgets
 
+    def _startup_surfaces(self):
+        """
+        Surfaces the figures are created with: those restored with the slider
+        values, if any, and otherwise the current surfaces
+        """
+        surfaces, self._startup = self._startup, None
+        if surfaces is None:
+            surfaces = self.current_surfaces(self.grid)
+        return surfaces
+
+    def get_state(self, include_surfaces=False):
+        """
+        Dict of what restore needs to show this demo as it is now: its class
+        and settings, the slider values and the camera, and optionally the
+        coarse grid's surfaces (as float32 arrays). Without surfaces, the
+        state can be saved with json.
+        """
+        camera = self._camera
+        if self.figs:
+            camera = self.figs[0].layout.scene.camera.to_plotly_json()
+        settings = dict(E0=self._E0, E1=self._E1, E2=self._E2, E3=self._E3, h1=self._h1, h2=self._h2, C1=self._C1,
+            C2=self._C2, continuous=self.continuous, figsize=self.figsize, refresh_delay=self.refresh_delay,
+            n_doses=self.n_doses, refine_factor=self.refine_factor, refine_delay=self.refine_delay,
+            dtype=self.dtype.str)
+        state = dict(version=STATE_VERSION, demo=type(self).__name__, settings=_plain(settings),
+            sliders=_plain(self.get_slider_values()), camera=_plain(camera) if camera else None)
+        if include_surfaces:
+            surfaces = self.current_surfaces(self.grid)
+            state["surfaces"] = dict((name, np.asarray(surfaces[name], dtype=np.float32)) for name in self.surface_names)
+        return state
+
+    def set_state(self, state):
+        """
+        Moves the sliders and camera to those of a state from get_state (or
+        load_state). Before the widgets are built (see lazy), its surfaces, if
+        any, are shown rather than computed.
+        """
+        if state.get("version", STATE_VERSION) > STATE_VERSION:
+            raise ValueError("The state was saved by a newer version of the demo")
+        values = dict(self.get_slider_values(), **state["sliders"])
+        if self.beta_slider is None:
+            self._slider_values = values
+            self._camera = state.get("camera")
+            surfaces = state.get("surfaces")
+            # Saved surfaces are only used if they cover this demo's panels and grid
+            if surfaces is not None and all(name in surfaces and np.shape(surfaces[name]) == self.grid.shape for name in self.surface_names):
+                self._startup = dict((name, surfaces[name]) for name in self.surface_names)
+            else:
+                self._startup = None
+            return
+        self.paused = True
+        for name, value in values.items():
+            getattr(self, name+"_slider").value = value
+        if state.get("camera"):
+            with ExitStack() as stack:
+                for fig in self.figs:
+                    stack.enter_context(fig.batch_update())
+                for fig in self.figs:
+                    fig.layout.scene.camera = state["camera"]
+        self.paused = False
+        self.refresh(0)
+
+    def save_state(self, path, include_surfaces=False):
+        """
+        Writes get_state(include_surfaces) to path, as JSON if it ends in
+        .json and as a compressed .npz file otherwise
+        """
+        state = self.get_state(include_surfaces)
+        if os.path.splitext(path)[1].lower() == ".json":
+            if include_surfaces:
+                raise ValueError("Surfaces can only be saved to .npz files")
+            with open(path, "w") as f:
+                json.dump(state, f)
+            return
+        surfaces = state.pop("surfaces", dict())
+        np.savez_compressed(path, state=json.dumps(state), **dict(("surface_"+name, z) for name, z in surfaces.items()))
+
+    @classmethod
+    def restore(cls, state, lazy=False, **kwargs):
+        """
+        Demo showing a state from get_state, or saved by save_state at the
+        path state
+
+        Called on Demo, this creates the class of demo the state was saved
+        from. kwargs override the saved settings or give the others (cache,
+        atlas, backend, ...). Saved surfaces are shown without computing them.
+        With lazy, the widgets are only built when the demo is first run.
+        """
+        if isinstance(state, str):
+            state = load_state(state)
+        if cls is Demo:
+            cls = DEMOS.get(state["demo"])
+            if cls is None:
+                raise ValueError("Unknown demo %r"%state["demo"])
+        settings = dict(state["settings"], **kwargs)
+        demo = cls(lazy=True, **settings)
+        demo.set_state(state)
+        if not lazy:
+            demo._build()
+        return demo
+
     def reset_to_default(self, b):
         self.paused=True
         self.E1_slider.value=self._E1
@@ -480,55 +900,71 @@ class Demo(ABC):
         self.paused=False
         self.refresh(0)
 
-    def cam_change(self, layout, camera):
+    def explore(self, x="alpha12", y="gamma12", summary="mean bliss", x_values=None, y_values=None):
+        """
+        Landscape_Explorer of this demo over the x and y sliders
+        """
+        self._build()
+        return Landscape_Explorer(self, x=x, y=y, summary=summary, x_values=x_values, y_values=y_values, figsize=self.figsize)
+
+    def contour_figure(self, levels=None, along="ratio", n_lines=64):
+        """
+        2-D plotly figure of E for the current sliders, with its isoboles at
+        levels (by default, synergy_isoboles.effect_levels towards the Emax
+        of the stronger drug). Much lighter than the 3-D figure widgets.
+        """
+        parameters = self.get_parameters()
+        E0, E1, E2 = parameters[:3]
+        if levels is None:
+            levels = effect_levels(E0, E1 if abs(E1-E0) > abs(E2-E0) else E2)
+        grid = self._grids["coarse"]
+        return contour_figure(isoboles(levels, *parameters, along=along, n_lines=n_lines), surface=self.current_surfaces(grid)["E"],
+            grid=grid, width=self.figsize, height=self.figsize)
+
+    def cam_change(self, scene, camera):
         if self.paused: return
         self.paused = True
-        for other_fig in self.figs:
-            other_fig.layout.scene.camera = camera
+        with ExitStack() as stack:
+            for other_fig in self.figs:
+                stack.enter_context(other_fig.batch_update())
+            for other_fig in self.figs:
+                if other_fig.layout.scene is not scene:
+                    other_fig.layout.scene.camera = camera
         self.paused = False
 
 class MuSyC_Demo(Demo):
-    def __init__(self, E0=1, E1=0.4, E2=0.5, E3=0.4, h1=2, h2=0.5, C1=1, C2=1, continuous=True, figsize=600):
-        super().__init__(E0=E0, E1=E1, E2=E2, E3=E3, h1=h1, h2=h2, C1=C1, C2=C2, continuous=continuous, figsize=figsize)
+    surface_names = ("E",)
+
+    def __init__(self, E0=1, E1=0.4, E2=0.5, E3=0.4, h1=2, h2=0.5, C1=1, C2=1, continuous=True, figsize=600, **options):
+        super().__init__(E0=E0, E1=E1, E2=E2, E3=E3, h1=h1, h2=h2, C1=C1, C2=C2, continuous=continuous, figsize=figsize, **options)
 
     #override
     def _setup_figs(self):
-        d1 = self.d1
-        d2 = self.d2
+        grid = self.grid
 
-        E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21 = self.get_parameters()
-        E = self._MuSyC_E(d1, d2, E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21)
+        surfaces = self._startup_surfaces()
 
-        self.fig = self.get_fig_widget(d1, d2, E, "Dose Response", width=self.figsize, height=self.figsize, z_title="E (MuSyC)")
+        self.fig = self.get_fig_widget(grid, surfaces["E"], width=self.figsize, height=self.figsize, **SURFACE_PANELS["E"])
         self.figs.append(self.fig)
         self.fig_widget_rows.append(self.fig)
 
-    def _update_figs(self, d1, d2, E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21):
-        E = self._MuSyC_E(d1,d2, E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21)
-        E[np.isnan(E)] = 0
-        self.fig.data[0].z = E
+    def _update_figs(self, surfaces):
+        self._set_surface(0, surfaces["E"])
 
 class MuSyC_Bliss_Demo(Demo):
-    def __init__(self, E0=1, E1=0.4, E2=0.5, E3=0.4, h1=2, h2=0.5, C1=1, C2=1, continuous=False, figsize=400):
-        super().__init__(E0=E0, E1=E1, E2=E2, E3=E3, h1=h1, h2=h2, C1=C1, C2=C2, continuous=continuous, figsize=figsize)
-        
+    surface_names = ("E", "bliss")
 
     #override
     def _setup_figs(self):
-        d1 = self.d1
-        d2 = self.d2
+        from ipywidgets import widgets
+        grid = self.grid
         
-        E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21 = self.get_parameters()
-        E = self._MuSyC_E(d1, d2, E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21)
-        bs = self._bliss(d1, d2, E, E0, E1, E2, h1, h2, C1, C2)
+        surfaces = self._startup_surfaces()
         
-        self.fig = self.get_fig_widget(d1, d2, E, "Dose Response", width=self.figsize, height=self.figsize, z_title="E (MuSyC)")
+        self.fig = self.get_fig_widget(grid, surfaces["E"], width=self.figsize, height=self.figsize, **SURFACE_PANELS["E"])
         self.figs.append(self.fig)
 
-        bliss_fig = self.get_fig_widget(d1, d2, bs, "Bliss Excess", zlim=(-0.5,0.5),
-                                clim=(-0.5,0.5), width=self.figsize,
-                                height=self.figsize, center_on_zero=True,
-                                cmap="PRGn", z_title="Bliss Excess")
+        bliss_fig = self.get_fig_widget(grid, surfaces["bliss"], width=self.figsize, height=self.figsize, **SURFACE_PANELS["bliss"])
         
         
         self.figs.append(bliss_fig)
@@ -537,35 +973,28 @@ class MuSyC_Bliss_Demo(Demo):
             [self.fig, bliss_fig]
         ))
 
-    def _update_figs(self, d1, d2, E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21):
-        E = self._MuSyC_E(d1,d2, E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21)
-        bs = self._bliss(d1,d2, E, E0, E1, E2, h1, h2, C1, C2)
-        E[np.isnan(E)] = 0
-        self.fig.data[0].z = E
-        self.figs[1].data[0].z = bs
+    def _update_figs(self, surfaces):
+        self._set_surface(0, surfaces["E"])
+        self._set_surface(1, surfaces["bliss"])
 
 class MuSyC_Loewe_Demo(Demo):
-    def __init__(self, E0=1, E1=0.5, E2=0.5, E3=0.5, h1=2, h2=0.5, C1=1, C2=1, continuous=False, figsize=400):
-        super().__init__(E0=E0, E1=E1, E2=E2, E3=E3, h1=h1, h2=h2, C1=C1, C2=C2, continuous=continuous, figsize=figsize)
+    surface_names = ("E", "loewe")
+
+    def __init__(self, E0=1, E1=0.5, E2=0.5, E3=0.5, h1=2, h2=0.5, C1=1, C2=1, continuous=False, figsize=400, **options):
+        super().__init__(E0=E0, E1=E1, E2=E2, E3=E3, h1=h1, h2=h2, C1=C1, C2=C2, continuous=continuous, figsize=figsize, **options)
         
 
     #override
     def _setup_figs(self):
-        d1 = self.d1
-        d2 = self.d2
+        from ipywidgets import widgets
+        grid = self.grid
         
-        E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21 = self.get_parameters()
-        E = self._MuSyC_E(d1, d2, E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21)
-        with np.errstate(divide='ignore', invalid='ignore'):
-            ls = -np.log(self._loewe(d1, d2, E, E0, E1, E2, h1, h2, C1, C2))
+        surfaces = self._startup_surfaces()
 
-        self.fig = self.get_fig_widget(d1, d2, E, "Dose Response", width=self.figsize, height=self.figsize, z_title="E (MuSyC)")
+        self.fig = self.get_fig_widget(grid, surfaces["E"], width=self.figsize, height=self.figsize, **SURFACE_PANELS["E"])
         self.figs.append(self.fig)
 
-        loewe_fig = self.get_fig_widget(d1, d2, ls, "Loewe Synergy", zlim=(-3,3),
-                                clim=(-3,3), width=self.figsize,
-                                height=self.figsize, center_on_zero=True,
-                                cmap="PRGn", z_title="-log(loewe)")
+        loewe_fig = self.get_fig_widget(grid, surfaces["loewe"], width=self.figsize, height=self.figsize, **SURFACE_PANELS["loewe"])
         
         
         self.figs.append(loewe_fig)
@@ -574,44 +1003,28 @@ class MuSyC_Loewe_Demo(Demo):
             [self.fig, loewe_fig]
         ))
 
-    def _update_figs(self, d1, d2, E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21):
-        E = self._MuSyC_E(d1, d2, E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21)
-        with np.errstate(divide='ignore', invalid='ignore'):
-            ls = -np.log(self._loewe(d1, d2, E, E0, E1, E2, h1, h2, C1, C2))
-
-        E[np.isnan(E)] = 0
-        self.fig.data[0].z = E
-        self.figs[1].data[0].z = ls
+    def _update_figs(self, surfaces):
+        self._set_surface(0, surfaces["E"])
+        self._set_surface(1, surfaces["loewe"])
 
 class All_Demo(Demo):
+    surface_names = ("E", "bliss", "loewe")
 
     #override
     def _setup_figs(self):
-        d1 = self.d1
-        d2 = self.d2
+        from ipywidgets import widgets
+        grid = self.grid
         
-        E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21 = self.get_parameters()
-        E = self._MuSyC_E(d1, d2, E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21)
-        bs = self._bliss(d1, d2, E, E0, E1, E2, h1, h2, C1, C2)
-        
-
-        with np.errstate(divide='ignore', invalid='ignore'):
-            ls = -np.log(self._loewe(d1, d2, E, E0, E1, E2, h1, h2, C1, C2))
+        surfaces = self._startup_surfaces()
 
-        self.fig = self.get_fig_widget(d1, d2, E, "Dose Response", width=self.figsize, height=self.figsize, z_title="E (MuSyC)")
+        self.fig = self.get_fig_widget(grid, surfaces["E"], width=self.figsize, height=self.figsize, **SURFACE_PANELS["E"])
         
 
-        bliss_fig = self.get_fig_widget(d1, d2, bs, "Bliss Excess", zlim=(-0.5,0.5),
-                        clim=(-0.5,0.5), width=self.figsize,
-                        height=self.figsize, center_on_zero=True,
-                        cmap="PRGn", z_title="Bliss Excess")
+        bliss_fig = self.get_fig_widget(grid, surfaces["bliss"], width=self.figsize, height=self.figsize, **SURFACE_PANELS["bliss"])
         
 
 
-        loewe_fig = self.get_fig_widget(d1, d2, ls, "Loewe Synergy", zlim=(-3,3),
-                                clim=(-3,3), width=self.figsize,
-                                height=self.figsize, center_on_zero=True,
-                                cmap="PRGn", z_title="-log(loewe)")
+        loewe_fig = self.get_fig_widget(grid, surfaces["loewe"], width=self.figsize, height=self.figsize, **SURFACE_PANELS["loewe"])
         
         
         self.figs.append(self.fig)
@@ -623,14 +1036,116 @@ class All_Demo(Demo):
             [bliss_fig, loewe_fig]
         ))
 
-    def _update_figs(self, d1, d2, E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21):
-        E = self._MuSyC_E(d1, d2, E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21)
-        bs = self._bliss(d1, d2, E, E0, E1, E2, h1, h2, C1, C2)
-        with np.errstate(divide='ignore', invalid='ignore'):
-            ls = -np.log(self._loewe(d1, d2, E, E0, E1, E2, h1, h2, C1, C2))
-
-        E[np.isnan(E)] = 0
-        self.fig.data[0].z = E
-        self.figs[1].data[0].z = bs
-        self.figs[2].data[0].z = ls
-        
\ No newline at end of file
+    def _update_figs(self, surfaces):
+        self._set_surface(0, surfaces["E"])
+        self._set_surface(1, surfaces["bliss"])
+        self._set_surface(2, surfaces["loewe"])
+
+# Demo classes by name, for Demo.restore
+DEMOS = dict((cls.__name__, cls) for cls in (MuSyC_Demo, MuSyC_Bliss_Demo, MuSyC_Loewe_Demo, All_Demo))
+
+class Landscape_Explorer:
+    """
+    Heatmap of a summary of the surfaces (see synergy_landscape.SUMMARIES)
+    over a 2-D slice of two sliders of demo, linked to demo's surfaces
+
+    Clicking the heatmap moves demo's x and y sliders there, and a marker
+    follows those sliders. The other sliders are held at their values when
+    the landscape was computed, and the Recompute button recomputes it at
+    their current values. Every summary is computed at once, so switching
+    between them is immediate.
+    """
+    def __init__(self, demo, x="alpha12", y="gamma12", summary="mean bliss", x_values=None, y_values=None, figsize=400):
+        self.demo = demo
+        self.x_name = x
+        self.y_name = y
+        self.x_values = models.slider_lattice(x) if x_values is None else np.asarray(x_values, dtype=float)
+        self.y_values = models.slider_lattice(y) if y_values is None else np.asarray(y_values, dtype=float)
+        self.summary = summary
+        self.figsize = figsize
+        self.landscapes = None
+        self.fig = None
+        self.widgets = None
+
+        self.compute()
+        self._setup_widget()
+
+    def compute(self):
+        """
+        Recomputes the landscapes at demo's current slider values
+        """
+        grid = self.demo.grid
+        self.landscapes = landscape(grid.d1, grid.d2, self.x_name, self.y_name, self.x_values, self.y_values,
+            slider_values=self.demo.get_slider_values(), E0=self.demo._E0, dtype=self.demo.dtype)
+        if self.fig is not None:
+            self._draw()
+
+    def _setup_widget(self):
+        from ipywidgets import widgets
+        import plotly.graph_objects as go
+
+        x_slider = getattr(self.demo, self.x_name+"_slider")
+        y_slider = getattr(self.demo, self.y_name+"_slider")
+        self.fig = go.FigureWidget(data=[
+            go.Heatmap(x=self.x_values, y=self.y_values, colorbar=dict(thickness=15)),
+            go.Scatter(x=[x_slider.value], y=[y_slider.value], mode="markers", hoverinfo="skip",
+                marker=dict(symbol="x", size=12, color="limegreen")),
+        ])
+        self.fig.update_layout(
+            autosize=False,
+            width=self.figsize,
+            height=self.figsize,
+            margin=dict(l=10, r=10, b=10, t=30),
+            xaxis_title=x_slider.description.rstrip(":"),
+            yaxis_title=y_slider.description.rstrip(":"),
+            font=dict(size=10),
+        )
+        self._draw()
+        self.fig.data[0].on_click(self._on_click)
+        x_slider.observe(self._move_marker, names="value")
+        y_slider.observe(self._move_marker, names="value")
+
+        summary = widgets.Dropdown(options=list(SUMMARIES), value=self.summary, description="Summary:")
+        summary.observe(self._set_summary, names="value")
+        recompute = widgets.Button(description="Recompute")
+        recompute.on_click(lambda b: self.compute())
+        self.widgets = widgets.VBox([widgets.HBox([summary, recompute]), self.fig])
+
+    def _draw(self):
+        z = self.landscapes[self.summary]
+        with self.fig.batch_update():
+            heatmap = self.fig.data[0]
+            heatmap.z = z
+            if self.summary in SIGNED_SUMMARIES:
+                heatmap.colorscale = "PRGn"
+                heatmap.zmid = 0
+            else:
+                heatmap.colorscale = "viridis"
+                heatmap.zmid = None
+            self.fig.layout.title = self.summary
+
+    def _set_summary(self, change):
+        self.summary = change["new"]
+        self._draw()
+
+    def _on_click(self, trace, points, selector):
+        if points.xs:
+            self.select(points.xs[0], points.ys[0])
+
+    def _move_marker(self, change):
+        with self.fig.batch_update():
+            self.fig.data[1].x = [getattr(self.demo, self.x_name+"_slider").value]
+            self.fig.data[1].y = [getattr(self.demo, self.y_name+"_slider").value]
+
+    def select(self, x, y):
+        """
+        Moves demo's sliders to (x, y) and refreshes its surfaces once
+        """
+        self.demo.paused = True
+        getattr(self.demo, self.x_name+"_slider").value = x
+        getattr(self.demo, self.y_name+"_slider").value = y
+        self.demo.paused = False
+        self.demo.refresh(0)
+
+    def run(self):
+        return self.widgets
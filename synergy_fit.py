@@ -0,0 +1,249 @@
+#    Copyright (C) 2021 David J. Wooten
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Fitting the Hill and MuSyC models to measured dose response data
+
+Positive parameters (h, C, alpha, gamma) are fit as log10 values with a
+Levenberg-Marquardt least squares solver, using the analytic MuSyC Jacobian.
+MuSyC fits are seeded from Hill fits to the single-drug data, and fit_many
+spreads many drug pairs over a process pool.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import synergy_models as models
+
+PARAMETER_NAMES = models.PARAMETER_NAMES
+HILL_PARAMETER_NAMES = ("E0", "Emax", "h", "C")
+
+# Bounds on the log10 of each positive parameter. alpha is bounded away from
+# 0, so a Loewe-like (alpha=0) fit comes out as alpha ~ 1e-6.
+_LOG10_BOUNDS = dict(h=(-2., 2.), C=(-10., 10.), alpha=(-6., 6.), gamma=(-3., 3.))
+
+class FitResult:
+    """
+    Best fit parameters, in the order of names, plus the optional bootstrap
+    samples and confidence intervals (rows are the lower and upper bounds)
+    """
+    def __init__(self, names, parameters, sse, converged, n_points):
+        self.names = names
+        self.parameters = tuple(parameters)
+        self.sse = sse
+        self.converged = converged
+        self.n_points = n_points
+        self.bootstrap = None
+        self.ci = None
+
+    def as_dict(self):
+        return dict(zip(self.names, self.parameters))
+
+    def __repr__(self):
+        params = ", ".join("%s=%.4g"%(k, v) for k, v in zip(self.names, self.parameters))
+        return "FitResult(%s, sse=%.4g)"%(params, self.sse)
+
+def _levenberg_marquardt(model, y, x0, lower, upper, jac=None, max_iter=200, tol=1e-10):
+    """
+    Minimizes sum((model(x) - y)**2) over lower <= x <= upper
+
+    model maps parameter sets of shape (m, k) to predictions of shape (m, n).
+    jac(x) returns the model value and its (n, k) Jacobian at x; by default it
+    is estimated by forward differences, evaluated in one batched model call.
+    """
+    if jac is None:
+        def jac(x):
+            steps = 1e-6*(1+np.abs(x))
+            F = model(np.vstack([x, x + np.diag(steps)]))
+            return F[0], ((F[1:] - F[0]) / steps[:,np.newaxis]).T
+
+    x = np.clip(np.asarray(x0, dtype=float), lower, upper)
+    r = model(x[np.newaxis])[0] - y
+    sse = r.dot(r)
+    lam = 1e-3
+    converged = False
+    for i in range(max_iter):
+        f, J = jac(x)
+        r = f - y
+        g = J.T.dot(r)
+        A = J.T.dot(J)
+        scale = np.diag(A).copy()
+        scale[scale <= 0] = 1
+
+        while lam < 1e10:
+            try:
+                step = np.linalg.solve(A + lam*np.diag(scale), -g)
+            except np.linalg.LinAlgError:
+                lam *= 10
+                continue
+            x_new = np.clip(x + step, lower, upper)
+            r_new = model(x_new[np.newaxis])[0] - y
+            sse_new = r_new.dot(r_new)
+            if sse_new < sse: break
+            lam *= 10
+        else:
+            # No step reduces the error any further
+            converged = True
+            break
+
+        improvement = sse - sse_new
+        x, sse = x_new, sse_new
+        lam = max(lam/10, 1e-12)
+        if improvement <= tol*(sse+tol):
+            converged = True
+            break
+    return x, sse, converged
+
+def _hill_from_x(X):
+    return X[...,0], X[...,1], np.power(10., X[...,2]), np.power(10., X[...,3])
+
+def _musyc_from_x(X):
+    return tuple(X[...,i] for i in range(4)) + tuple(np.power(10., X[...,i]) for i in range(4, 12))
+
+def _musyc_bounds():
+    log_bounds = [_LOG10_BOUNDS[k] for k in ("h", "h", "C", "C", "alpha", "alpha", "gamma", "gamma")]
+    lower = np.array([-np.inf]*4 + [b[0] for b in log_bounds])
+    upper = np.array([np.inf]*4 + [b[1] for b in log_bounds])
+    return lower, upper
+
+def _bootstrap(fit, model, y, x, n_bootstrap, ci, seed, to_parameters):
+    """
+    Residual bootstrap: refits fitted + resampled residuals, starting at x
+    """
+    rng = np.random.default_rng(seed)
+    fitted = model(x[np.newaxis])[0]
+    residuals = y - fitted
+    samples = np.empty((n_bootstrap, len(x)))
+    for b in range(n_bootstrap):
+        y_b = fitted + rng.choice(residuals, size=len(residuals), replace=True)
+        samples[b] = np.asarray(to_parameters(fit(y_b, x)[0]))
+    bounds = np.percentile(samples, [50*(1-ci), 50*(1+ci)], axis=0)
+    return samples, bounds
+
+def _clean(*arrays):
+    arrays = [np.asarray(a, dtype=float).flatten() for a in arrays]
+    keep = np.all([np.isfinite(a) for a in arrays], axis=0)
+    return [a[keep] for a in arrays]
+
+def fit_hill(d, E, n_bootstrap=0, ci=0.95, seed=None, x0=None):
+    """
+    Fits E = E0 + (Emax-E0)*d^h/(C^h+d^h) to single-drug data
+
+    x0 is an optional starting point (E0, Emax, log10(h), log10(C)).
+    """
+    d, E = _clean(d, E)
+    if x0 is None:
+        E0 = np.mean(E[d==d.min()])
+        Emax = np.mean(E[d==d.max()])
+        positive = d[d>0]
+        if len(positive) == 0:
+            C = 1.
+        else:
+            # Start C at the dose whose response is closest to halfway
+            C = positive[np.argmin(np.abs(E[d>0] - (E0+Emax)/2))]
+        x0 = (E0, Emax, 0., np.log10(C))
+
+    lower = np.array([-np.inf, -np.inf, _LOG10_BOUNDS["h"][0], _LOG10_BOUNDS["C"][0]])
+    upper = np.array([np.inf, np.inf, _LOG10_BOUNDS["h"][1], _LOG10_BOUNDS["C"][1]])
+
+    def model(X):
+        E0, Emax, h, C = [p[:,np.newaxis] for p in _hill_from_x(X)]
+        return models.hill_E(d, E0, Emax, h, C)
+
+    def fit(y, start):
+        return _levenberg_marquardt(model, y, start, lower, upper)
+
+    x, sse, converged = fit(E, x0)
+    result = FitResult(HILL_PARAMETER_NAMES, _hill_from_x(x), sse, converged, len(E))
+    if n_bootstrap > 0:
+        result.bootstrap, result.ci = _bootstrap(fit, model, E, x, n_bootstrap, ci, seed, _hill_from_x)
+    return result
+
+def _musyc_initial_guess(d1, d2, E):
+    """
+    Seeds the MuSyC fit from Hill fits to each drug's single-drug data
+    """
+    x0 = np.array([np.max(E), np.min(E), np.min(E), np.min(E), 0., 0., 0., 0., 0., 0., 0., 0.])
+    E0 = []
+    for i, (d, other) in enumerate(((d1, d2), (d2, d1))):
+        mask = (other==0)
+        if np.sum(mask) < 4 or len(np.unique(d[mask])) < 3: continue
+        hill = fit_hill(d[mask], E[mask])
+        e0, emax, h, C = hill.parameters
+        E0.append(e0)
+        x0[1+i] = emax
+        x0[4+i] = np.log10(h)
+        x0[6+i] = np.log10(C)
+    if E0: x0[0] = np.mean(E0)
+
+    # Start E3 at the response to the highest dose combination
+    combo = (d1>0) & (d2>0)
+    if combo.any():
+        top = combo & (d1==d1[combo].max()) & (d2==d2[combo].max())
+        x0[3] = np.mean(E[top]) if top.any() else min(x0[1], x0[2])
+    else:
+        x0[3] = min(x0[1], x0[2])
+    return x0
+
+def fit_MuSyC(d1, d2, E, n_bootstrap=0, ci=0.95, seed=None, x0=None):
+    """
+    Fits the twelve MuSyC parameters (see Demo.get_parameters) to (d1, d2, E)
+
+    The fit starts from Hill fits to the single-drug data (points where the
+    other dose is 0) with alpha = gamma = 1, unless x0 is given (in the order
+    of PARAMETER_NAMES, with positive parameters as log10 values). With
+    n_bootstrap > 0, a residual bootstrap gives ci-level confidence intervals.
+    """
+    d1, d2, E = _clean(d1, d2, E)
+    if len(E) == 0:
+        raise ValueError("No finite (d1, d2, E) points to fit")
+    if x0 is None:
+        x0 = _musyc_initial_guess(d1, d2, E)
+    lower, upper = _musyc_bounds()
+
+    def model(X):
+        return models.MuSyC_E_batch(d1, d2, *_musyc_from_x(X))
+
+    def jac(x):
+        E, J = models.MuSyC_E_jacobian(d1, d2, *_musyc_from_x(x))
+        return E, J.T
+
+    def fit(y, start):
+        return _levenberg_marquardt(model, y, start, lower, upper, jac=jac)
+
+    x, sse, converged = fit(E, x0)
+    result = FitResult(PARAMETER_NAMES, _musyc_from_x(x), sse, converged, len(E))
+    if n_bootstrap > 0:
+        result.bootstrap, result.ci = _bootstrap(fit, model, E, x, n_bootstrap, ci, seed, _musyc_from_x)
+    return result
+
+def _fit_job(job):
+    i, (d1, d2, E), n_bootstrap, ci, seed = job
+    return fit_MuSyC(d1, d2, E, n_bootstrap=n_bootstrap, ci=ci, seed=np.random.SeedSequence(seed, spawn_key=(i,)))
+
+def fit_many(datasets, n_bootstrap=0, ci=0.95, seed=0, processes=None, chunksize=16):
+    """
+    Fits fit_MuSyC to each (d1, d2, E) in datasets using a process pool
+
+    Dataset i is bootstrapped with child i of SeedSequence(seed), so results are
+    reproducible whatever the number of processes. Results are returned in the
+    order of datasets. processes=1 fits in the calling process.
+    """
+    jobs = ((i, data, n_bootstrap, ci, seed) for i, data in enumerate(datasets))
+    if processes == 1:
+        return [_fit_job(job) for job in jobs]
+    with ProcessPoolExecutor(processes) as pool:
+        return list(pool.map(_fit_job, jobs, chunksize=chunksize))
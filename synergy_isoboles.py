@@ -0,0 +1,211 @@
+#    Copyright (C) 2021 David J. Wooten
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Isoboles (iso-effect contours) of MuSyC surfaces, and 2-D plots of them
+
+Each isobole is found as the doses where E crosses its effect level along a
+set of lines through log dose space: fixed-ratio rays d2 = r*d1 (as in an
+isobologram experiment), or lines of fixed d1 or fixed d2. Every line is
+scanned for the first crossing, which is then refined by the Illinois method
+in log dose, for every parameter set, effect level and line at once (see
+synergy_models.MuSyC_E_paired). Each isobole comes out as a polyline of one
+point per line, NaN where the line does not cross it.
+"""
+
+import numpy as np
+
+import synergy_models as models
+
+ALONG = ("ratio", "d1", "d2")
+
+class Isoboles:
+    """
+    Isoboles of P parameter sets at L effect levels, one point per line
+
+    d1 and d2 (shape (P, L, n_lines)) are the doses of each isobole's points,
+    NaN where a line does not reach the level. single1 and single2 (shape
+    (P, L)) are the doses of each drug alone that reach the level (NaN if it
+    cannot), where the isobole meets the axes. combination_index is
+    d1/single1 + d2/single2 at each point, which is the Loewe index there (< 1
+    is synergistic).
+    """
+    def __init__(self, levels, d1, d2, single1, single2):
+        self.levels = levels
+        self.d1 = d1
+        self.d2 = d2
+        self.single1 = single1
+        self.single2 = single2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.combination_index = d1/single1[..., np.newaxis] + d2/single2[..., np.newaxis]
+
+    def polyline(self, p=0, level=0):
+        """
+        Points (k, 2) of (d1, d2) on isobole level of parameter set p, leaving
+        out the lines that do not reach it
+        """
+        points = np.stack([self.d1[p, level], self.d2[p, level]], axis=-1)
+        return points[np.all(np.isfinite(points), axis=-1)]
+
+    def __repr__(self):
+        return "Isoboles(%d parameter sets, %d levels, %d lines)"%self.d1.shape
+
+def _lines(along, n_lines, d1_range, d2_range):
+    """
+    Lines (x0, y0, ux, uy, t_low, t_high) through log10 dose space, whose
+    points are (x0 + ux*t, y0 + uy*t) for t_low <= t <= t_high
+    """
+    lo1, hi1 = np.log10(d1_range)
+    lo2, hi2 = np.log10(d2_range)
+    zeros, ones = np.zeros(n_lines), np.ones(n_lines)
+    if along == "d2":
+        # Fixed d1, searching along d2
+        return np.linspace(lo1, hi1, n_lines), zeros, zeros, ones, np.full(n_lines, lo2), np.full(n_lines, hi2)
+    if along == "d1":
+        return zeros, np.linspace(lo2, hi2, n_lines), ones, zeros, np.full(n_lines, lo1), np.full(n_lines, hi1)
+    # log10(d2/d1) for rays that each cross the box for at least a tenth of a decade
+    log_r = np.linspace(lo2-hi1+0.1, hi2-lo1-0.1, n_lines)
+    return zeros, log_r, ones, ones, np.maximum(lo1, lo2-log_r), np.minimum(hi1, hi2-log_r)
+
+def _doses(lines, t):
+    x0, y0, ux, uy = lines[:4]
+    return np.power(10., x0 + ux*t), np.power(10., y0 + uy*t)
+
+def _crossings(levels, params, lines, n_scan, xtol, max_iter):
+    """
+    t of the first crossing of each level along each line, with shape (P, L,
+    n_lines), for parameter sets params of shape (P,)
+    """
+    P, L, n = len(params[0]), len(levels), len(lines[0])
+    t_low, t_high = lines[4], lines[5]
+    T = t_low[:,np.newaxis] + (t_high - t_low)[:,np.newaxis]*np.linspace(0, 1, n_scan)
+    d1, d2 = _doses([x[:,np.newaxis] for x in lines], T)
+    E = models.MuSyC_E_paired(np.broadcast_to(d1.reshape(-1), (P, n*n_scan)), np.broadcast_to(d2.reshape(-1), (P, n*n_scan)), *params)
+    F = E.reshape(P, 1, n, n_scan) - levels[:,np.newaxis,np.newaxis]
+
+    # The first scan interval over which E - level changes sign (or hits 0)
+    change = (np.signbit(F[..., 1:]) != np.signbit(F[..., :-1])) | (F[..., :-1] == 0)
+    found = change.any(axis=-1)
+    first = np.argmax(change, axis=-1)
+    a = np.take_along_axis(np.broadcast_to(T, F.shape), first[..., np.newaxis], axis=-1)[..., 0]
+    b = np.take_along_axis(np.broadcast_to(T, F.shape), first[..., np.newaxis]+1, axis=-1)[..., 0]
+    fa = np.take_along_axis(F, first[..., np.newaxis], axis=-1)[..., 0]
+    fb = np.take_along_axis(F, first[..., np.newaxis]+1, axis=-1)[..., 0]
+
+    # Illinois: regula falsi, halving the value kept at one end twice in a row
+    side = np.zeros(a.shape, dtype=np.int8)
+    done = ~found | (fa == 0)
+    c = np.where(fa == 0, a, b)
+    line_params = [np.broadcast_to(x, (P, L, n)) for x in lines[:4]]
+    for i in range(max_iter):
+        if done.all(): break
+        with np.errstate(divide='ignore', invalid='ignore'):
+            c = np.where(done, c, (a*fb - b*fa)/(fb - fa))
+        c = np.where(np.isfinite(c), c, (a + b)/2)
+        d1, d2 = _doses(line_params, c)
+        fc = models.MuSyC_E_paired(d1.reshape(P, -1), d2.reshape(P, -1), *params).reshape(P, L, n) - levels[:,np.newaxis]
+        left = np.signbit(fc) == np.signbit(fa)
+        update = ~done
+        # c replaces a when it is on a's side of the root, and b otherwise
+        a, fa = np.where(update & left, c, a), np.where(update & left, fc, fa)
+        b, fb = np.where(update & ~left, c, b), np.where(update & ~left, fc, fb)
+        fb = np.where(update & left & (side == 1), fb/2, fb)
+        fa = np.where(update & ~left & (side == -1), fa/2, fa)
+        side = np.where(update, np.where(left, 1, -1), side).astype(np.int8)
+        done |= (np.abs(b - a) < xtol) | (fc == 0)
+    return np.where(found, c, np.nan)
+
+def isoboles(levels, E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21, along="ratio", n_lines=64,
+        d1_range=(1e-3, 1e3), d2_range=(1e-3, 1e3), n_scan=32, xtol=1e-10, max_iter=60, max_memory=2**27):
+    """
+    Isoboles of MuSyC surfaces at each of the effect levels (values of E)
+
+    Each parameter is a scalar or an array of shape (P,). along is "ratio"
+    (fixed-ratio rays), "d1" (lines of fixed d2) or "d2" (lines of fixed d1),
+    with n_lines lines spread over the doses in d1_range and d2_range. Each
+    line is scanned at n_scan doses for its first crossing of each level, so
+    a level crossed twice between two scan doses is missed. Crossings are
+    refined to xtol in log10 dose. Parameter sets are processed in chunks
+    whose work arrays stay under max_memory bytes. Returns Isoboles.
+    """
+    if along not in ALONG:
+        raise ValueError("along must be one of %s"%", ".join(ALONG))
+    levels = np.atleast_1d(np.asarray(levels, dtype=float))
+    params = np.broadcast_arrays(*[np.atleast_1d(np.asarray(p, dtype=float)) for p in (E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21)])
+    if params[0].ndim != 1:
+        raise ValueError("Parameters must be scalars or 1-D arrays")
+    P, L = len(params[0]), len(levels)
+    lines = _lines(along, n_lines, d1_range, d2_range)
+
+    t = np.empty((P, L, n_lines))
+    # The scan holds E and its differences from each level, and the monomials
+    rows = max(1, int(max_memory // (8*n_lines*max(n_scan*(12 + L), 16*L))))
+    for start in range(0, P, rows):
+        chunk = slice(start, start+rows)
+        t[chunk] = _crossings(levels, [p[chunk] for p in params], lines, n_scan, xtol, max_iter)
+    d1, d2 = _doses(lines, t)
+
+    E0, E1, E2, E3, h1, h2, C1, C2 = [p[:,np.newaxis] for p in params[:8]]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        single1 = models.hill_inv(np.broadcast_to(levels, (P, L)).copy(), E0, E1, h1, C1)
+        single2 = models.hill_inv(np.broadcast_to(levels, (P, L)).copy(), E0, E2, h2, C2)
+    return Isoboles(levels, d1, d2, single1, single2)
+
+def effect_levels(E0, Emax, fractions=(0.1, 0.25, 0.5, 0.75, 0.9)):
+    """
+    Effects a fraction of the way from E0 to Emax, e.g. 0.5 for the EC50
+    isobole of a drug whose maximal effect is Emax
+    """
+    return E0 + (Emax - E0)*np.asarray(fractions, dtype=float)
+
+def contour_figure(isobole_set, p=0, surface=None, grid=None, width=500, height=500, title="Isoboles"):
+    """
+    2-D plotly figure of the isoboles of parameter set p, on log dose axes
+
+    With a surface (e.g. E from synergy_demo_backend.compute_surfaces) on the
+    DoseGrid grid, it is drawn as a filled contour plot under the isoboles.
+    """
+    import plotly.graph_objects as go
+    data = []
+    if surface is not None:
+        positive = (grid.d1[0] > 0, grid.d2[:,0] > 0)
+        data.append(go.Contour(x=grid.d1[0][positive[0]], y=grid.d2[:,0][positive[1]],
+            z=np.asarray(surface)[np.ix_(positive[1], positive[0])], colorscale="viridis", opacity=0.6,
+            contours_coloring="heatmap", colorbar=dict(thickness=15, title="E"), hoverinfo="skip"))
+    for level in range(len(isobole_set.levels)):
+        data.append(go.Scatter(x=isobole_set.d1[p, level], y=isobole_set.d2[p, level], mode="lines",
+            name="E = %.3g"%isobole_set.levels[level], connectgaps=False))
+    figure = go.Figure(data=data)
+    figure.update_layout(width=width, height=height, title=title, xaxis_type="log", yaxis_type="log",
+        xaxis_title="Drug 1", yaxis_title="Drug 2", margin=dict(l=10, r=10, b=10, t=30), font=dict(size=10))
+    return figure
+
+def isobologram_figure(isobole_set, p=0, width=500, height=500, title="Isobologram"):
+    """
+    Isobologram of parameter set p: each isobole with its doses divided by the
+    single-drug doses reaching its level, so the Loewe additive isobole is the
+    line from (1, 0) to (0, 1) at every level. Points below it are synergistic.
+    """
+    import plotly.graph_objects as go
+    data = [go.Scatter(x=[0, 1], y=[1, 0], mode="lines", name="Loewe additive", line=dict(color="gray", dash="dash"))]
+    for level in range(len(isobole_set.levels)):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x = isobole_set.d1[p, level]/isobole_set.single1[p, level]
+            y = isobole_set.d2[p, level]/isobole_set.single2[p, level]
+        data.append(go.Scatter(x=x, y=y, mode="lines", name="E = %.3g"%isobole_set.levels[level], connectgaps=False))
+    figure = go.Figure(data=data)
+    figure.update_layout(width=width, height=height, title=title, xaxis_title="d1 / D1(E)", yaxis_title="d2 / D2(E)",
+        margin=dict(l=10, r=10, b=10, t=30), font=dict(size=10))
+    return figure
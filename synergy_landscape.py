@@ -0,0 +1,120 @@
+#    Copyright (C) 2021 David J. Wooten
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Scalar summaries of the surfaces over 2-D slices of slider space
+
+A landscape holds two sliders on grids of values and the rest fixed, and
+reduces the E, Bliss and -log(Loewe) surfaces of every slider state to
+numbers such as the mean Bliss excess or the volume under the Loewe surface.
+Every state of the slice is evaluated together with the *_batch functions of
+synergy_models.
+"""
+
+import numpy as np
+
+import synergy_models as models
+from surface_atlas import DEFAULT_SLIDER_VALUES
+
+def _dose_weights(d1, d2):
+    """
+    Area (in log10 dose units) around each dose of a rectangular grid, by the
+    trapezoidal rule, and 0 for the single-drug doses
+    """
+    weights = np.ones(len(d1))
+    for d in (d1, d2):
+        doses = np.unique(d[d > 0])
+        if len(doses) < 2:
+            w = np.ones(len(doses))
+        else:
+            w = np.gradient(np.log10(doses))
+            w[[0, -1]] /= 2
+        index = np.minimum(np.searchsorted(doses, d), len(doses)-1)
+        weights *= np.where(d > 0, w[index], 0.)
+    return weights
+
+def _mean(values, combination):
+    values = values[:, combination]
+    defined = np.isfinite(values)
+    return np.where(defined, values, 0).sum(axis=1)/np.maximum(defined.sum(axis=1), 1)
+
+def _volume(values, weights):
+    return np.where(np.isfinite(values), values, 0) @ weights
+
+# Name: (surface it summarizes, function of that surface of shape (P, N), the
+# dose weights of _dose_weights and the mask of combination doses). Loewe
+# summaries skip the doses where -log(Loewe) is undefined or infinite.
+SUMMARIES = dict([
+    ("max E", ("E", lambda E, weights, combination: np.nanmax(E, axis=1))),
+    ("min E", ("E", lambda E, weights, combination: np.nanmin(E, axis=1))),
+    ("mean bliss", ("bliss", lambda B, weights, combination: _mean(B, combination))),
+    ("bliss volume", ("bliss", lambda B, weights, combination: _volume(B, weights))),
+    ("mean loewe", ("loewe", lambda L, weights, combination: _mean(L, combination))),
+    ("loewe volume", ("loewe", lambda L, weights, combination: _volume(L, weights))),
+    ("loewe undefined", ("loewe", lambda L, weights, combination: np.isnan(L[:, combination]).mean(axis=1))),
+])
+
+# Summaries whose sign tells synergy from antagonism, drawn centered on 0
+SIGNED_SUMMARIES = ("mean bliss", "bliss volume", "mean loewe", "loewe volume")
+
+def landscape(d1, d2, x_name, y_name, x_values=None, y_values=None, slider_values=None, E0=1,
+        summaries=tuple(SUMMARIES), dtype=np.float64, max_memory=2**28):
+    """
+    Summaries of the surfaces at every (x, y) slider state of a 2-D slice
+
+    d1 and d2 are the flattened doses of a rectangular grid (e.g. a DoseGrid's
+    d1.flatten() and d2.flatten()). x_name and y_name are sliders of
+    synergy_models.SLIDER_RANGES, which take x_values and y_values (by default
+    every value the slider can take). The other sliders are held at
+    slider_values[name], or else at surface_atlas.DEFAULT_SLIDER_VALUES[name].
+    Returns a dict by summary name (see SUMMARIES) of arrays of shape
+    (len(y_values), len(x_values)). States are evaluated in chunks whose
+    surfaces stay under max_memory bytes.
+    """
+    d1 = np.asarray(d1, dtype=float).flatten()
+    d2 = np.asarray(d2, dtype=float).flatten()
+    slider_values = dict(DEFAULT_SLIDER_VALUES, **(slider_values or dict()))
+    if x_values is None:
+        x_values = models.slider_lattice(x_name)
+    if y_values is None:
+        y_values = models.slider_lattice(y_name)
+    x_values = np.asarray(x_values, dtype=float)
+    y_values = np.asarray(y_values, dtype=float)
+    unknown = [s for s in summaries if s not in SUMMARIES]
+    if unknown:
+        raise ValueError("Unknown summaries %s"%", ".join(unknown))
+    surfaces = set(SUMMARIES[s][0] for s in summaries)
+
+    weights = _dose_weights(d1, d2)
+    combination = (d1 > 0) & (d2 > 0)
+    x, y = [v.flatten() for v in np.meshgrid(x_values, y_values)]
+    results = dict((s, np.empty(len(x))) for s in summaries)
+
+    # E plus up to two synergy surfaces, and the work arrays of MuSyC_E
+    chunk = max(1, int(max_memory // (16*np.dtype(dtype).itemsize*len(d1))))
+    for start in range(0, len(x), chunk):
+        sliders = dict(slider_values, **{x_name: x[start:start+chunk], y_name: y[start:start+chunk]})
+        E0_, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21 = models.parameters_from_sliders(E0, **sliders)
+        block = dict()
+        block["E"] = models.MuSyC_E_batch(d1, d2, E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21,
+            max_memory=max_memory, dtype=dtype)
+        if "bliss" in surfaces:
+            block["bliss"] = models.bliss_batch(d1, d2, block["E"], E0, E1, E2, h1, h2, C1, C2, max_memory=max_memory)
+        if "loewe" in surfaces:
+            block["loewe"] = models.loewe_batch(d1, d2, block["E"], E0, E1, E2, h1, h2, C1, C2, max_memory=max_memory)
+        for s in summaries:
+            surface, summary = SUMMARIES[s]
+            results[s][start:start+chunk] = summary(block[surface], weights, combination)
+    return dict((s, v.reshape(len(y_values), len(x_values))) for s, v in results.items())
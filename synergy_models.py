@@ -0,0 +1,673 @@
+#    Copyright (C) 2021 David J. Wooten
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Dose response and synergy models behind the interactive demos
+
+Everything here is a stateless function of numpy arrays, so the models can be
+used (and imported) without ipywidgets or plotly.
+"""
+
+import numpy as np
+
+# Each (state, monomial) coefficient of _musyc_log_coefficients is the sum of
+# these terms from _musyc_log_terms
+_MUSYC_COEFFICIENT_TERMS = (
+    (0, 0, ("L100", "L100", "lS")),
+    (0, 1, ("lr1g", "L100", "lP12")),
+    (0, 2, ("lr2g", "L100", "lP21")),
+
+    (1, 3, ("lr1", "L100", "lS")),
+    (1, 4, ("lr1g", "lr1", "lP12")),
+    (1, 8, ("lr1g", "lr2", "lP12")),
+
+    (2, 5, ("lr1", "lr2g", "lP21")),
+    (2, 7, ("L100", "lr2", "lS")),
+    (2, 9, ("lr2g", "lr2", "lP21")),
+
+    (3, 5, ("lr1", "lr2g", "L100")),
+    (3, 6, ("lr1g", "lr1", "lr2g")),
+    (3, 8, ("lr1g", "L100", "lr2")),
+    (3, 10, ("lr1g", "lr2g", "lr2")),
+)
+
+def _musyc_log_terms(h1, h2, C1, C2, gamma12, gamma21):
+    L100 = np.log(100.)
+    lr1 = L100 - h1*np.log(C1)
+    lr2 = L100 - h2*np.log(C2)
+    lP21 = gamma21*L100
+    lP12 = gamma12*L100
+    return dict(L100=L100, lr1=lr1, lr2=lr2, lP21=lP21, lP12=lP12,
+        lS=np.logaddexp(lP21, lP12), lr1g=gamma21*lr1, lr2g=gamma12*lr2)
+
+def _musyc_log_coefficients(h1, h2, C1, C2, gamma12, gamma21):
+    """
+    Log-coefficients of the unnormalized MuSyC state occupancies
+
+    Rows are the states (U, A1, A2, A12). Columns are the monomials
+    1, a21, a12, x1, x1*a21, x1*a12, x1*a21*a12, x2, x2*a21, x2*a12, x2*a21*a12
+    where x1 = d1^h1, x2 = d2^h2, a21 = (alpha21*d1)^(gamma21*h1) and
+    a12 = (alpha12*d2)^(gamma12*h2). Each state's occupancy is its row dotted
+    with the monomials, divided by the sum over all rows. Entries are kept in
+    log space because r^gamma overflows at the ends of the slider ranges.
+    Array parameters give an array of shape (..., 4, 11).
+    """
+    terms = _musyc_log_terms(h1, h2, C1, C2, gamma12, gamma21)
+    logM = np.full(np.broadcast(*terms.values()).shape+(4, 11), -np.inf)
+    for s, c, names in _MUSYC_COEFFICIENT_TERMS:
+        logM[..., s, c] = sum(terms[k] for k in names)
+    return logM
+
+def _musyc_log_monomials(d1, d2, h1, h2, alpha12, alpha21, gamma12, gamma21, dtype=np.float64):
+    """
+    Logs of the 11 monomials used by _musyc_log_coefficients, stacked on axis 0
+    """
+    d1 = np.asarray(d1, dtype=dtype)
+    d2 = np.asarray(d2, dtype=dtype)
+    L = np.empty((11,)+np.broadcast(d1, d2, h1, h2, alpha12, alpha21, gamma12, gamma21).shape, dtype=dtype)
+    with np.errstate(divide='ignore'):
+        np.log(d1, out=L[3])
+        np.log(d2, out=L[7])
+        np.log(alpha21*d1, out=L[1])
+        np.log(alpha12*d2, out=L[2])
+    L[0] = 0
+    L[3] *= h1
+    L[7] *= h2
+    L[1] *= gamma21*h1
+    L[2] *= gamma12*h2
+    np.add(L[3], L[1], out=L[4])
+    np.add(L[3], L[2], out=L[5])
+    np.add(L[4], L[2], out=L[6])
+    np.add(L[7], L[1], out=L[8])
+    np.add(L[7], L[2], out=L[9])
+    np.add(L[8], L[2], out=L[10])
+    return L
+
+# Order of the parameters of MuSyC_E
+PARAMETER_NAMES = ("E0", "E1", "E2", "E3", "h1", "h2", "C1", "C2", "alpha12", "alpha21", "gamma12", "gamma21")
+
+def get_beta(E0, E1, E2, E3):
+    minE = np.minimum(E1, E2)
+    return (minE-E3)/(E0-minE)
+
+def get_E3(E0, E1, E2, beta):
+    minE = np.minimum(E1, E2)
+    return minE - beta*(E0-minE)
+
+# (min, max, step) of the demo sliders. C, h, alpha and gamma sliders are log10
+# values, and the lowest alpha slider value stands for alpha = 0.
+SLIDER_RANGES = dict(
+    E1=(0., 1., 0.05),
+    E2=(0., 1., 0.05),
+    h1=(-1., 1., 0.2),
+    h2=(-1., 1., 0.2),
+    C1=(-2., 2., 0.2),
+    C2=(-2., 2., 0.2),
+    alpha12=(-3., 3., 0.2),
+    alpha21=(-3., 3., 0.2),
+    gamma12=(-1.4, 1.6, 0.2),
+    gamma21=(-1.4, 1.6, 0.2),
+    beta=(-1., 1., 0.05),
+)
+
+def slider_lattice(name):
+    """
+    Every value the named slider can take
+    """
+    low, high, step = SLIDER_RANGES[name]
+    return np.round(low + step*np.arange(int(round((high-low)/step))+1), 10)
+
+def parameters_from_sliders(E0, E1, E2, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21, beta):
+    """
+    Converts slider values (scalars or arrays) to the MuSyC_E parameters
+    (E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21)
+    """
+    def alpha(value):
+        return np.where(np.asarray(value) <= SLIDER_RANGES["alpha12"][0], 0., np.power(10., value))[()]
+
+    return (E0, E1, E2, get_E3(E0, E1, E2, beta),
+        np.power(10., h1), np.power(10., h2), np.power(10., C1), np.power(10., C2),
+        alpha(alpha12), alpha(alpha21), np.power(10., gamma12), np.power(10., gamma21))
+
+def hill_inv(E, E0, Emax, h, C):
+    E_ratio = (E-E0)/(Emax-E)
+    d = np.float_power(E_ratio, 1./h)*C
+    d[E_ratio<0] = np.nan
+    return d
+
+def hill_E(d, E0, Emax, h, C):
+    dh = np.power(d,h)
+    return E0 + (Emax-E0)*dh/(C**h+dh)
+
+def hill_fraction(d, h, C):
+    """
+    Fraction of the way from E0 to Emax a single drug gets at dose d
+    """
+    dh = d**h
+    return dh/(C**h+dh)
+
+def _musyc_scaled_occupancies(h1, h2, C1, C2, gamma12, gamma21):
+    """
+    Coefficients of the unnormalized MuSyC state occupancies over the 11
+    monomials (see _musyc_log_coefficients), and the log of the largest of
+    each monomial's coefficients, colmax
+
+    Each monomial's coefficients are scaled by exp(-colmax), so the log of
+    every monomial must have colmax added to it.
+    """
+    logM = _musyc_log_coefficients(h1, h2, C1, C2, gamma12, gamma21)
+    colmax = logM.max(axis=-2)
+    return np.exp(logM - colmax[...,np.newaxis,:]), colmax
+
+def _musyc_mix_coefficients(E0, E1, E2, E3, M):
+    """
+    Coefficients of the MuSyC numerator (K[..., 0, :]) and denominator
+    (K[..., 1, :]) over the 11 monomials, from the occupancy coefficients M
+    """
+    E = np.stack(np.broadcast_arrays(E0, E1, E2, E3), axis=-1)[...,np.newaxis,:]
+    K = np.empty(np.broadcast_shapes(E.shape[:-2], M.shape[:-2])+(2, 11))
+    np.matmul(E, M, out=K[...,:1,:])
+    K[...,1,:] = M.sum(axis=-2)
+    return K
+
+def _musyc_scaled_coefficients(E0, E1, E2, E3, h1, h2, C1, C2, gamma12, gamma21):
+    """
+    Coefficients of the MuSyC numerator (K[:, 0]) and denominator (K[:, 1])
+    over the 11 monomials, for parameters of shape (P,), and colmax (see
+    _musyc_scaled_occupancies)
+    """
+    M, colmax = _musyc_scaled_occupancies(h1, h2, C1, C2, gamma12, gamma21)
+    return _musyc_mix_coefficients(E0, E1, E2, E3, M), colmax
+
+def MuSyC_terms(d1, d2, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21, dtype=np.float64):
+    """
+    The parts of MuSyC_E that do not depend on E0..E3, for MuSyC_E_from_terms
+
+    These are the scaled occupancy coefficients of each parameter set and the
+    exponentiated monomials at each dose, which hold all of the exp and log
+    work. The dose dependent work is done in dtype. Parameters may be scalars
+    or arrays of a common shape.
+    """
+    d1, d2 = np.broadcast_arrays(np.asarray(d1, dtype=float), np.asarray(d2, dtype=float))
+    params = np.broadcast_arrays(*[np.asarray(p, dtype=float) for p in (h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21)])
+    pshape = params[0].shape
+    P = int(np.prod(pshape))
+    h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21 = [p.reshape(P, 1) for p in params]
+
+    M, colmax = _musyc_scaled_occupancies(*[p[:,0] for p in (h1, h2, C1, C2, gamma12, gamma21)])
+
+    L = _musyc_log_monomials(d1.reshape(-1), d2.reshape(-1),
+        *[p.astype(dtype) for p in (h1, h2, alpha12, alpha21, gamma12, gamma21)], dtype=dtype)
+    L += colmax.T[:,:,np.newaxis].astype(dtype)
+    L -= L.max(axis=0)
+    np.exp(L, out=L)
+    L = L.transpose(1,0,2).reshape(pshape+(11, -1))
+    return M.reshape(pshape+(4, 11)), L, d1.shape
+
+def MuSyC_E_from_terms(terms, E0, E1, E2, E3, out=None):
+    """
+    MuSyC_E from the terms given by MuSyC_terms and E0..E3, in the dtype of the
+    terms
+
+    E0..E3 may be scalars or arrays that broadcast with the parameters the
+    terms were made for. Only a matrix product over the doses is left to do,
+    so E can be recomputed cheaply for new efficacies.
+    """
+    M, L, dshape = terms
+    K = _musyc_mix_coefficients(*[np.asarray(p, dtype=float) for p in (E0, E1, E2, E3)], M)
+    pshape = K.shape[:-2]
+    ND = np.matmul(K.astype(L.dtype), L)
+    if out is None:
+        out = np.empty(pshape+dshape, dtype=L.dtype)
+    return np.divide(ND[...,0,:].reshape(pshape+dshape), ND[...,1,:].reshape(pshape+dshape), out=out)
+
+def MuSyC_E(d1, d2, E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21, out=None, dtype=None):
+    """
+    Evaluates the two-drug MuSyC dose response surface
+
+    E is the ratio of two polynomials over the same 11 monomials (see
+    _musyc_log_coefficients), so each power term is computed once and the
+    numerator and shared denominator come from a single matrix product.
+    Parameters may be scalars or arrays of a common shape P, in which case the
+    result has shape P + the broadcast shape of d1 and d2. If out is given, E
+    is written into it. The dose dependent work is done in dtype (by default
+    that of out, or float64); float32 is enough for display and is faster on
+    large grids, see precision_error.
+    """
+    if dtype is None:
+        dtype = np.float64 if out is None else out.dtype
+    terms = MuSyC_terms(d1, d2, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21, dtype=dtype)
+    return MuSyC_E_from_terms(terms, E0, E1, E2, E3, out=out)
+
+def MuSyC_E_paired(d1, d2, E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21, dtype=np.float64):
+    """
+    Evaluates MuSyC surfaces of P parameter sets, each at its own doses
+
+    Each parameter is a scalar or an array of shape (P,), and d1 and d2 have
+    shape (P, N): row p of the doses is evaluated with parameter set p, where
+    MuSyC_E would evaluate every parameter set at every dose. Returns E with
+    shape (P, N).
+    """
+    d1, d2 = np.broadcast_arrays(np.asarray(d1, dtype=float), np.asarray(d2, dtype=float))
+    if d1.ndim != 2:
+        raise ValueError("d1 and d2 must have shape (P, N)")
+    params = np.broadcast_arrays(*[np.atleast_1d(np.asarray(p, dtype=float)) for p in (E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21)])
+    E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21 = [np.broadcast_to(p, d1.shape[:1]) for p in params]
+
+    K, colmax = _musyc_scaled_coefficients(E0, E1, E2, E3, h1, h2, C1, C2, gamma12, gamma21)
+    L = _musyc_log_monomials(d1, d2, *[p[:,np.newaxis].astype(dtype) for p in (h1, h2, alpha12, alpha21, gamma12, gamma21)], dtype=dtype)
+    L += colmax.T[:,:,np.newaxis].astype(dtype)
+    L -= L.max(axis=0)
+    np.exp(L, out=L)
+    ND = np.matmul(K.astype(dtype), L.transpose(1,0,2))
+    return ND[:,0]/ND[:,1]
+
+def _musyc_log_term_derivatives(h1, h2, C1, C2, gamma12, gamma21, terms):
+    """
+    Derivatives of the _musyc_log_terms with respect to ln(h1), ln(h2),
+    ln(C1), ln(C2), ln(gamma12) and ln(gamma21). Terms not listed are constant.
+    """
+    lC1 = np.log(C1)
+    lC2 = np.log(C2)
+    lP21, lP12, lS = terms["lP21"], terms["lP12"], terms["lS"]
+    return (
+        dict(lr1=-h1*lC1, lr1g=-gamma21*h1*lC1),
+        dict(lr2=-h2*lC2, lr2g=-gamma12*h2*lC2),
+        dict(lr1=-h1, lr1g=-gamma21*h1),
+        dict(lr2=-h2, lr2g=-gamma12*h2),
+        dict(lP12=lP12, lS=lP12*np.exp(lP12-lS), lr2g=terms["lr2g"]),
+        dict(lP21=lP21, lS=lP21*np.exp(lP21-lS), lr1g=terms["lr1g"]),
+    )
+
+# Monomials (columns of _musyc_log_coefficients) containing x1, x2, a21 and a12
+_MONOMIAL_FACTORS = np.zeros((4, 11), dtype=bool)
+_MONOMIAL_FACTORS[0, [3, 4, 5, 6]] = True
+_MONOMIAL_FACTORS[1, [7, 8, 9, 10]] = True
+_MONOMIAL_FACTORS[2, [1, 4, 6, 8, 10]] = True
+_MONOMIAL_FACTORS[3, [2, 5, 6, 9, 10]] = True
+
+def MuSyC_E_jacobian(d1, d2, E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21, log_scale=True):
+    """
+    Evaluates the MuSyC surface together with its parameter derivatives
+
+    Returns E and J, where J[i] is the derivative of E with respect to the i-th
+    parameter, in the order of the MuSyC_E arguments. The derivatives reuse
+    the monomials and coefficients of the surface itself, so the cost is a
+    small multiple of one MuSyC_E call. With log_scale, derivatives for h, C,
+    alpha and gamma are taken with respect to their log10 values, as on the
+    demo sliders; these stay finite at alpha = 0. Otherwise they are with
+    respect to the parameters themselves, and are NaN for an alpha of 0.
+    Parameters must be scalars.
+    """
+    d1, d2 = np.broadcast_arrays(np.asarray(d1, dtype=float), np.asarray(d2, dtype=float))
+    dshape = d1.shape
+    d1 = d1.reshape(-1)
+    d2 = d2.reshape(-1)
+    w = np.array([E0, E1, E2, E3], dtype=float)
+
+    terms = _musyc_log_terms(h1, h2, C1, C2, gamma12, gamma21)
+    logM = _musyc_log_coefficients(h1, h2, C1, C2, gamma12, gamma21)
+    colmax = logM.max(axis=0)
+    M = np.exp(logM - colmax)
+
+    m = _musyc_log_monomials(d1, d2, h1, h2, alpha12, alpha21, gamma12, gamma21)
+    m += colmax[:,np.newaxis]
+    m -= m.max(axis=0)
+    np.exp(m, out=m)
+
+    # dE/dp = sum over (state s, monomial c) of (w_s - E) * d(M_sc*m_c)/dp / D.
+    # For coefficient parameters d(M_sc)/dp = M_sc*G_sc, and for dose-dependent
+    # parameters d(m_c)/dp = m_c*(sum of the derivatives of the logs of the x1,
+    # x2, a21 and a12 factors present in c).
+    K = [M]
+    for dterms in _musyc_log_term_derivatives(h1, h2, C1, C2, gamma12, gamma21, terms):
+        G = np.zeros((4, 11))
+        for s, c, names in _MUSYC_COEFFICIENT_TERMS:
+            G[s, c] = sum(dterms.get(k, 0.) for k in names)
+        MG = M*G
+        K += [np.dot(w, MG), MG.sum(axis=0)]
+    kN = np.dot(w, M)
+    kD = M.sum(axis=0)
+    K += [kN*_MONOMIAL_FACTORS, kD*_MONOMIAL_FACTORS]
+    S = np.dot(np.vstack(K), m)
+
+    occupancy = S[:4]
+    D = occupancy.sum(axis=0)
+    occupancy /= D
+    E = np.dot(w, occupancy)
+    coef = (S[4:16:2] - E*S[5:16:2])/D
+    R = (S[16:20] - E*S[20:24])/D
+
+    with np.errstate(divide='ignore'):
+        ld1 = np.log(d1)
+        ld2 = np.log(d2)
+        la21 = np.log(alpha21*d1)
+        la12 = np.log(alpha12*d2)
+    # The affected monomials vanish where these logs are -inf
+    lx1 = h1*np.where(d1>0, ld1, 0)
+    lx2 = h2*np.where(d2>0, ld2, 0)
+    la = gamma21*h1*np.where(alpha21*d1>0, la21, 0)
+    lb = gamma12*h2*np.where(alpha12*d2>0, la12, 0)
+
+    J = np.empty((12, len(E)))
+    J[:4] = occupancy
+    J[4] = coef[0] + lx1*R[0] + la*R[2]
+    J[5] = coef[1] + lx2*R[1] + lb*R[3]
+    J[6] = coef[2]
+    J[7] = coef[3]
+    J[8] = gamma12*h2*R[3]
+    J[9] = gamma21*h1*R[2]
+    J[10] = coef[4] + lb*R[3]
+    J[11] = coef[5] + la*R[2]
+
+    if log_scale:
+        J[4:] *= np.log(10.)
+    else:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            J[4:] /= np.array([h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21], dtype=float)[:,np.newaxis]
+    return E.reshape(dshape), J.reshape((12,)+dshape)
+
+def bliss(d1, d2, E, E0, E1, E2, h1, h2, C1, C2):
+    return bliss_from_fractions(hill_fraction(d1, h1, C1), hill_fraction(d2, h2, C2), E, E0, E1, E2, (d1==0) | (d2==0))
+
+def bliss_from_fractions(f1, f2, E, E0, E1, E2, single):
+    """
+    bliss from the single drug Hill fractions f1 and f2 (see hill_fraction),
+    set to 0 where single (the points where one dose is 0) is True
+    """
+    E1_alone = E0 + (E1-E0)*f1
+    E2_alone = E0 + (E2-E0)*f2
+    synergy = E1_alone*E2_alone - E
+    synergy[..., single] = 0
+    return synergy
+
+def loewe(d1, d2, E, E0, E1, E2, h1, h2, C1, C2):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d1_alone = hill_inv(E, E0, E1, h1, C1)
+        d2_alone = hill_inv(E, E0, E2, h2, C2)
+        synergy = d1/d1_alone + d2/d2_alone
+    synergy[..., (d1==0) | (d2==0)] = 1
+    return synergy
+
+# Classes of points returned by loewe_log
+LOEWE_DEFINED = 0
+LOEWE_SINGLE_DRUG = 1   # one of the doses is 0, so the index is 1
+LOEWE_INFINITE = 2      # E == E0, which a single drug reaches at dose 0
+LOEWE_UNDEFINED = 3     # E is outside the range of a drug's Hill curve
+
+def _loewe_log_terms(d, E, E0, Emax, h, C):
+    """
+    log(d/hill_inv(E, E0, Emax, h, C)) for one drug, and a mask of where
+    hill_inv is undefined
+
+    The term is +inf where E == E0 (hill_inv is 0) and -inf where E == Emax
+    (hill_inv is infinite) or d == 0. Elsewhere, the values where it is
+    undefined are meaningless and must be masked out. log((E-E0)/(Emax-E)) and
+    log(d/C) are taken as differences of logs, so they cannot overflow or
+    underflow in float32, and each log is only taken where its argument is
+    nonzero. log(d) - log(C) is formed in float64.
+    """
+    num = np.subtract(E, E0)
+    den = np.subtract(Emax, E)
+    d = np.asarray(d)
+    shape = np.broadcast(d, num, den, h, C).shape
+    dtype = np.result_type(num, den, d, h, C)
+    nonzero_num, nonzero_den = num != 0, den != 0
+    defined = ((num >= 0) & (den > 0)) | ((num <= 0) & (den < 0)) | (~nonzero_den & nonzero_num)
+
+    log_num = np.full(num.shape, -np.inf, dtype=dtype)
+    np.log(np.abs(num), out=log_num, where=nonzero_num)
+    log_den = np.full(den.shape, -np.inf, dtype=dtype)
+    np.log(np.abs(den), out=log_den, where=nonzero_den)
+    log_ratio = np.full(np.broadcast(num, den).shape, np.nan, dtype=dtype)
+    np.subtract(log_num, log_den, out=log_ratio, where=nonzero_num | nonzero_den)
+    np.divide(log_ratio, h, out=log_ratio)
+
+    log_d = np.full(d.shape, -np.inf)
+    np.log(d, out=log_d, where=d != 0)
+    t = np.full(shape, -np.inf, dtype=dtype)
+    nonzero_dose = np.broadcast_to(d != 0, shape)
+    np.subtract(log_d, np.log(np.asarray(C, dtype=np.float64)), out=t, where=nonzero_dose, casting="same_kind")
+    np.subtract(t, log_ratio, out=t, where=nonzero_dose)
+    return t, np.broadcast_to(~defined, shape)
+
+def loewe_log(d1, d2, E, E0, E1, E2, h1, h2, C1, C2):
+    """
+    -log of the Loewe index (positive is synergistic), and the class of each
+    point (LOEWE_DEFINED, LOEWE_SINGLE_DRUG, LOEWE_INFINITE or LOEWE_UNDEFINED)
+
+    The single drug doses giving E are inverted in log space and summed with
+    logaddexp, so neither they nor the index are formed directly and cannot
+    overflow near E0 or Emax. -log(Loewe) is 0 where a dose is 0, -inf where
+    E == E0 and NaN where the index is undefined, as given by the classes.
+    Unlike -log(loewe(...)), E == E1 or E2 counts as reached at an infinite
+    dose of that drug, whichever side of E0 E1 and E2 are on.
+    """
+    t1, undefined1 = _loewe_log_terms(d1, E, E0, E1, h1, C1)
+    t2, undefined2 = _loewe_log_terms(d2, E, E0, E2, h2, C2)
+    t1, t2 = np.broadcast_arrays(t1, t2)
+    undefined = undefined1 | undefined2
+    result = np.full(t1.shape, np.nan, dtype=np.result_type(t1, t2))
+    np.logaddexp(t1, t2, out=result, where=~(undefined | np.isnan(t1) | np.isnan(t2)))
+    np.negative(result, out=result)
+    shape = result.shape
+
+    classes = np.full(shape, LOEWE_DEFINED, dtype=np.int8)
+    classes[result == -np.inf] = LOEWE_INFINITE
+    classes[undefined] = LOEWE_UNDEFINED
+    single = np.broadcast_to((np.asarray(d1) == 0) | (np.asarray(d2) == 0), shape)
+    classes[single] = LOEWE_SINGLE_DRUG
+    result[single] = 0
+    return result, classes
+
+def _precision_error(a, b):
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    finite = np.isfinite(a) & np.isfinite(b)
+    mismatched = ~finite & ~((a == b) | (np.isnan(a) & np.isnan(b)))
+    return dict(max_error=float(np.max(np.abs(a[finite] - b[finite]), initial=0.)), mismatched=int(mismatched.sum()))
+
+def precision_error(d1, d2, E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21, dtype=np.float32):
+    """
+    Compares the MuSyC_E, bliss and -log(Loewe) surfaces computed in dtype
+    with those computed in float64
+
+    Returns a dict by surface name of dicts with max_error, the largest
+    absolute difference where both are finite, and mismatched, the number of
+    points that are NaN or infinite in only one of them (or infinite with
+    different signs). For Loewe these are points where E is within rounding
+    error of E0, E1 or E2.
+    """
+    errors = dict()
+    params = (E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21)
+    hill = (E0, E1, E2, h1, h2, C1, C2)
+    low = [float(p) for p in params]
+    low_hill = [float(p) for p in hill]
+    d1_low, d2_low = np.asarray(d1, dtype=dtype), np.asarray(d2, dtype=dtype)
+
+    E = MuSyC_E(d1, d2, *params)
+    E_low = MuSyC_E(d1_low, d2_low, *low, dtype=dtype)
+    errors["E"] = _precision_error(E, E_low)
+    errors["bliss"] = _precision_error(bliss(d1, d2, E, *hill), bliss(d1_low, d2_low, E_low, *low_hill))
+    errors["loewe"] = _precision_error(loewe_log(d1, d2, E, *hill)[0], loewe_log(d1_low, d2_low, E_low, *low_hill)[0])
+    return errors
+
+def _batch_args(d1, d2, *params):
+    d1 = np.asarray(d1, dtype=float)
+    d2 = np.asarray(d2, dtype=float)
+    if d1.ndim != 1 or d1.shape != d2.shape:
+        raise ValueError("d1 and d2 must be 1-D arrays of the same length")
+    params = np.broadcast_arrays(*[np.atleast_1d(np.asarray(p, dtype=float)) for p in params])
+    if params[0].ndim != 1:
+        raise ValueError("Parameters must be scalars or 1-D arrays")
+    return d1, d2, [p[:,np.newaxis] for p in params]
+
+def _batch_surface(E):
+    E = np.asarray(E)
+    dtype = np.float32 if E.dtype == np.float32 else np.float64
+    return E.astype(dtype, copy=False), dtype
+
+def _batch_chunks(n_sets, n_doses, max_memory, row_bytes=16):
+    # MuSyC evaluation holds ~11 work arrays per parameter set, plus outputs
+    rows = max(1, int(max_memory // (row_bytes*8*max(n_doses, 1))))
+    for start in range(0, n_sets, rows):
+        yield slice(start, start+rows)
+
+def MuSyC_E_batch(d1, d2, E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21, max_memory=2**27, dtype=np.float64):
+    """
+    Evaluates MuSyC surfaces for many parameter sets in one call
+
+    Each parameter is a scalar or an array of shape (P,), and d1 and d2 are
+    dose arrays of shape (N,). Returns E with shape (P, N) and the given dtype.
+    Parameter sets are processed in chunks whose work arrays stay under
+    max_memory bytes.
+    """
+    d1, d2, params = _batch_args(d1, d2, E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21)
+    E = np.empty((params[0].shape[0], d1.shape[0]), dtype=dtype)
+    for rows in _batch_chunks(E.shape[0], E.shape[1], max_memory):
+        MuSyC_E(d1, d2, *[p[rows,0] for p in params], out=E[rows])
+    return E
+
+def bliss_batch(d1, d2, E, E0, E1, E2, h1, h2, C1, C2, max_memory=2**27):
+    """
+    Bliss excess for many surfaces, E of shape (P, N) (see MuSyC_E_batch),
+    computed in float32 if E is float32 and in float64 otherwise
+    """
+    d1, d2, params = _batch_args(d1, d2, E0, E1, E2, h1, h2, C1, C2)
+    E, dtype = _batch_surface(E)
+    shape = np.broadcast(E, params[0], d1).shape
+    E = np.broadcast_to(E, shape)
+    synergy = np.empty(shape, dtype=dtype)
+    d1, d2 = d1.astype(dtype), d2.astype(dtype)
+    for rows in _batch_chunks(synergy.shape[0], synergy.shape[1], max_memory, row_bytes=4):
+        synergy[rows] = bliss(d1, d2, E[rows], *[p[rows].astype(dtype) for p in params])
+    return synergy
+
+def loewe_batch(d1, d2, E, E0, E1, E2, h1, h2, C1, C2, max_memory=2**27):
+    """
+    -log(Loewe) for many surfaces, E of shape (P, N) (see MuSyC_E_batch),
+    computed in float32 if E is float32 and in float64 otherwise
+
+    Like the Loewe panels of the demos, this returns -log of the Loewe index,
+    so positive values are synergistic.
+    """
+    d1, d2, params = _batch_args(d1, d2, E0, E1, E2, h1, h2, C1, C2)
+    E, dtype = _batch_surface(E)
+    shape = np.broadcast(E, params[0], d1).shape
+    E = np.broadcast_to(E, shape)
+    synergy = np.empty(shape, dtype=dtype)
+    d1, d2 = d1.astype(dtype), d2.astype(dtype)
+    for rows in _batch_chunks(synergy.shape[0], synergy.shape[1], max_memory, row_bytes=8):
+        synergy[rows] = loewe_log(d1, d2, E[rows], *[p[rows].astype(dtype) for p in params])[0]
+    return synergy
+
+def _logsumexp(x, axis=0):
+    top = x.max(axis=axis, keepdims=True)
+    top[~np.isfinite(top)] = 0
+    with np.errstate(divide='ignore'):
+        return np.log(np.exp(x - top).sum(axis=axis)) + top.squeeze(axis)
+
+def _log_steady_state(logQ):
+    """
+    Log steady state probabilities of continuous time Markov chains
+
+    logQ[i, j, ...] is the log of the rate from state i to state j (the
+    diagonal is ignored), and the result has shape logQ.shape[1:]. Uses the
+    Grassmann-Taksar-Heyman elimination, which has no subtractions and so
+    keeps full relative accuracy; every state except 0 must have a path to a
+    lower state.
+    """
+    logQ = logQ.copy()
+    n_states = logQ.shape[0]
+    logS = np.empty(logQ.shape[1:])
+    for k in range(n_states-1, 0, -1):
+        logS[k] = _logsumexp(logQ[k, :k])
+        update = logQ[:k, k, np.newaxis] + (logQ[k, :k] - logS[k])
+        np.logaddexp(logQ[:k, :k], update, out=logQ[:k, :k])
+
+    logp = np.empty(logQ.shape[1:])
+    logp[0] = 0
+    for k in range(1, n_states):
+        logp[k] = _logsumexp(logp[:k] + logQ[:k, k]) - logS[k]
+    return logp - _logsumexp(logp)
+
+def musyc_transitions(n_drugs):
+    """
+    The binding transitions of the n_drugs MuSyC model, as arrays (state, drug)
+
+    States are bitmasks of the bound drugs (bit i set when drug i is bound), so
+    there are 2**n_drugs of them, from 0 (unaffected) to 2**n_drugs - 1 (bound
+    to every drug). Each transition binds drug to state, giving state | 1<<drug.
+    """
+    states = np.arange(2**n_drugs)
+    return np.nonzero((states[:,np.newaxis] >> np.arange(n_drugs)) & 1 == 0)
+
+def MuSyC_E_ndrug(doses, E, h, C, alpha=None, gamma=None, max_memory=2**27):
+    """
+    Evaluates the MuSyC dose response surface for any number of drugs
+
+    doses is a sequence of N dose arrays (broadcast together), E holds the
+    effect of each of the 2**N states (see musyc_transitions, so E[0] is E0),
+    and h and C hold each drug's Hill slope and EC50. alpha[s, i] and
+    gamma[s, i] modulate the potency and cooperativity of drug i binding in
+    state s; entries for states with no drug bound, or where drug i is already
+    bound, are ignored, and both default to 1. Drug i binds at rate
+    r_i**g*(a*d_i)**(g*h_i) and unbinds at rate 100**g, with r_i = 100/C_i**h_i,
+    a = alpha[s, i] and g = gamma[s, i].
+
+    The steady state of the 2**N state transition system is solved at all
+    dose points at once by elimination in log space (see _log_steady_state),
+    in chunks whose work arrays stay under max_memory bytes. For two drugs
+    this equals MuSyC_E with alpha[2, 0] = alpha21, alpha[1, 1] = alpha12 (and
+    the same for gamma) and E = (E0, E1, E2, E3). Parameters must be scalars or arrays of one value
+    per drug or state.
+    """
+    doses = np.broadcast_arrays(*[np.asarray(d, dtype=float) for d in doses])
+    n_drugs = len(doses)
+    n_states = 2**n_drugs
+    dshape = doses[0].shape
+    doses = np.stack([d.reshape(-1) for d in doses])
+    E = np.asarray(E, dtype=float)
+    h = np.broadcast_to(np.asarray(h, dtype=float), (n_drugs,))
+    C = np.broadcast_to(np.asarray(C, dtype=float), (n_drugs,))
+    if E.shape != (n_states,):
+        raise ValueError("E must hold one effect for each of the %d states"%n_states)
+    alpha = np.ones((n_states, n_drugs)) if alpha is None else np.asarray(alpha, dtype=float)
+    gamma = np.ones((n_states, n_drugs)) if gamma is None else np.asarray(gamma, dtype=float)
+
+    state, drug = musyc_transitions(n_drugs)
+    bound = state | (1 << drug)
+    a = np.where(state == 0, 1., alpha[state, drug])
+    g = np.where(state == 0, 1., gamma[state, drug])
+    L100 = np.log(100.)
+    log_r = L100 - h*np.log(C)
+
+    # Log rates of binding (per dose point) and unbinding (constant) on each
+    # transition. Rates span hundreds of orders of magnitude at the ends of
+    # the slider ranges, so the steady state is found in log space.
+    with np.errstate(divide='ignore'):
+        log_on = g[:,np.newaxis]*(log_r[drug,np.newaxis] + h[drug,np.newaxis]*np.log(a[:,np.newaxis]*doses[drug]))
+    log_off = g*L100
+
+    n = doses.shape[1]
+    result = np.empty(n)
+    chunk = max(1, int(max_memory // (8*(3*n_states**2 + len(state)))))
+    for start in range(0, n, chunk):
+        logQ = np.full((n_states, n_states, min(chunk, n-start)), -np.inf)
+        logQ[state, bound] = log_on[:, start:start+chunk]
+        logQ[bound, state] = log_off[:,np.newaxis]
+        occupancy = np.exp(_log_steady_state(logQ))
+        result[start:start+chunk] = np.dot(E, occupancy)
+    return result.reshape(dshape)
@@ -0,0 +1,279 @@
+#    Copyright (C) 2021 David J. Wooten
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Numba compiled versions of the surface functions in synergy_models
+
+MuSyC_E, bliss, loewe and loewe_log take the same arguments and give the same
+results as those in synergy_models, but each is a single parallel loop over
+the doses, so no intermediate arrays are made. Only scalar parameters are
+compiled; arrays of parameter sets are passed on to synergy_models.
+
+Compiled functions are cached on disk (in __pycache__, or in NUMBA_CACHE_DIR
+if that is set), so they are only compiled the first time they are used.
+Without numba installed, this module can still be imported and its functions
+are the synergy_models ones. Use get_backend to choose between them.
+
+numba's default threading layer cannot run two parallel loops at once, so
+calls into the compiled loops from different threads (e.g. a demo's refresh
+scheduler and its kernel's main thread) are serialized by a lock.
+"""
+
+import sys
+import threading
+
+import numpy as np
+
+import synergy_models as models
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+available = numba is not None
+
+# Held while a compiled parallel loop runs
+_kernel_lock = threading.Lock()
+
+if available:
+    _jit = numba.njit(parallel=True, cache=True, error_model='numpy')
+    _prange = numba.prange
+    _LOG2 = np.log(2.)
+
+    @numba.njit(cache=True, error_model='numpy')
+    def _logaddexp(a, b):
+        # As np.logaddexp, including a == b == +-inf
+        if a == b:
+            return a + _LOG2
+        diff = a - b
+        if diff > 0:
+            return a + np.log1p(np.exp(-diff))
+        if diff <= 0:
+            return b + np.log1p(np.exp(diff))
+        return diff
+
+    @numba.njit(cache=True, error_model='numpy')
+    def _hill_E(d, E0, Emax, h, C):
+        dh = d**h
+        return E0 + (Emax-E0)*dh/(C**h+dh)
+
+    @_jit
+    def _musyc_kernel(d1, d2, K, colmax, h1, h2, alpha12, alpha21, gamma12, gamma21, out):
+        # The 11 monomials of synergy_models._musyc_log_coefficients, in log
+        # space and shifted by the largest so that exp cannot overflow
+        g1 = gamma21*h1
+        g2 = gamma12*h2
+        for i in _prange(len(out)):
+            x1 = np.log(np.float64(d1[i]))*h1
+            x2 = np.log(np.float64(d2[i]))*h2
+            a21 = np.log(alpha21*d1[i])*g1
+            a12 = np.log(alpha12*d2[i])*g2
+            L0 = colmax[0]
+            L1 = a21 + colmax[1]
+            L2 = a12 + colmax[2]
+            L3 = x1 + colmax[3]
+            L4 = x1 + a21 + colmax[4]
+            L5 = x1 + a12 + colmax[5]
+            L6 = x1 + a21 + a12 + colmax[6]
+            L7 = x2 + colmax[7]
+            L8 = x2 + a21 + colmax[8]
+            L9 = x2 + a12 + colmax[9]
+            L10 = x2 + a21 + a12 + colmax[10]
+            m = max(L0, L1, L2, L3, L4, L5, L6, L7, L8, L9, L10)
+            e0 = np.exp(L0 - m)
+            e1 = np.exp(L1 - m)
+            e2 = np.exp(L2 - m)
+            e3 = np.exp(L3 - m)
+            e4 = np.exp(L4 - m)
+            e5 = np.exp(L5 - m)
+            e6 = np.exp(L6 - m)
+            e7 = np.exp(L7 - m)
+            e8 = np.exp(L8 - m)
+            e9 = np.exp(L9 - m)
+            e10 = np.exp(L10 - m)
+            num = (K[0, 0]*e0 + K[0, 1]*e1 + K[0, 2]*e2 + K[0, 3]*e3 + K[0, 4]*e4 + K[0, 5]*e5
+                + K[0, 6]*e6 + K[0, 7]*e7 + K[0, 8]*e8 + K[0, 9]*e9 + K[0, 10]*e10)
+            den = (K[1, 0]*e0 + K[1, 1]*e1 + K[1, 2]*e2 + K[1, 3]*e3 + K[1, 4]*e4 + K[1, 5]*e5
+                + K[1, 6]*e6 + K[1, 7]*e7 + K[1, 8]*e8 + K[1, 9]*e9 + K[1, 10]*e10)
+            out[i] = num/den
+
+    @_jit
+    def _bliss_kernel(d1, d2, E, E0, E1, E2, h1, h2, C1, C2, out):
+        for i in _prange(len(out)):
+            if d1[i] == 0 or d2[i] == 0:
+                out[i] = 0
+            else:
+                out[i] = _hill_E(d1[i], E0, E1, h1, C1)*_hill_E(d2[i], E0, E2, h2, C2) - E[i]
+
+    @_jit
+    def _loewe_kernel(d1, d2, E, E0, E1, E2, h1, h2, C1, C2, out):
+        for i in _prange(len(out)):
+            if d1[i] == 0 or d2[i] == 0:
+                out[i] = 1
+                continue
+            r1 = (E[i]-E0)/(E1-E[i])
+            r2 = (E[i]-E0)/(E2-E[i])
+            if r1 < 0 or r2 < 0:
+                out[i] = np.nan
+            else:
+                out[i] = d1[i]/(r1**(1./h1)*C1) + d2[i]/(r2**(1./h2)*C2)
+
+    @numba.njit(cache=True, error_model='numpy')
+    def _loewe_log_term(d, E, E0, Emax, h, C):
+        num = E - E0
+        den = Emax - E
+        ratio = num/den
+        undefined = not (ratio >= 0 or (den == 0 and num != 0))
+        return np.log(d/C) - np.log(np.abs(ratio))/h, undefined
+
+    @_jit
+    def _loewe_log_kernel(d1, d2, E, E0, E1, E2, h1, h2, C1, C2, out, classes):
+        for i in _prange(len(out)):
+            if d1[i] == 0 or d2[i] == 0:
+                out[i] = 0
+                classes[i] = models.LOEWE_SINGLE_DRUG
+                continue
+            t1, undefined1 = _loewe_log_term(np.float64(d1[i]), np.float64(E[i]), E0, E1, h1, C1)
+            t2, undefined2 = _loewe_log_term(np.float64(d2[i]), np.float64(E[i]), E0, E2, h2, C2)
+            if undefined1 or undefined2:
+                out[i] = np.nan
+                classes[i] = models.LOEWE_UNDEFINED
+                continue
+            result = -_logaddexp(t1, t2)
+            out[i] = result
+            classes[i] = models.LOEWE_INFINITE if result == -np.inf else models.LOEWE_DEFINED
+
+def _scalars(params):
+    """
+    The parameters as floats, or None if any is an array of parameter sets
+    """
+    if not available or any(np.ndim(p) > 0 for p in params):
+        return None
+    return [float(p) for p in params]
+
+def _flat_doses(d1, d2, dtype=None):
+    d1, d2 = np.broadcast_arrays(np.asarray(d1, dtype=dtype), np.asarray(d2, dtype=dtype))
+    return d1.shape, np.ascontiguousarray(d1).reshape(-1), np.ascontiguousarray(d2).reshape(-1)
+
+def _flat_surface(d1, d2, E):
+    """
+    Flattened doses and E, or None if E is not a single surface over the doses
+    """
+    E = np.asarray(E)
+    shape, d1, d2 = _flat_doses(d1, d2)
+    if E.shape != shape or E.dtype.kind != 'f':
+        return None
+    return shape, d1, d2, np.ascontiguousarray(E).reshape(-1), np.result_type(d1, d2, E)
+
+def MuSyC_E(d1, d2, E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21, out=None, dtype=None):
+    """
+    As synergy_models.MuSyC_E. dtype only sets the type of the result, as the
+    compiled loop works in float64 on one point at a time.
+    """
+    params = _scalars((E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21))
+    if params is None:
+        return models.MuSyC_E(d1, d2, E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21, out=out, dtype=dtype)
+    E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21 = params
+    if dtype is None:
+        dtype = np.float64 if out is None else out.dtype
+    shape, d1, d2 = _flat_doses(d1, d2)
+    K, colmax = models._musyc_scaled_coefficients(*[np.array([p]) for p in (E0, E1, E2, E3, h1, h2, C1, C2, gamma12, gamma21)])
+    E = np.empty(len(d1), dtype=dtype)
+    with _kernel_lock:
+        _musyc_kernel(d1, d2, K[0], colmax[0], h1, h2, alpha12, alpha21, gamma12, gamma21, E)
+    if out is None:
+        return E.reshape(shape)
+    out[...] = E.reshape(shape)
+    return out
+
+def bliss(d1, d2, E, E0, E1, E2, h1, h2, C1, C2):
+    params = _scalars((E0, E1, E2, h1, h2, C1, C2))
+    flat = None if params is None else _flat_surface(d1, d2, E)
+    if flat is None:
+        return models.bliss(d1, d2, E, E0, E1, E2, h1, h2, C1, C2)
+    shape, d1, d2, E, dtype = flat
+    synergy = np.empty(len(E), dtype=dtype)
+    with _kernel_lock:
+        _bliss_kernel(d1, d2, E, *params, synergy)
+    return synergy.reshape(shape)
+
+def loewe(d1, d2, E, E0, E1, E2, h1, h2, C1, C2):
+    params = _scalars((E0, E1, E2, h1, h2, C1, C2))
+    flat = None if params is None else _flat_surface(d1, d2, E)
+    if flat is None:
+        return models.loewe(d1, d2, E, E0, E1, E2, h1, h2, C1, C2)
+    shape, d1, d2, E, dtype = flat
+    synergy = np.empty(len(E), dtype=dtype)
+    with _kernel_lock:
+        _loewe_kernel(d1, d2, E, *params, synergy)
+    return synergy.reshape(shape)
+
+def loewe_log(d1, d2, E, E0, E1, E2, h1, h2, C1, C2):
+    params = _scalars((E0, E1, E2, h1, h2, C1, C2))
+    flat = None if params is None else _flat_surface(d1, d2, E)
+    if flat is None:
+        return models.loewe_log(d1, d2, E, E0, E1, E2, h1, h2, C1, C2)
+    shape, d1, d2, E, dtype = flat
+    result = np.empty(len(E), dtype=dtype)
+    classes = np.empty(len(E), dtype=np.int8)
+    with _kernel_lock:
+        _loewe_log_kernel(d1, d2, E, *params, result, classes)
+    return result.reshape(shape), classes.reshape(shape)
+
+BACKENDS = ("auto", "numpy", "numba")
+
+def get_backend(name="auto"):
+    """
+    Module providing MuSyC_E, bliss, loewe and loewe_log: synergy_models for
+    "numpy" and this module for "numba"
+
+    "auto" is this module if numba is installed and can use more than one
+    thread. On a single core the compiled loops call exp and log one point at
+    a time, which is no faster than NumPy's vectorized versions.
+    """
+    if name not in BACKENDS:
+        raise ValueError("Unknown backend %r, expected one of %s"%(name, ", ".join(BACKENDS)))
+    if name == "numba" and not available:
+        raise ImportError("The numba backend requires numba")
+    if name == "numpy" or (name == "auto" and not (available and numba.config.NUMBA_NUM_THREADS > 1)):
+        return models
+    return sys.modules[__name__]
+
+def compare_backends(d1, d2, E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21, dtype=np.float64):
+    """
+    Compares the surfaces of the numba backend with those of synergy_models
+
+    Returns a dict by surface name (E, bliss, loewe, loewe_log) of dicts with
+    max_error and mismatched as in synergy_models.precision_error, plus
+    "loewe classes", the number of points whose loewe_log class differs. Both
+    backends are given the same E, so only the function itself is compared.
+    """
+    if not available:
+        raise ImportError("The numba backend requires numba")
+    params = (E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21)
+    hill = (E0, E1, E2, h1, h2, C1, C2)
+    d1, d2 = np.asarray(d1, dtype=dtype), np.asarray(d2, dtype=dtype)
+    errors = dict()
+    E = models.MuSyC_E(d1, d2, *params, dtype=dtype)
+    errors["E"] = models._precision_error(E, MuSyC_E(d1, d2, *params, dtype=dtype))
+    errors["bliss"] = models._precision_error(models.bliss(d1, d2, E, *hill), bliss(d1, d2, E, *hill))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        errors["loewe"] = models._precision_error(models.loewe(d1, d2, E, *hill), loewe(d1, d2, E, *hill))
+    expected, expected_classes = models.loewe_log(d1, d2, E, *hill)
+    result, classes = loewe_log(d1, d2, E, *hill)
+    errors["loewe_log"] = models._precision_error(expected, result)
+    errors["loewe classes"] = int((expected_classes != classes).sum())
+    return errors
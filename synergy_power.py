@@ -0,0 +1,437 @@
+#    Copyright (C) 2021 David J. Wooten
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Power analysis of plate layouts by simulating noisy experiments
+
+An experiment measures every well of a dose layout in a number of replicate
+plates, with noise added to the MuSyC surface and some wells dropped. Many
+experiments are simulated at once as arrays of shape (experiments,
+replicates, wells), and each is called as synergistic, antagonistic or
+neither by:
+
+    bliss   the Bliss excess of each combination well over the product of the
+            measured single-drug responses (relative to the measured control)
+    loewe   -log(Loewe) of each combination well, with the single-drug curves
+            taken as known (the simulated parameters), leaving out responses
+            near either end of the single-drug curves
+    musyc_beta, musyc_alpha
+            Wald tests of beta, and of log(alpha12) and log(alpha21), from a
+            MuSyC fit to all replicates of the experiment
+
+Bliss and Loewe average their score over the combination wells of each
+replicate plate, and t-test the plate averages against 0. MuSyC calls need a
+fit per experiment, so they are much slower than the others.
+
+power_analysis shards the experiments of every condition over a process pool.
+Shard s of condition i draws from child (i, s) of SeedSequence(seed), so the
+tables are reproducible whatever the number of processes.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+from math import lgamma
+from statistics import NormalDist
+
+import numpy as np
+
+import synergy_models as models
+from synergy_fit import fit_MuSyC, _LOG10_BOUNDS
+
+METHODS = ("bliss", "loewe", "musyc_beta", "musyc_alpha")
+
+class GaussianNoise:
+    """
+    Noise with the same standard deviation sigma in every well
+    """
+    def __init__(self, sigma=0.05):
+        self.sigma = sigma
+
+    def __call__(self, E, rng):
+        return E + self.sigma*rng.standard_normal(E.shape)
+
+    def __repr__(self):
+        return "GaussianNoise(sigma=%g)"%self.sigma
+
+class HeteroscedasticNoise:
+    """
+    Noise whose standard deviation grows with the response,
+    sqrt(sigma^2 + (cv*E)^2)
+    """
+    def __init__(self, sigma=0.02, cv=0.1):
+        self.sigma = sigma
+        self.cv = cv
+
+    def __call__(self, E, rng):
+        return E + np.sqrt(self.sigma**2 + (self.cv*E)**2)*rng.standard_normal(E.shape)
+
+    def __repr__(self):
+        return "HeteroscedasticNoise(sigma=%g, cv=%g)"%(self.sigma, self.cv)
+
+def dose_layout(doses1, doses2):
+    """
+    Flattened (d1, d2) of the checkerboard of doses1 and doses2, with a 0 dose
+    of each drug added if missing, so that it has control and single-drug wells
+    """
+    doses1 = np.union1d([0.], np.asarray(doses1, dtype=float))
+    doses2 = np.union1d([0.], np.asarray(doses2, dtype=float))
+    d1, d2 = np.meshgrid(doses1, doses2)
+    return d1.flatten(), d2.flatten()
+
+def simulate_experiments(d1, d2, parameters, n_experiments, replicates=3, noise=None, dropout=0., rng=None):
+    """
+    Noisy measurements of the MuSyC surface of the 12 parameters at the wells
+    (d1, d2), with shape (n_experiments, replicates, wells)
+
+    noise is called with the noiseless responses and rng (by default
+    GaussianNoise()). Each well is dropped (NaN) with probability dropout.
+    """
+    if noise is None:
+        noise = GaussianNoise()
+    rng = np.random.default_rng(rng)
+    d1 = np.asarray(d1, dtype=float)
+    d2 = np.asarray(d2, dtype=float)
+    E = models.MuSyC_E(d1, d2, *parameters)
+    E = noise(np.broadcast_to(E, (n_experiments, replicates, len(d1))), rng)
+    if dropout > 0:
+        E[rng.random(E.shape) < dropout] = np.nan
+    return E
+
+def _t_abs_cdf(t, df):
+    """
+    P(|T| < t) for t >= 0 and Student's t with integer df (an array) degrees
+    of freedom, from the finite series of Abramowitz and Stegun 26.7.3-4
+    """
+    theta = np.arctan(t/np.sqrt(df))
+    c2 = np.cos(theta)**2
+    odd = df % 2 == 1
+    term = np.where(odd, np.cos(theta), 1.)
+    series = np.where(df >= 2, term, 0.)
+    for j in range(1, int(df.max())//2):
+        term = term*c2*np.where(odd, 2*j/(2*j+1), (2*j-1)/(2*j))
+        series += np.where(2*j + np.where(odd, 3, 2) <= df, term, 0.)
+    return np.where(odd, 2/np.pi*(theta + np.sin(theta)*series), np.sin(theta)*series)
+
+# Degrees of freedom below which _t_critical refines the Cornish-Fisher
+# expansion with Newton's method
+_T_REFINE_DF = 30
+
+def _t_critical(p, df):
+    """
+    p quantile (p >= 0.5) of Student's t with df (an array of integers >= 1)
+    degrees of freedom
+
+    Uses scipy when it is installed. Otherwise, the quantile is exact for 1
+    and 2 degrees of freedom, and starts from the Cornish-Fisher expansion
+    (Abramowitz and Stegun 26.7.5) above that. Below _T_REFINE_DF degrees of
+    freedom, where the expansion is off by up to 4% (at df = 3 and p = 0.9995),
+    it is refined by Newton's method on the exact distribution function, to
+    within 1e-12. Above, the expansion is within 1e-6 for p <= 0.9995.
+    """
+    df = np.asarray(df, dtype=float)
+    try:
+        from scipy.stats import t
+        return t.ppf(p, df)
+    except ImportError:
+        pass
+    z = NormalDist().inv_cdf(p)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        g1 = (z**3 + z)/4
+        g2 = (5*z**5 + 16*z**3 + 3*z)/96
+        g3 = (3*z**7 + 19*z**5 + 17*z**3 - 15*z)/384
+        g4 = (79*z**9 + 776*z**7 + 1482*z**5 - 1920*z**3 - 945*z)/92160
+        t = z + g1/df + g2/df**2 + g3/df**3 + g4/df**4
+    refine = (df > 2) & (df < _T_REFINE_DF)
+    if refine.any():
+        nu = df[refine]
+        x = t[refine]
+        log_norm = np.array([lgamma((n+1)/2) - lgamma(n/2) for n in nu]) - 0.5*np.log(nu*np.pi)
+        for i in range(4):
+            pdf = np.exp(log_norm - (nu+1)/2*np.log1p(x**2/nu))
+            x = x - ((1 + _t_abs_cdf(x, nu))/2 - p)/pdf
+        t = np.array(t, dtype=float)
+        t[refine] = x
+    t = np.where(df == 1, np.tan(np.pi*(p-0.5)), t)
+    return np.where(df == 2, (2*p-1)/np.sqrt(2*p*(1-p)), t)
+
+def _calls(estimate, se, df, alpha):
+    """
+    1 where estimate is significantly positive, -1 where it is significantly
+    negative (two-sided, at level alpha) and 0 elsewhere, including where
+    there are no degrees of freedom left
+    """
+    valid = (df >= 1) & (se > 0) & np.isfinite(estimate)
+    critical = _t_critical(1-alpha/2, np.where(valid, df, 1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(valid, estimate/np.where(valid, se, 1), 0)
+    return np.where(t > critical, 1, np.where(t < -critical, -1, 0)).astype(np.int8)
+
+def _replicate_t_calls(scores, alpha):
+    """
+    Calls from a one-sample t-test of each row of scores (experiments,
+    replicates) against 0, ignoring NaNs
+    """
+    n = np.isfinite(scores).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.nansum(scores, axis=1)/n
+        var = np.nansum((scores - mean[:,np.newaxis])**2, axis=1)/(n-1)
+        se = np.sqrt(var/n)
+    return _calls(mean, se, n-1, alpha)
+
+def _finite_mean(x):
+    """
+    Mean over the last axis of the finite values of x, NaN where there are none
+    """
+    finite = np.isfinite(x)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(finite, x, 0).sum(axis=-1)/finite.sum(axis=-1)
+
+def _well_means(E, mask, groups):
+    """
+    Mean of the measured wells of each group (a dose of the masked wells), as
+    an array (..., len(groups)) ignoring dropped wells
+    """
+    weights = (mask[np.newaxis] & (groups[:,np.newaxis] == groups[np.newaxis]))
+    weights = weights.astype(float)
+    measured = np.isfinite(E)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (np.where(measured, E, 0) @ weights.T)/(measured @ weights.T)
+
+def _layout_wells(d1, d2):
+    """
+    Masks of the control and single-drug wells of a layout, and the indices
+    of its combination wells
+    """
+    control = (d1 == 0) & (d2 == 0)
+    single1 = (d1 > 0) & (d2 == 0)
+    single2 = (d1 == 0) & (d2 > 0)
+    combination = np.flatnonzero((d1 > 0) & (d2 > 0))
+    if not control.any():
+        raise ValueError("The layout has no control (d1 = d2 = 0) wells")
+    if len(combination) == 0:
+        raise ValueError("The layout has no combination wells")
+    for single, d, other in ((single1, d1, "d2"), (single2, d2, "d1")):
+        missing = np.setdiff1d(d[combination], d[single])
+        if len(missing):
+            raise ValueError("The layout has no single-drug (%s = 0) wells at doses %s"%(other, missing))
+    return control, single1, single2, combination
+
+def bliss_calls(d1, d2, E, alpha=0.05):
+    """
+    Calls (1 synergy, -1 antagonism, 0 neither) for experiments E of shape
+    (experiments, replicates, wells), from the mean Bliss excess of each
+    replicate's combination wells
+
+    The excess of a combination well is E1*E2/E0 - E, where E1 and E2 are the
+    replicate's mean single-drug responses at its doses and E0 its mean
+    control response. For responses normalized to E0 = 1, this is the Bliss
+    excess of synergy_models.bliss.
+    """
+    d1 = np.asarray(d1, dtype=float)
+    d2 = np.asarray(d2, dtype=float)
+    control, single1, single2, combination = _layout_wells(d1, d2)
+    E0 = _well_means(E, control, np.zeros(len(d1)))[..., :1]
+    E1 = _well_means(E, single1, d1)[..., combination]
+    E2 = _well_means(E, single2, d2)[..., combination]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        excess = E1*E2/E0 - E[..., combination]
+    return _replicate_t_calls(_finite_mean(excess), alpha)
+
+def loewe_calls(d1, d2, E, parameters, alpha=0.05, margin=0.1):
+    """
+    Calls (1 synergy, -1 antagonism, 0 neither) for experiments E of shape
+    (experiments, replicates, wells), from the mean -log(Loewe) of each
+    replicate's combination wells
+
+    Loewe needs the single-drug doses that reach each measured response, which
+    are taken from the single-drug curves of the 12 MuSyC parameters rather
+    than fit to the noisy data. Near E0 and Emax these doses are so sensitive
+    to noise that the mean is biased, so wells whose response is within
+    margin (a fraction of the way from E0 to Emax) of either end of a drug's
+    range are left out, as are wells whose response neither drug reaches.
+    """
+    d1 = np.asarray(d1, dtype=float)
+    d2 = np.asarray(d2, dtype=float)
+    combination = _layout_wells(d1, d2)[3]
+    E0, E1, E2, E3, h1, h2, C1, C2 = parameters[:8]
+    E = E[..., combination]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        loewe, _ = models.loewe_log(d1[combination], d2[combination], E, E0, E1, E2, h1, h2, C1, C2)
+        for Emax in (E1, E2):
+            fraction = (E - E0)/(Emax - E0)
+            loewe[~((fraction >= margin) & (fraction <= 1 - margin))] = np.nan
+    return _replicate_t_calls(_finite_mean(loewe), alpha)
+
+def _beta_gradient(E0, E1, E2, E3):
+    """
+    Derivatives of get_beta with respect to E0..E3
+    """
+    minE = min(E1, E2)
+    gradient = np.zeros(4)
+    gradient[0] = -(minE-E3)/(E0-minE)**2
+    gradient[1 if E1 <= E2 else 2] = (E0-E3)/(E0-minE)**2
+    gradient[3] = -1/(E0-minE)
+    return gradient
+
+# Largest condition number of a fit's Jacobian for which its Wald tests are
+# made. The covariance inverts J J^T, whose condition number is its square, so
+# beyond 1/sqrt(eps) some combination of the parameters is not determined by
+# the data in double precision.
+_MAX_CONDITION = 1/np.sqrt(np.finfo(float).eps)
+
+def _covariance(J, sse, df):
+    """
+    Covariance of the parameters of a least squares fit with Jacobian J (shape
+    (parameters, points)), or None if J is rank deficient
+    """
+    U, s, _ = np.linalg.svd(J, full_matrices=False)
+    if not (s[-1] > 0 and s[0]/s[-1] < _MAX_CONDITION):
+        return None
+    return sse/df*(U/s**2) @ U.T
+
+def _standard_error(variance):
+    # NaN, so no call is made, unless the variance is positive
+    variance = np.asarray(variance, dtype=float)
+    return np.sqrt(np.where(variance > 0, variance, np.nan))
+
+def musyc_calls(d1, d2, E, alpha=0.05):
+    """
+    Calls (1 synergy, -1 antagonism, 0 neither) of beta and of potency for
+    experiments E of shape (experiments, replicates, wells), from a MuSyC fit
+    to all replicates of each experiment
+
+    Returns a dict with musyc_beta, the Wald test of beta against 0, and
+    musyc_alpha, the Wald tests of log(alpha12) and log(alpha21) against 0
+    (each at level alpha/2, taking the more significant of the two). Standard
+    errors come from the fit's Jacobian. Fits that do not converge, whose
+    Jacobian is rank deficient (see _MAX_CONDITION), or whose potency
+    parameters sit at a bound, are not called.
+    """
+    d1 = np.asarray(d1, dtype=float)
+    d2 = np.asarray(d2, dtype=float)
+    n_experiments, replicates = E.shape[:2]
+    D1, D2 = np.tile(d1, replicates), np.tile(d2, replicates)
+    estimates = np.full((n_experiments, 3), np.nan)
+    se = np.full((n_experiments, 3), np.nan)
+    df = np.zeros(n_experiments, dtype=int)
+    for i in range(n_experiments):
+        y = E[i].flatten()
+        measured = np.isfinite(y)
+        if measured.sum() <= 12: continue
+        fit = fit_MuSyC(D1[measured], D2[measured], y[measured])
+        if not fit.converged: continue
+        _, J = models.MuSyC_E_jacobian(D1[measured], D2[measured], *fit.parameters)
+        covariance = _covariance(J, fit.sse, measured.sum() - 12)
+        if covariance is None: continue
+        df[i] = measured.sum() - 12
+        gradient = _beta_gradient(*fit.parameters[:4])
+        estimates[i, 0] = models.get_beta(*fit.parameters[:4])
+        se[i, 0] = _standard_error(gradient @ covariance[:4,:4] @ gradient)
+        estimates[i, 1:] = np.log10(fit.parameters[8:10])
+        se[i, 1:] = _standard_error(np.diag(covariance)[8:10])
+    with np.errstate(invalid='ignore'):
+        at_bound = np.any(np.abs(estimates[:, 1:]) >= _LOG10_BOUNDS["alpha"][1] - 1e-6, axis=1)
+    potency = _calls(estimates[:, 1:], se[:, 1:], np.where(at_bound, 0, df)[:,np.newaxis], alpha/2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.abs(estimates[:, 1:]/se[:, 1:])
+    stronger = np.argmax(np.where(potency != 0, np.nan_to_num(z), -1), axis=1)
+    return dict(musyc_beta=_calls(estimates[:, 0], se[:, 0], df, alpha),
+        musyc_alpha=potency[np.arange(n_experiments), stronger])
+
+def synergy_calls(d1, d2, E, parameters, methods=("bliss", "loewe"), alpha=0.05):
+    """
+    Dict by method (see METHODS) of the calls (1 synergy, -1 antagonism, 0
+    neither) for experiments E of shape (experiments, replicates, wells)
+    """
+    unknown = [m for m in methods if m not in METHODS]
+    if unknown:
+        raise ValueError("Unknown method(s) %s"%", ".join(unknown))
+    calls = dict()
+    if "bliss" in methods:
+        calls["bliss"] = bliss_calls(d1, d2, E, alpha)
+    if "loewe" in methods:
+        calls["loewe"] = loewe_calls(d1, d2, E, parameters, alpha)
+    if "musyc_beta" in methods or "musyc_alpha" in methods:
+        calls.update((m, c) for m, c in musyc_calls(d1, d2, E, alpha).items() if m in methods)
+    return dict((m, calls[m]) for m in methods)
+
+def power_conditions(parameters, layouts, noise_models, replicates=(3,), dropout=(0.,)):
+    """
+    Every combination of the named parameter sets, layouts and noise models
+    (dicts by name of 12 MuSyC parameters, (d1, d2) and noise models) with
+    each number of replicates and dropout rate, as conditions for
+    power_analysis
+    """
+    conditions = []
+    for (scenario, p), (layout, (d1, d2)), (noise, model), r, drop in itertools.product(parameters.items(),
+            layouts.items(), noise_models.items(), replicates, dropout):
+        if hasattr(p, "parameters"):
+            p = p.parameters
+        conditions.append(dict(scenario=scenario, parameters=tuple(p), layout=layout, d1=d1, d2=d2,
+            noise=noise, noise_model=model, replicates=r, dropout=drop))
+    return conditions
+
+def _power_job(job):
+    i, s, n_experiments, condition, methods, alpha, seed = job
+    c = condition
+    E = simulate_experiments(c["d1"], c["d2"], c["parameters"], n_experiments, c["replicates"], c["noise_model"],
+        c["dropout"], rng=np.random.SeedSequence(seed, spawn_key=(i, s)))
+    calls = synergy_calls(c["d1"], c["d2"], E, c["parameters"], methods, alpha)
+    return i, dict((m, (int((v == 1).sum()), int((v == -1).sum()))) for m, v in calls.items())
+
+# Keys of a condition that are copied to its rows of the power table
+_LABELS = ("scenario", "layout", "noise", "replicates", "dropout")
+
+def power_analysis(conditions, n_experiments=1000, methods=("bliss", "loewe"), alpha=0.05, seed=0, shard_size=1000,
+        processes=None):
+    """
+    Table of how often each method calls synergy in each condition, as a list
+    of rows (dicts), one per condition and method
+
+    conditions are dicts (see power_conditions) with the 12 MuSyC parameters,
+    the wells d1 and d2, the noise_model, replicates and dropout. Each
+    simulates n_experiments experiments, in shards of shard_size spread over a
+    process pool (processes=1 runs in the calling process). Rows hold the
+    labels of the condition, the number of wells, and the method's power (the
+    fraction of experiments called synergistic), with its standard error, and
+    antagonism (the fraction called antagonistic). For a condition without
+    synergy, power is the false positive rate.
+    """
+    conditions = list(conditions)
+    unknown = [m for m in methods if m not in METHODS]
+    if unknown:
+        raise ValueError("Unknown method(s) %s"%", ".join(unknown))
+    jobs = [(i, s, min(shard_size, n_experiments - start), c, tuple(methods), alpha, seed)
+        for i, c in enumerate(conditions) for s, start in enumerate(range(0, n_experiments, shard_size))]
+    if processes == 1:
+        results = [_power_job(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(processes) as pool:
+            results = list(pool.map(_power_job, jobs))
+
+    counts = [dict((m, [0, 0]) for m in methods) for c in conditions]
+    for i, shard in results:
+        for m, (synergy, antagonism) in shard.items():
+            counts[i][m][0] += synergy
+            counts[i][m][1] += antagonism
+    rows = []
+    for c, condition_counts in zip(conditions, counts):
+        for m in methods:
+            power = condition_counts[m][0]/n_experiments
+            row = dict((k, c[k]) for k in _LABELS if k in c)
+            row.update(wells=len(c["d1"]), method=m, experiments=n_experiments, power=power,
+                se=float(np.sqrt(power*(1-power)/n_experiments)), antagonism=condition_counts[m][1]/n_experiments)
+            rows.append(row)
+    return rows
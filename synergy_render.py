@@ -0,0 +1,150 @@
+#    Copyright (C) 2021 David J. Wooten
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Headless rendering of the demo surfaces to static HTML and image files
+
+Figures look like the demo's (the settings in synergy_demo_backend are
+reused), but are written from plain dicts without building a FigureWidget or
+validating the surface arrays. The settings that are the same for every
+figure are built once per worker process as a plotly template, so each figure
+only holds its title, axis ranges, colors and surface. HTML files load
+plotly.js from one shared plotly.min.js in the output directory by default.
+Image formats need kaleido.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+from synergy_demo_backend import DoseGrid, compute_surfaces, SURFACE_PANELS, SURFACE_STYLE, FIGURE_STYLE, surface_trace, figure_layout
+
+IMAGE_FORMATS = ("png", "jpeg", "webp", "svg", "pdf")
+
+def figure_template():
+    """
+    The default plotly template with SURFACE_STYLE and FIGURE_STYLE added, as
+    a dict
+    """
+    import plotly.graph_objects as go
+    import plotly.io as pio
+    template = go.layout.Template(pio.templates[pio.templates.default])
+    template.layout.update(FIGURE_STYLE)
+    template.data.surface = [go.Surface(**SURFACE_STYLE)]
+    return template.to_plotly_json()
+
+def pair_surfaces(grid, parameters, surface_names=("E", "bliss", "loewe")):
+    """
+    The surfaces the demo would show on the DoseGrid grid for the 12 MuSyC
+    parameters (E, bliss and -log(Loewe), with undefined E drawn as 0)
+    """
+    return compute_surfaces(grid.d1.flatten(), grid.d2.flatten(), parameters, surface_names)
+
+def surface_figure(grid, E, panel, template, width=600, height=600):
+    """
+    Figure dict of the surface E, with the title, axes and colors of panel (an
+    entry of SURFACE_PANELS) and the shared template from figure_template
+    """
+    import plotly.graph_objects as go
+    panel = dict(panel)
+    layout = figure_layout(grid, panel.pop("title"), zlim=panel.pop("zlim", (0,1.1)), width=width, height=height,
+        center_on_zero=panel.get("center_on_zero", False), z_title=panel.pop("z_title", None), styled=False)
+    trace = surface_trace(grid, E, styled=False, **panel)
+    x, y, z = trace.pop("x"), trace.pop("y"), trace.pop("z")
+    # Only the small properties are validated, e.g. to expand named colorscales
+    trace = go.Surface(**trace).to_plotly_json()
+    trace.update(x=x, y=y, z=z)
+    layout = go.Layout(**layout).to_plotly_json()
+    layout["template"] = template
+    return dict(data=[trace], layout=layout)
+
+def write_figure(figure, path, include_plotlyjs="directory"):
+    """
+    Writes a figure dict to path, as HTML or an image by its extension
+    """
+    import plotly.io as pio
+    fmt = os.path.splitext(path)[1][1:].lower()
+    if fmt == "html":
+        pio.write_html(figure, path, include_plotlyjs=include_plotlyjs, validate=False, auto_open=False)
+    else:
+        pio.write_image(figure, path, format=fmt, validate=False)
+
+# Settings and template of the worker process, set by _init_worker
+_worker = None
+
+def _init_worker(settings):
+    global _worker
+    _worker = dict(settings, template=figure_template())
+
+def _render_job(job):
+    name, parameters = job
+    if hasattr(parameters, "parameters"):
+        parameters = parameters.parameters
+    grid = _worker["grid"]
+    surfaces = pair_surfaces(grid, parameters, _worker["surface_names"])
+    paths = []
+    for surface in _worker["surface_names"]:
+        figure = surface_figure(grid, surfaces[surface], SURFACE_PANELS[surface], _worker["template"],
+            width=_worker["width"], height=_worker["height"])
+        for fmt in _worker["formats"]:
+            path = os.path.join(_worker["output_dir"], "%s_%s.%s"%(name, surface, fmt))
+            write_figure(figure, path, _worker["include_plotlyjs"])
+            paths.append(path)
+    return paths
+
+def render_many(pairs, output_dir, formats=("html",), surface_names=("E", "bliss", "loewe"), grid=None, n_doses=30,
+        width=600, height=600, include_plotlyjs="directory", processes=None, chunksize=16):
+    """
+    Writes the surfaces of each (name, parameters) in pairs (or the items of a
+    dict) to output_dir/<name>_<surface>.<format>, using a process pool
+
+    parameters are the 12 MuSyC parameters, or a FitResult. Surfaces are drawn
+    on grid, by default the demo's DoseGrid.log_spaced(n_doses). formats are
+    "html" and any of IMAGE_FORMATS. include_plotlyjs is passed to
+    plotly.io.write_html. Returns the paths written for each pair, in the order
+    of pairs. processes=1 renders in the calling process.
+    """
+    if isinstance(pairs, dict):
+        pairs = pairs.items()
+    formats = tuple(f.lower() for f in formats)
+    unknown = [f for f in formats if f != "html" and f not in IMAGE_FORMATS]
+    if unknown:
+        raise ValueError("Unknown format(s) %s"%", ".join(unknown))
+    if any(f in IMAGE_FORMATS for f in formats):
+        try:
+            import kaleido
+        except ImportError:
+            raise ImportError("Writing images requires kaleido")
+    unknown = [s for s in surface_names if s not in SURFACE_PANELS]
+    if unknown:
+        raise ValueError("Unknown surface(s) %s"%", ".join(unknown))
+
+    os.makedirs(output_dir, exist_ok=True)
+    if "html" in formats and include_plotlyjs == "directory":
+        # Written here rather than by each worker, which could race on it
+        bundle = os.path.join(output_dir, "plotly.min.js")
+        if not os.path.exists(bundle):
+            from plotly.offline import get_plotlyjs
+            with open(bundle, "w", encoding="utf-8") as f:
+                f.write(get_plotlyjs())
+
+    if grid is None:
+        grid = DoseGrid.log_spaced(n_doses)
+    settings = dict(grid=grid, output_dir=output_dir, formats=formats, surface_names=tuple(surface_names),
+        width=width, height=height, include_plotlyjs=include_plotlyjs)
+    if processes == 1:
+        _init_worker(settings)
+        return [_render_job(job) for job in pairs]
+    with ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(settings,)) as pool:
+        return list(pool.map(_render_job, pairs, chunksize=chunksize))
@@ -0,0 +1,200 @@
+#    Copyright (C) 2021 David J. Wooten
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Streaming synergy scores for measured plate data
+
+Reads (plate, d1, d2, E) records from CSV or Parquet files in chunks, fits
+MuSyC to each plate, and writes every measurement back out with its MuSyC
+prediction, Bliss excess and Loewe index as soon as its plate is done. A
+plate that cannot be fit (e.g. with no finite measurements) gets NaN scores
+and the stream goes on. Only
+one plate and one chunk are held in memory, so the rows of each plate must be
+contiguous in the input.
+
+Parquet needs pyarrow. CSV files are read with pandas when it is installed,
+and with the csv module otherwise.
+"""
+
+import csv
+import os
+
+import numpy as np
+
+import synergy_models as models
+from synergy_fit import fit_MuSyC
+
+COLUMNS = ("plate", "d1", "d2", "E")
+SCORE_COLUMNS = ("E_musyc", "bliss", "loewe")
+FIT_COLUMNS = models.PARAMETER_NAMES + ("sse", "converged", "n_points", "error")
+
+def _is_parquet(path):
+    return os.path.splitext(path)[1].lower() in (".parquet", ".pq")
+
+def _read_csv(path, chunksize, columns):
+    try:
+        import pandas as pd
+    except ImportError:
+        pd = None
+    if pd is not None:
+        for frame in pd.read_csv(path, usecols=list(columns), chunksize=chunksize, dtype={columns[0]: str}):
+            yield [frame[c].to_numpy() for c in columns]
+        return
+
+    with open(path, newline="") as f:
+        reader = csv.DictReader(f)
+        missing = [c for c in columns if c not in reader.fieldnames]
+        if missing:
+            raise ValueError("%s has no column(s) %s"%(path, ", ".join(missing)))
+        rows = []
+        for row in reader:
+            rows.append([row[c] for c in columns])
+            if len(rows) == chunksize:
+                yield _csv_chunk(rows)
+                rows = []
+        if rows:
+            yield _csv_chunk(rows)
+
+def _csv_chunk(rows):
+    plate, d1, d2, E = zip(*rows)
+    return [np.array(plate, dtype=object)] + [np.array(x, dtype=float) for x in (d1, d2, E)]
+
+def _read_parquet(path, chunksize, columns):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Reading Parquet files requires pyarrow")
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=list(columns)):
+        yield [batch.column(c).to_numpy(zero_copy_only=False) for c in columns]
+
+def read_records(path, chunksize=100000, columns=COLUMNS):
+    """
+    Yields chunks of at most chunksize records from a CSV or Parquet file, as
+    lists of arrays (plate, d1, d2, E). columns names the file's columns for
+    each of these.
+    """
+    if _is_parquet(path):
+        return _read_parquet(path, chunksize, columns)
+    return _read_csv(path, chunksize, columns)
+
+def iter_plates(chunks):
+    """
+    Regroups chunks of (plate, d1, d2, E) records into one (plate, d1, d2, E)
+    per plate. Raises ValueError if a plate's rows are not contiguous.
+    """
+    done = set()
+    current, parts = None, []
+    for plate, d1, d2, E in chunks:
+        plate = np.asarray(plate)
+        if len(plate) == 0: continue
+        # Positions where the plate changes within the chunk
+        starts = np.r_[0, np.flatnonzero(plate[1:] != plate[:-1]) + 1, len(plate)]
+        for start, stop in zip(starts[:-1], starts[1:]):
+            name = plate[start]
+            if name != current:
+                if parts:
+                    yield (current,) + tuple(np.concatenate(x) for x in zip(*parts))
+                    done.add(current)
+                if name in done:
+                    raise ValueError("The rows of plate %r are not contiguous"%(name,))
+                current, parts = name, []
+            parts.append((np.asarray(d1[start:stop], dtype=float), np.asarray(d2[start:stop], dtype=float),
+                np.asarray(E[start:stop], dtype=float)))
+    if parts:
+        yield (current,) + tuple(np.concatenate(x) for x in zip(*parts))
+
+def score_plate(d1, d2, E, **fit_kwargs):
+    """
+    Fits MuSyC to one plate and scores each measurement
+
+    Returns the FitResult and a dict of arrays: E_musyc, the fitted surface at
+    each dose; bliss, the Bliss excess of the measurement over the fitted
+    single drug responses; and loewe, the Loewe index of the measurement (< 1
+    is synergistic, NaN where it is undefined).
+    """
+    fit = fit_MuSyC(d1, d2, E, **fit_kwargs)
+    E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21 = fit.parameters
+    scores = dict(E_musyc=models.MuSyC_E(d1, d2, *fit.parameters))
+    scores["bliss"] = models.bliss(d1, d2, E, E0, E1, E2, h1, h2, C1, C2)
+    scores["loewe"] = models.loewe(d1, d2, E, E0, E1, E2, h1, h2, C1, C2)
+    return fit, scores
+
+class _CSVWriter:
+    def __init__(self, path, columns):
+        self.f = open(path, "w", newline="")
+        self.writer = csv.writer(self.f)
+        self.writer.writerow(columns)
+
+    def write(self, table):
+        self.writer.writerows(zip(*table))
+
+    def close(self):
+        self.f.close()
+
+class _ParquetWriter:
+    def __init__(self, path, columns):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Writing Parquet files requires pyarrow")
+        self.pa = pa
+        self.columns = columns
+        self.schema = pa.schema([(columns[0], pa.string())] + [(c, pa.float64()) for c in columns[1:]])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, table):
+        arrays = [self.pa.array([str(p) for p in table[0]], type=self.pa.string())] + [self.pa.array(c) for c in table[1:]]
+        self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+def score_file(path, output, chunksize=100000, columns=COLUMNS, fits=None, **fit_kwargs):
+    """
+    Scores every plate in the CSV or Parquet file path, writing the records
+    with the SCORE_COLUMNS added to output (CSV or Parquet, by extension)
+
+    Plates are written as soon as they are scored. If fits is a path, the
+    fitted MuSyC parameters of each plate are written there as CSV, with the
+    FIT_COLUMNS. A plate whose fit fails is written with NaN scores, and with
+    NaN parameters and the reason in the error column of fits. fit_kwargs are
+    passed to fit_MuSyC. Returns the number of plates scored, including those
+    that failed.
+    """
+    out_columns = tuple(columns) + SCORE_COLUMNS
+    writer = (_ParquetWriter if _is_parquet(output) else _CSVWriter)(output, out_columns)
+    fit_writer = None
+    n_plates = 0
+    try:
+        if fits is not None:
+            fit_writer = _CSVWriter(fits, (columns[0],) + FIT_COLUMNS)
+        for plate, d1, d2, E in iter_plates(read_records(path, chunksize, columns)):
+            try:
+                fit, scores = score_plate(d1, d2, E, **fit_kwargs)
+                row = fit.parameters + (fit.sse, fit.converged, fit.n_points, "")
+            except (ValueError, FloatingPointError) as error:
+                scores = dict((c, np.full(len(E), np.nan)) for c in SCORE_COLUMNS)
+                row = (np.nan,)*len(models.PARAMETER_NAMES) + (np.nan, False,
+                    int(np.sum(np.isfinite(d1) & np.isfinite(d2) & np.isfinite(E))), "%s: %s"%(type(error).__name__, error))
+            writer.write([np.full(len(E), plate, dtype=object), d1, d2, E] + [scores[c] for c in SCORE_COLUMNS])
+            if fit_writer is not None:
+                fit_writer.write([[x] for x in (plate,) + row])
+            n_plates += 1
+    finally:
+        writer.close()
+        if fit_writer is not None:
+            fit_writer.close()
+    return n_plates
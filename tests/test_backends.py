@@ -0,0 +1,37 @@
+import itertools
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import synergy_numba
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DOSES = np.concatenate([[0], np.logspace(-3, 3, 21)])
+
+PARAMETER_GRID = [(1, E1, 0.5, E3, h1, 0.7, C1, 2, alpha12, alpha21, gamma12, 1)
+    for E1, E3, h1, C1, alpha12, alpha21, gamma12 in itertools.product(
+        (0.2, 1.3), (0, 0.4), (0.5, 3), (0.1, 10), (0.1, 10), (0.5, 4), (0.5, 2))]
+
+# Largest differences allowed between the backends for each surface
+TOLERANCES = {np.float64: dict(E=1e-12, bliss=1e-12, loewe_log=1e-10),
+    np.float32: dict(E=1e-5, bliss=1e-5, loewe_log=1e-5)}
+
+@pytest.mark.skipif(not synergy_numba.available, reason="numba is not installed")
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_numba_backend_matches_numpy(dtype):
+    d1, d2 = np.meshgrid(DOSES, DOSES)
+    for params in PARAMETER_GRID:
+        errors = synergy_numba.compare_backends(d1, d2, *params, dtype=dtype)
+        for name, tolerance in TOLERANCES[dtype].items():
+            assert errors[name]["max_error"] <= tolerance, (name, params, errors[name])
+            assert errors[name]["mismatched"] == 0, (name, params, errors[name])
+        assert errors["loewe classes"] == 0, params
+
+def test_numpy_backend_does_not_import_numba():
+    code = "import sys, synergy_demo_backend, compute_service, synergy_render; print('numba' in sys.modules)"
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == "False"
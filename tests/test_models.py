@@ -0,0 +1,84 @@
+import itertools
+import warnings
+
+import numpy as np
+import pytest
+
+import synergy_models as models
+
+def baseline_MuSyC_E(d1, d2, E0, E1, E2, E3, h1, h2, C1, C2, alpha12, alpha21, gamma12, gamma21):
+    """
+    The closed form MuSyC_E replaced (Demo._MuSyC_E in the original backend)
+    """
+    d1h1 = np.power(d1,h1)
+    d2h2 = np.power(d2,h2)
+    C1h1 = np.power(C1,h1)
+    C2h2 = np.power(C2,h2)
+    r1 = 100/C1h1
+    r2 = 100/C2h2
+    a21 = np.power(alpha21*d1, gamma21*h1)
+    a12 = np.power(alpha12*d2, gamma12*h2)
+    g1 = np.power((r1*C1h1),gamma21)
+    g2 = np.power((r2*C2h2),gamma12)
+    denominator = (d1h1*r1*r2*g1*C2h2+d1h1*r1*r2*g2*C2h2+d1h1*r1*np.power(r2,(gamma12+1))*a12*C2h2
+        +d1h1*r1*np.power(r2,gamma12)*a12*g1+d1h1*np.power(r1,(gamma21+1))*np.power(r2,gamma12)*a21*a12
+        +d1h1*np.power(r1,(gamma21+1))*a21*g2+d2h2*r1*r2*g1*C1h1+d2h2*r1*r2*g2*C1h1
+        +d2h2*np.power(r1,(gamma21+1))*r2*a21*C1h1+d2h2*np.power(r1,gamma21)*r2*a21*g2
+        +d2h2*np.power(r1,gamma21)*np.power(r2,(gamma12+1))*a21*a12+d2h2*np.power(r2,(gamma12+1))*a12*g1
+        +r1*r2*g1*C1h1*C2h2+r1*r2*g2*C1h1*C2h2+np.power(r1,(gamma21+1))*a21*g2*C1h1
+        +np.power(r2,(gamma12+1))*a12*g1*C2h2)
+    U = (r1*r2*g1*C1h1*C2h2+r1*r2*g2*C1h1*C2h2+np.power(r1,(gamma21+1))*a21*g2*C1h1
+        +np.power(r2,(gamma12+1))*a12*g1*C2h2)/denominator
+    A1 = (d1h1*r1*r2*g1*C2h2+d1h1*r1*r2*g2*C2h2+d1h1*np.power(r1,(gamma21+1))*a21*g2
+        +d2h2*np.power(r1,gamma21)*r2*a21*g2)/denominator
+    A2 = (d1h1*r1*np.power(r2,gamma12)*a12*g1+d2h2*r1*r2*g1*C1h1+d2h2*r1*r2*g2*C1h1
+        +d2h2*np.power(r2,(gamma12+1))*a12*g1)/denominator
+    return U*E0 + A1*E1 + A2*E2 + (1-(U+A1+A2))*E3
+
+DOSES = np.concatenate([[0], np.logspace(-3, 3, 13)])
+
+PARAMETER_GRID = [dict(E0=1, E1=E1, E2=0.5, E3=E3, h1=h1, h2=h2, C1=C1, C2=0.5, alpha12=alpha12, alpha21=alpha21,
+        gamma12=gamma12, gamma21=gamma21)
+    for E1, E3, h1, h2, C1, alpha12, alpha21, gamma12, gamma21 in itertools.product(
+        (0.2, 1.2), (0, 0.7), (0.5, 2), (0.8, 3), (0.1, 10), (0.1, 10), (1, 5), (0.5, 2), (1, 3))]
+
+# float32 is meant for display, see synergy_models.precision_error
+TOLERANCES = {np.float64: 1e-9, np.float32: 1e-4}
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_MuSyC_E_matches_closed_form(dtype):
+    d1, d2 = np.meshgrid(DOSES, DOSES)
+    for params in PARAMETER_GRID:
+        expected = baseline_MuSyC_E(d1, d2, **params)
+        E = models.MuSyC_E(d1, d2, dtype=dtype, **params)
+        assert E.dtype == dtype
+        np.testing.assert_allclose(E, expected, rtol=0, atol=TOLERANCES[dtype], err_msg=str(params))
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_MuSyC_E_vectorized_parameters_match_closed_form(dtype):
+    d1, d2 = np.meshgrid(DOSES, DOSES)
+    stacked = {name: np.array([params[name] for params in PARAMETER_GRID]) for name in PARAMETER_GRID[0]}
+    E = models.MuSyC_E(d1, d2, dtype=dtype, **stacked)
+    assert E.shape == (len(PARAMETER_GRID),) + d1.shape
+    for p, params in enumerate(PARAMETER_GRID):
+        np.testing.assert_allclose(E[p], baseline_MuSyC_E(d1, d2, **params), rtol=0, atol=TOLERANCES[dtype])
+
+LOEWE_DOSES = np.concatenate([[0], np.logspace(-30, 3, 34)])
+
+@pytest.mark.parametrize("C", [0.015625, 1, 2.0**64])
+def test_loewe_log_float32_matches_float64(C):
+    d1_low, d2_low = [d.astype(np.float32) for d in np.meshgrid(LOEWE_DOSES, LOEWE_DOSES)]
+    d1, d2 = d1_low.astype(np.float64), d2_low.astype(np.float64)
+    for E1, E2, h1 in itertools.product((0.25, 1.25), (0, 0.5), (0.5, 2)):
+        hill = (1, E1, E2, h1, 0.75, C, 0.5)
+        E = models.MuSyC_E(d1_low, d2_low, 1, E1, E2, 0.25, h1, 0.75, C, 0.5, 2, 0.5, 1, 1, dtype=np.float32)
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            low, low_classes = models.loewe_log(d1_low, d2_low, E, *hill)
+        high, classes = models.loewe_log(d1, d2, E.astype(np.float64), *hill)
+        assert low.dtype == np.float32
+        np.testing.assert_array_equal(low_classes, classes)
+        finite = np.isfinite(high)
+        np.testing.assert_array_equal(np.isfinite(low), finite)
+        np.testing.assert_array_equal(low[~finite], high[~finite])
+        np.testing.assert_allclose(low[finite], high[finite], rtol=1e-5, atol=1e-5)
@@ -0,0 +1,27 @@
+import sys
+import warnings
+
+import numpy as np
+import pytest
+
+import synergy_models as models
+import synergy_power as power
+
+def test_musyc_calls_size_under_null():
+    # alpha = gamma = 1 and E3 = min(E1, E2), so neither beta nor alpha is synergistic
+    null = models.parameters_from_sliders(1, E1=0.3, E2=0.5, h1=0, h2=0, C1=0, C2=0, alpha12=0, alpha21=0,
+        gamma12=0, gamma21=0, beta=0)
+    d1, d2 = power.dose_layout(np.logspace(-2, 2, 5), np.logspace(-2, 2, 5))
+    E = power.simulate_experiments(d1, d2, null, 100, 3, power.GaussianNoise(0.05), rng=1)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", RuntimeWarning)
+        calls = power.musyc_calls(d1, d2, E, alpha=0.05)
+    for method, c in calls.items():
+        assert np.mean(c != 0) <= 0.1, method
+
+def test_t_critical_without_scipy(monkeypatch):
+    stats = pytest.importorskip("scipy.stats")
+    df = np.arange(1, 200)
+    monkeypatch.setitem(sys.modules, "scipy.stats", None)
+    for p in (0.975, 0.9875, 0.995, 0.9995):
+        np.testing.assert_allclose(power._t_critical(p, df), stats.t.ppf(p, df), rtol=1e-5)
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+import synergy_models as models
+import synergy_numba
+from synergy_demo_backend import DoseGrid, compute_surfaces, surface_graph
+
+GRID = DoseGrid.log_spaced(40)
+
+BASE = dict(E0=1, E1=0.4, E2=0.5, E3=0.4, h1=2, h2=0.5, C1=1, C2=1, alpha12=1.5, alpha21=0.7, gamma12=2, gamma21=0.5)
+
+# Each state moves a few sliders from the one before, so the graph reuses
+# some of its nodes. E approaches E0 at the lowest doses.
+STATES = [BASE, dict(BASE, E3=0.1), dict(BASE, E3=0.1, alpha12=30), dict(BASE, E1=0.9, E3=0.1, alpha12=30),
+    dict(BASE, E1=0.9, E3=0.1, alpha12=30, h1=0.3, C2=20), dict(BASE, E2=1.3, gamma21=8)]
+
+BACKENDS = [models, pytest.param(synergy_numba, marks=pytest.mark.skipif(not synergy_numba.available, reason="numba is not installed"))]
+
+def assert_same_surfaces(a, b):
+    assert sorted(a) == sorted(b)
+    for name in a:
+        assert a[name].dtype == b[name].dtype, name
+        np.testing.assert_array_equal(a[name], b[name], err_msg=name)
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_graph_matches_full_computation(backend, dtype):
+    d1, d2 = GRID.d1, GRID.d2
+    graph = surface_graph(d1, d2, dtype=dtype, backend=backend)
+    for state in STATES:
+        parameters = [state[name] for name in models.PARAMETER_NAMES]
+        incremental = compute_surfaces(d1, d2, parameters, dtype=dtype, backend=backend, graph=graph)
+        assert_same_surfaces(incremental, compute_surfaces(d1, d2, parameters, dtype=dtype, backend=backend))
+    assert graph.evaluations["E"] == len(STATES)
+    if "terms" in graph:
+        assert graph.evaluations["terms"] == 4
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_graph_matches_model_functions(dtype):
+    d1, d2 = GRID.d1.astype(dtype), GRID.d2.astype(dtype)
+    graph = surface_graph(d1, d2, dtype=dtype)
+    for state in STATES:
+        parameters = [float(state[name]) for name in models.PARAMETER_NAMES]
+        hill = parameters[:3] + parameters[4:8]
+        E = models.MuSyC_E(d1, d2, *parameters, dtype=dtype)
+        expected = dict(bliss=models.bliss(d1, d2, E, *hill), loewe=models.loewe_log(d1, d2, E, *hill)[0],
+            E=np.where(np.isnan(E), 0, E))
+        assert_same_surfaces(compute_surfaces(d1, d2, parameters, dtype=dtype, graph=graph), expected)